@@ -1,13 +1,15 @@
-import itertools as ittl
 import datetime as dt
 import numpy as np
 import pandas as pd
-import multiprocessing as mp
 from rich.progress import Progress
 from skyrim.whiterun import CCalendar, error_handler
 from skyrim.falkreath import CLib1Tab1
 from skyrim.falkreath import CManagerLibReader
-from skyrim.falkreath import CManagerLibWriter
+from engines.cross_section import sorted_weight
+from engines.rolling import rolling_means
+from store.bulk_writer import CBulkLibWriter
+from store.result_cache import run_with_cache, fingerprint_files, CResultCacheStats
+from pipeline.pool import get_worker_pool
 
 
 class CSigFromFactor(object):
@@ -16,11 +18,20 @@ class CSigFromFactor(object):
         self.m_u_size = len(self.m_universe)
         k = int(self.m_u_size / 2)
         wh = np.array([1] * k + [0] * (self.m_u_size - 2 * k) + [-1] * k)
+        self.m_wh_int = wh
         self.m_wh = wh / np.abs(wh).sum()
 
-    def convert(self, xs: pd.Series, d: dict):
-        d[xs.name] = pd.Series(data=self.m_wh, index=xs.sort_values(ascending=False).index)
-        return 0
+    def convert(self, exp_df: pd.DataFrame, t_int: bool = False) -> pd.DataFrame:
+        """
+
+        :param exp_df: index = trade_date, columns = universe
+        :param t_int: if True, m_wh_int would be used, whose values are 1, 0 and -1
+        :return: weights of each date with the same shape as exp_df, m_wh is assigned to the
+                 instruments sorted by exposure in descending order
+        """
+        wh = self.m_wh_int if t_int else self.m_wh
+        return pd.DataFrame(sorted_weight(exp_df.to_numpy(dtype=np.float64), wh, t_axis=1),
+                            index=exp_df.index, columns=exp_df.columns)
 
 
 def moving_average(df: pd.DataFrame, row: str, col: str, val: str, mov_ave_win: int):
@@ -31,14 +42,28 @@ def moving_average(df: pd.DataFrame, row: str, col: str, val: str, mov_ave_win:
 
 
 def fac_exp_MA(
-        factor: str, mov_ave_win: int,
+        factor: str, mov_ave_wins: list[int],
         run_mode: str, bgn_date: str, stp_date: str | None,
         universe: list[str],
         database_structure: dict[str, CLib1Tab1],
         factors_exposure_dir: str,
         calendar_path: str,
 ):
-    factor_ma = "{}-M{:03d}".format(factor, mov_ave_win)
+    """
+    the factor is read and converted to weights once, then moving averages of
+    all windows are calculated from one cumulative sum of the weights
+
+    :param factor:
+    :param mov_ave_wins:
+    :param run_mode:
+    :param bgn_date:
+    :param stp_date:
+    :param universe:
+    :param database_structure:
+    :param factors_exposure_dir:
+    :param calendar_path:
+    :return:
+    """
     if stp_date is None:
         stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
 
@@ -47,45 +72,63 @@ def fac_exp_MA(
     # --- load calendar
     calendar = CCalendar(calendar_path)
     iter_dates = calendar.get_iter_list(bgn_date, stp_date, True)
-    base_date = calendar.get_next_date(iter_dates[0], -mov_ave_win + 1)
+    base_date = calendar.get_next_date(iter_dates[0], -max(mov_ave_wins) + 1)
 
-    # --- init src lib
+    # --- load src lib
     factor_src_lib_structure = database_structure[factor]
     factor_src_lib = CManagerLibReader(
         t_db_name=factor_src_lib_structure.m_lib_name,
         t_db_save_dir=factors_exposure_dir
     )
     factor_src_lib.set_default(t_default_table_name=factor_src_lib_structure.m_tab.m_table_name)
-
-    # --- init dst lib
-    factor_dst_lib_structure = database_structure[factor_ma]
-    factor_dst_lib = CManagerLibWriter(
-        t_db_name=factor_dst_lib_structure.m_lib_name,
-        t_db_save_dir=factors_exposure_dir
-    )
-    factor_dst_lib.initialize_table(t_table=factor_dst_lib_structure.m_tab,
-                                    t_remove_existence=run_mode in ["O", "OVERWRITE"])
-
     src_df = factor_src_lib.read_by_conditions(t_conditions=[
         ("trade_date", ">=", base_date),
         ("trade_date", "<", stp_date),
     ], t_value_columns=["trade_date", "instrument", "value"])
+    factor_src_lib.close()
 
     exp_df_by_date = pd.pivot_table(data=src_df, values="value", index="trade_date", columns="instrument")
-    res = {}
-    exp_df_by_date[universe].apply(signal.convert, axis=1, d=res)
-    fac_sig_raw_df = pd.DataFrame.from_dict(res, orient="index")
-    mov_ave_df = fac_sig_raw_df.rolling(window=mov_ave_win).mean()
-    mov_ave_norm_df = mov_ave_df.div(mov_ave_df.abs().sum(axis=1), axis=0).fillna(0)
-    update_df = mov_ave_norm_df.loc[mov_ave_norm_df.index >= bgn_date].stack().reset_index()
-    factor_dst_lib.update(t_update_df=update_df, t_using_index=False)
-
-    # --- close libs
-    factor_src_lib.close()
-    factor_dst_lib.close()
+    # --- weights are normalized by date after moving average, so integer weights are used
+    #     to keep the cumulative sum exact, and exact zeros are kept as zeros
+    fac_sig_raw_df = signal.convert(exp_df_by_date[universe], t_int=True)
+    mov_aves = rolling_means(fac_sig_raw_df.to_numpy(dtype=np.float64), mov_ave_wins)
+
+    update_dfs = {}
+    for mov_ave_win, mov_ave in zip(mov_ave_wins, mov_aves):
+        mov_ave_df = pd.DataFrame(mov_ave, index=fac_sig_raw_df.index, columns=fac_sig_raw_df.columns)
+        mov_ave_norm_df = mov_ave_df.div(mov_ave_df.abs().sum(axis=1), axis=0).fillna(0)
+        update_dfs["{}-M{:03d}".format(factor, mov_ave_win)] = \
+            mov_ave_norm_df.loc[mov_ave_norm_df.index >= bgn_date].stack().reset_index()
+
+    # --- save
+    bulk_writer = CBulkLibWriter(database_structure, factors_exposure_dir)
+    bulk_writer.write(t_update_dfs=update_dfs, t_remove_existence=run_mode in ["O", "OVERWRITE"],
+                      t_using_index=False)
     return 0
 
 
+def run_fac_exp_MA_with_cache(
+        factor: str, mov_ave_wins: list[int],
+        run_mode: str, bgn_date: str, stp_date: str | None,
+        universe: list[str],
+        database_structure: dict[str, CLib1Tab1],
+        factors_exposure_dir: str,
+        calendar_path: str,
+        result_cache_dir: str | None,
+) -> str:
+    return run_with_cache(
+        t_cache_dir=result_cache_dir, t_task_id="fema/{}".format(factor),
+        t_inputs={"factor": factor, "mov_ave_wins": mov_ave_wins, "run_mode": run_mode,
+                  "bgn_date": bgn_date, "stp_date": stp_date, "universe": universe,
+                  "calendar": fingerprint_files([calendar_path])},
+        t_input_libs=[(database_structure[factor], factors_exposure_dir)],
+        t_outputs=[(database_structure["{}-M{:03d}".format(factor, _)], factors_exposure_dir) for _ in mov_ave_wins],
+        t_func=fac_exp_MA,
+        t_args=(factor, mov_ave_wins, run_mode, bgn_date, stp_date,
+                universe, database_structure, factors_exposure_dir, calendar_path),
+    )
+
+
 def cal_fac_exp_MA_mp(
         proc_num: int,
         factor_lbls: list[str], mov_ave_wins: list[int],
@@ -94,26 +137,35 @@ def cal_fac_exp_MA_mp(
         database_structure: dict[str, CLib1Tab1],
         factors_exposure_dir: str,
         calendar_path: str,
+        result_cache_dir: str | None = None,
 ):
     t0 = dt.datetime.now()
+    cache_stats = CResultCacheStats()
     with Progress() as pb:
-        iter_args = list(ittl.product(factor_lbls, mov_ave_wins))
-        main_task = pb.add_task(description=f"[INF] Calculating moving average of factors ...", total=len(iter_args))
-        with mp.Pool(processes=proc_num) as pool:
-            for factor_lbl, mov_ave_win in iter_args:
+        main_task = pb.add_task(description=f"[INF] Calculating moving average of factors ...", total=len(factor_lbls))
+
+        def on_done(status: str):
+            pb.update(main_task, advance=1)
+            cache_stats.update(status)
+
+        with get_worker_pool(proc_num) as pool:
+            for factor_lbl in factor_lbls:
                 pool.apply_async(
-                    fac_exp_MA,
-                    args=(factor_lbl, mov_ave_win,
+                    run_fac_exp_MA_with_cache,
+                    args=(factor_lbl, mov_ave_wins,
                           run_mode, bgn_date, stp_date,
                           universe,
                           database_structure,
                           factors_exposure_dir,
-                          calendar_path),
-                    callback=lambda _: pb.update(main_task, advance=1),
+                          calendar_path,
+                          result_cache_dir),
+                    callback=on_done,
                     error_callback=error_handler,
                 )
             pool.close()
             pool.join()
+    if result_cache_dir is not None:
+        cache_stats.report("fema")
     t1 = dt.datetime.now()
     print("... total time consuming: {:.2f} seconds".format((t1 - t0).total_seconds()))
     return 0
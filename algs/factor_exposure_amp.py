@@ -1,30 +1,25 @@
 import os
 import datetime as dt
-import itertools as ittl
-import multiprocessing as mp
 import pandas as pd
 from skyrim.whiterun import error_handler
 from skyrim.falkreath import CLib1Tab1
-from skyrim.falkreath import CManagerLibWriter, CManagerLibReader, CTable
-
-
-def cal_amp(t_sub_df: pd.DataFrame, t_x: str, t_sort_var: str, t_top_size: int):
-    _sorted_df = t_sub_df.sort_values(by=t_sort_var, ascending=False)
-    _amp_h = _sorted_df.head(t_top_size)[t_x].mean()
-    _amp_l = _sorted_df.tail(t_top_size)[t_x].mean()
-    _amp_d = _amp_h - _amp_l
-    return -_amp_h, _amp_l, -_amp_d
+from skyrim.falkreath import CTable
+from store.major_return import read_major_return
+from store.bulk_writer import CBulkLibWriter
+from engines.rolling import rolling_top_bottom_mean
+from pipeline.pool import get_worker_pool
 
 
 def fac_exp_alg_amp(
         run_mode: str, bgn_date: str, stp_date: str | None,
-        amp_window: int, lbd: float,
+        amp_window: int, lbds: list[float],
         instruments_universe: list[str],
         database_structure: dict[str, CLib1Tab1],
         by_instrument_dir: str,
         factors_exposure_dir: str,
         mapper_fut_to_idx: dict[str, str],
         equity_index_by_instrument_dir: str,
+        input_bgn_date: str | None = None,
 ):
     """
 
@@ -32,71 +27,58 @@ def fac_exp_alg_amp(
     :param bgn_date:
     :param stp_date:
     :param amp_window:
-    :param lbd:
+    :param lbds: all lbds of the window are calculated in one pass
     :param instruments_universe:
     :param database_structure:
     :param by_instrument_dir:
     :param factors_exposure_dir:
     :param mapper_fut_to_idx: {'IH.CFE': '000016.SH', 'IF.CFE': '000300.SH', 'IC.CFE': '000905.SH', 'IM.CFE': '000852.SH', None: '881001.WI'}
     :param equity_index_by_instrument_dir:
+    :param input_bgn_date: if provided, major return before this date would not be loaded
     :return:
     """
-    factor_h_lbl, factor_l_lbl, factor_d_lbl = ["AMP{}{:03d}T{:02d}".format(_, amp_window, int(lbd * 10))
-                                                for _ in ["H", "L", "D"]]
+    factor_h_lbls, factor_l_lbls, factor_d_lbls = [
+        ["AMP{}{:03d}T{:02d}".format(_, amp_window, int(lbd * 10)) for lbd in lbds] for _ in ["H", "L", "D"]]
     if stp_date is None:
         stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
-    top_size = int(amp_window * lbd) + 1
+    top_sizes = [int(amp_window * lbd) + 1 for lbd in lbds]
 
     # --- init major contracts
-    all_factor_h_dfs, all_factor_l_dfs, all_factor_d_dfs = [], [], []
+    all_factor_dfs = []
     for instrument in instruments_universe:
         equity_index_code = mapper_fut_to_idx[instrument]
         spot_data_file = "{}.csv".format(equity_index_code)
         spot_data_path = os.path.join(equity_index_by_instrument_dir, spot_data_file)
         spot_df = pd.read_csv(spot_data_path, dtype={"trade_date": str}).set_index("trade_date")
 
-        major_return_lib_reader = CManagerLibReader(by_instrument_dir, "major_return.db")
-        major_return_df = major_return_lib_reader.read(
-            t_value_columns=["trade_date", "open", "high", "low", "close"],
-            t_using_default_table=False,
-            t_table_name=instrument.replace(".", "_"),
-        ).set_index("trade_date")
+        major_return_df = read_major_return(
+            instrument, ["trade_date", "open", "high", "low", "close"], by_instrument_dir, input_bgn_date, stp_date)
 
         major_return_df["amp"] = major_return_df["high"] / major_return_df["low"] - 1
         major_return_df["spot"] = spot_df["close"]
 
-        r_h_data, r_l_data, r_d_data = {}, {}, {}
-        for i in range(len(major_return_df)):
-            trade_date = major_return_df.index[i]
-            if (trade_date < bgn_date) or (trade_date >= stp_date):
-                continue
-            sub_df = major_return_df.iloc[i - amp_window + 1:i + 1]
-            r_h_data[trade_date], r_l_data[trade_date], r_d_data[trade_date] = cal_amp(
-                t_sub_df=sub_df, t_x="amp", t_sort_var="spot", t_top_size=top_size)
-        for _iter_data, _iter_dfs, _iter_factor_lbl in zip([r_h_data, r_l_data, r_d_data],
-                                                           [all_factor_h_dfs, all_factor_l_dfs, all_factor_d_dfs],
-                                                           [factor_h_lbl, factor_l_lbl, factor_d_lbl]):
-            factor_df = pd.DataFrame({"instrument": instrument, _iter_factor_lbl: pd.Series(_iter_data)})
-            _iter_dfs.append(factor_df[["instrument", _iter_factor_lbl]])
-
-    for _iter_dfs, _iter_factor_lbl in zip([all_factor_h_dfs, all_factor_l_dfs, all_factor_d_dfs],
-                                           [factor_h_lbl, factor_l_lbl, factor_d_lbl]):
-        # --- reorganize
-        all_factor_df = pd.concat(_iter_dfs, axis=0, ignore_index=False)
-        all_factor_df.sort_index(inplace=True)
+        amp_h, amp_l = rolling_top_bottom_mean(
+            t_x=major_return_df["amp"].to_numpy(), t_sort=major_return_df["spot"].to_numpy(),
+            t_window=amp_window, t_top_sizes=top_sizes)
+        factor_df = pd.concat([
+            pd.DataFrame(data=-amp_h, index=major_return_df.index, columns=factor_h_lbls),
+            pd.DataFrame(data=amp_l, index=major_return_df.index, columns=factor_l_lbls),
+            pd.DataFrame(data=amp_l - amp_h, index=major_return_df.index, columns=factor_d_lbls),
+        ], axis=1)
+        filter_dates = (factor_df.index >= bgn_date) & (factor_df.index < stp_date)
+        factor_df = factor_df.loc[filter_dates].copy()
+        factor_df["instrument"] = instrument
+        all_factor_dfs.append(factor_df)
 
-        # --- save
-        factor_lib_structure = database_structure[_iter_factor_lbl]
-        factor_lib = CManagerLibWriter(
-            t_db_name=factor_lib_structure.m_lib_name,
-            t_db_save_dir=factors_exposure_dir
-        )
-        factor_lib.initialize_table(t_table=factor_lib_structure.m_tab,
-                                    t_remove_existence=run_mode in ["O", "OVERWRITE"])
-        factor_lib.update(t_update_df=all_factor_df, t_using_index=True)
-        factor_lib.close()
+    # --- reorganize
+    all_factor_df = pd.concat(all_factor_dfs, axis=0, ignore_index=False)
+    all_factor_df.sort_index(inplace=True)
 
-        print("... @ {} factor = {:>12s} calculated".format(dt.datetime.now(), _iter_factor_lbl))
+    # --- save
+    bulk_writer = CBulkLibWriter(database_structure, factors_exposure_dir)
+    bulk_writer.write(t_update_dfs={factor_lbl: all_factor_df[["instrument", factor_lbl]]
+                                    for factor_lbl in factor_h_lbls + factor_l_lbls + factor_d_lbls},
+                      t_remove_existence=run_mode in ["O", "OVERWRITE"])
     return 0
 
 
@@ -108,19 +90,21 @@ def cal_fac_exp_amp_mp(proc_num: int,
                        by_instrument_dir: str,
                        factors_exposure_dir: str,
                        mapper_fut_to_idx: dict[str, str],
-                       equity_index_by_instrument_dir: str):
+                       equity_index_by_instrument_dir: str,
+                       input_bgn_date: str | None = None):
     t0 = dt.datetime.now()
-    pool = mp.Pool(processes=proc_num)
-    for p_window, lbd in ittl.product(amp_windows, lbds):
+    pool = get_worker_pool(proc_num)
+    for p_window in amp_windows:
         pool.apply_async(fac_exp_alg_amp,
                          args=(run_mode, bgn_date, stp_date,
-                               p_window, lbd,
+                               p_window, lbds,
                                instruments_universe,
                                database_structure,
                                by_instrument_dir,
                                factors_exposure_dir,
                                mapper_fut_to_idx,
-                               equity_index_by_instrument_dir),
+                               equity_index_by_instrument_dir,
+                               input_bgn_date),
                          error_callback=error_handler,
                          )
     pool.close()
@@ -1,12 +1,13 @@
 import os
 import datetime as dt
 import pandas as pd
-import multiprocessing as mp
 from rich.progress import track
 from skyrim.whiterun import CCalendar, error_handler
 from skyrim.falkreath import CLib1Tab1
 from skyrim.falkreath import CManagerLibReader
 from skyrim.falkreath import CManagerLibWriter
+from store.major_return import read_major_return
+from pipeline.pool import get_worker_pool
 
 
 def fac_exp_alg_basis(
@@ -36,12 +37,9 @@ def fac_exp_alg_basis(
     # --- init major contracts
     all_factor_dfs = []
     for instrument in track(instruments_universe):
-        major_return_lib_reader = CManagerLibReader(by_instrument_dir, "major_return.db")
-        major_return_df = major_return_lib_reader.read(
-            t_value_columns=["trade_date", "n_contract", "close"],
-            t_using_default_table=False,
-            t_table_name=instrument.replace(".", "_"),
-        ).set_index("trade_date")
+        major_return_df = read_major_return(
+            instrument, ["trade_date", "n_contract", "close"],
+            by_instrument_dir, base_date, stp_date)
         filter_dates = (major_return_df.index >= base_date) & (major_return_df.index < stp_date)
         selected_major_return_df = major_return_df.loc[filter_dates, ["n_contract", "close"]].round(2)
 
@@ -169,7 +167,7 @@ def cal_fac_exp_basis_mp(proc_num: int,
                       by_instrument_dir,
                       equity_index_by_instrument_dir,
                       factors_exposure_dir)
-    pool = mp.Pool(processes=proc_num)
+    pool = get_worker_pool(proc_num)
     for p_window in basis_windows:
         pool.apply_async(fac_exp_alg_basis_ma_and_diff,
                          args=(run_mode, bgn_date, stp_date, p_window,
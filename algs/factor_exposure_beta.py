@@ -1,12 +1,13 @@
 import os
 import datetime as dt
-import multiprocessing as mp
 import pandas as pd
 from rich.progress import track
 from skyrim.falkreath import CLib1Tab1
 from skyrim.falkreath import CManagerLibReader
 from skyrim.falkreath import CManagerLibWriter
 from skyrim.whiterun import CCalendar, error_handler
+from store.major_return import read_major_return
+from pipeline.pool import get_worker_pool
 
 
 def fac_exp_alg_beta(
@@ -34,12 +35,9 @@ def fac_exp_alg_beta(
     # --- init major contracts
     all_factor_dfs = []
     for instrument in track(instruments_universe):
-        major_return_lib_reader = CManagerLibReader(by_instrument_dir, "major_return.db")
-        major_return_df = major_return_lib_reader.read(
-            t_value_columns=["trade_date", "major_return"],
-            t_using_default_table=False,
-            t_table_name=instrument.replace(".", "_"),
-        ).set_index("trade_date")
+        major_return_df = read_major_return(
+            instrument, ["trade_date", "major_return"],
+            by_instrument_dir, base_date, stp_date)
         filter_dates = (major_return_df.index >= base_date) & (major_return_df.index < stp_date)
         factor_df = major_return_df.loc[filter_dates, ["major_return"]].copy()
         factor_df["market"] = (market_index_df["close"] / market_index_df["pre_close"] - 1) * 100
@@ -142,7 +140,7 @@ def cal_fac_exp_beta_mp(proc_num: int,
                         factors_exposure_dir: str,
                         calendar_path: str):
     t0 = dt.datetime.now()
-    pool = mp.Pool(processes=proc_num)
+    pool = get_worker_pool(proc_num)
     for p_window in beta_windows:
         pool.apply_async(fac_exp_alg_beta,
                          args=(run_mode, bgn_date, stp_date, p_window,
@@ -156,7 +154,7 @@ def cal_fac_exp_beta_mp(proc_num: int,
                          )
     pool.close()
     pool.join()
-    pool = mp.Pool(processes=proc_num)
+    pool = get_worker_pool(proc_num)
     for p_window in beta_windows[1:]:
         pool.apply_async(fac_exp_alg_beta_diff,
                          args=(run_mode, bgn_date, stp_date, p_window, beta_windows[0],
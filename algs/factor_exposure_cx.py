@@ -1,27 +1,50 @@
 import datetime as dt
-import itertools as ittl
-import multiprocessing as mp
 import sys
 import pandas as pd
-from rich.progress import track
 from skyrim.whiterun import error_handler
 from skyrim.falkreath import CLib1Tab1
-from skyrim.falkreath import CManagerLibWriter, CManagerLibReader
+from store.major_return import read_major_return
+from store.bulk_writer import CBulkLibWriter
+from engines.rolling import rolling_top_spearman
+from pipeline.pool import get_worker_pool
 
+cx_vars = {
+    "CSP": ("sigma", "instru_idx"),
+    "CSR": ("sigma", "major_return"),
+    "CTP": ("turnover", "instru_idx"),
+    "CTR": ("turnover", "major_return"),
+    "CVP": ("volume", "instru_idx"),
+    "CVR": ("volume", "major_return"),
+}
 
-def cal_corr(t_sub_df: pd.DataFrame, t_x: str, t_y: str, t_sort_var: str, t_top_size: int):
-    _sorted_df = t_sub_df.sort_values(by=t_sort_var, ascending=False)
-    _top_df = _sorted_df.head(t_top_size)
-    _r = _top_df[[t_x, t_y]].corr(method="spearman").at[t_x, t_y]
-    return -_r
+
+def load_cx_inputs(instruments_universe: list[str], by_instrument_dir: str,
+                   input_bgn_date: str | None, stp_date: str) -> dict[str, pd.DataFrame]:
+    """
+
+    :param instruments_universe:
+    :param by_instrument_dir:
+    :param input_bgn_date: if provided, major return before this date would not be loaded
+    :param stp_date:
+    :return: {instrument: DataFrame with index = trade_date,
+              columns = ["sigma", "turnover", "volume", "instru_idx", "major_return"]}
+    """
+    cx_inputs = {}
+    for instrument in instruments_universe:
+        major_return_df = read_major_return(
+            instrument, ["trade_date", "major_return", "high", "low", "volume", "oi", "instru_idx"],
+            by_instrument_dir, input_bgn_date, stp_date)
+        major_return_df["sigma"] = major_return_df["high"] / major_return_df["low"] - 1
+        major_return_df["turnover"] = major_return_df["volume"] / major_return_df["oi"]
+        cx_inputs[instrument] = major_return_df[["sigma", "turnover", "volume", "instru_idx", "major_return"]]
+    return cx_inputs
 
 
 def fac_exp_alg_cx(
-        run_mode: str, bgn_date: str, stp_date: str | None,
-        cx: str, cx_window: int, top_prop: float,
-        instruments_universe: list[str],
+        run_mode: str, bgn_date: str, stp_date: str,
+        cx: str, cx_window: int, top_props: list[float],
+        cx_inputs: dict[str, pd.DataFrame],
         database_structure: dict[str, CLib1Tab1],
-        by_instrument_dir: str,
         factors_exposure_dir: str,
 ):
     """
@@ -31,69 +54,38 @@ def fac_exp_alg_cx(
     :param stp_date:
     :param cx: must be one of ["CSP", "CSR", "CTP", "CTR", "CVP", "CVR"]
     :param cx_window:
-    :param top_prop:
-    :param instruments_universe:
+    :param top_props: all top_props of the window are calculated in one pass
+    :param cx_inputs: {instrument: DataFrame with index = trade_date, columns = [x, y, "volume"] of this cx}
     :param database_structure:
-    :param by_instrument_dir:
     :param factors_exposure_dir:
     :return:
     """
-    factor_lbl = "{}{:03d}T{:02d}".format(cx, cx_window, int(top_prop * 10))
-    if stp_date is None:
-        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
-    top_size = int(cx_window * top_prop) + 1
-    x, y = {
-        "CSP": ("sigma", "instru_idx"),
-        "CSR": ("sigma", "major_return"),
-        "CTP": ("turnover", "instru_idx"),
-        "CTR": ("turnover", "major_return"),
-        "CVP": ("volume", "instru_idx"),
-        "CVR": ("volume", "major_return"),
-    }.get(cx.upper(), (None, None))
-    if (x, y) == (None, None):
-        print("... Error! when calculating CX")
-        print("... cx = ", cx, "is not a legal input, please check again")
-        print("... this function will terminate at once")
-        sys.exit()
+    factor_lbls = ["{}{:03d}T{:02d}".format(cx, cx_window, int(top_prop * 10)) for top_prop in top_props]
+    top_sizes = [int(cx_window * top_prop) + 1 for top_prop in top_props]
+    x, y = cx_vars[cx.upper()]
 
     # --- init major contracts
     all_factor_dfs = []
-    for instrument in track(instruments_universe):
-        major_return_lib_reader = CManagerLibReader(by_instrument_dir, "major_return.db")
-        major_return_df = major_return_lib_reader.read(
-            t_value_columns=["trade_date", "major_return", "high", "low", "volume", "oi", "instru_idx"],
-            t_using_default_table=False,
-            t_table_name=instrument.replace(".", "_"),
-        ).set_index("trade_date")
-        if cx.upper() in ["CSP", "CSR"]:
-            major_return_df[x] = major_return_df["high"] / major_return_df["low"] - 1
-        elif cx.upper() in ["CTP", "CTR"]:
-            major_return_df[x] = major_return_df["volume"] / major_return_df["oi"]
-        r_data = {}
-        for i in range(len(major_return_df)):
-            trade_date = major_return_df.index[i]
-            if (trade_date < bgn_date) or (trade_date >= stp_date):
-                continue
-            sub_df = major_return_df.iloc[i - cx_window + 1:i + 1]
-            r_data[trade_date] = cal_corr(t_sub_df=sub_df, t_x=x, t_y=y, t_sort_var="volume", t_top_size=top_size)
-        factor_df = pd.DataFrame({"instrument": instrument, factor_lbl: pd.Series(r_data)})
-        all_factor_dfs.append(factor_df[["instrument", factor_lbl]])
+    for instrument, input_df in cx_inputs.items():
+        r = -rolling_top_spearman(
+            t_x=input_df[x].to_numpy(), t_y=input_df[y].to_numpy(),
+            t_sort=input_df["volume"].to_numpy(),
+            t_window=cx_window, t_top_sizes=top_sizes)
+        factor_df = pd.DataFrame(data=r, index=input_df.index, columns=factor_lbls)
+        filter_dates = (factor_df.index >= bgn_date) & (factor_df.index < stp_date)
+        factor_df = factor_df.loc[filter_dates].copy()
+        factor_df["instrument"] = instrument
+        all_factor_dfs.append(factor_df)
 
     # --- reorganize
     all_factor_df = pd.concat(all_factor_dfs, axis=0, ignore_index=False)
     all_factor_df.sort_index(inplace=True)
 
     # --- save
-    factor_lib_structure = database_structure[factor_lbl]
-    factor_lib = CManagerLibWriter(
-        t_db_name=factor_lib_structure.m_lib_name,
-        t_db_save_dir=factors_exposure_dir
-    )
-    factor_lib.initialize_table(t_table=factor_lib_structure.m_tab, t_remove_existence=run_mode in ["O", "OVERWRITE"])
-    factor_lib.update(t_update_df=all_factor_df, t_using_index=True)
-    factor_lib.close()
-
-    print("... @ {} factor = {:>12s} calculated".format(dt.datetime.now(), factor_lbl))
+    bulk_writer = CBulkLibWriter(database_structure, factors_exposure_dir)
+    bulk_writer.write(t_update_dfs={factor_lbl: all_factor_df[["instrument", factor_lbl]]
+                                    for factor_lbl in factor_lbls},
+                      t_remove_existence=run_mode in ["O", "OVERWRITE"])
     return 0
 
 
@@ -103,17 +95,30 @@ def cal_fac_exp_cx_mp(proc_num: int,
                       instruments_universe: list[str],
                       database_structure: dict,
                       by_instrument_dir: str,
-                      factors_exposure_dir: str):
+                      factors_exposure_dir: str,
+                      input_bgn_date: str | None = None):
     t0 = dt.datetime.now()
-    pool = mp.Pool(processes=proc_num)
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+    for cx in mgr_cx_windows:
+        if cx.upper() not in cx_vars:
+            print("... Error! when calculating CX")
+            print("... cx = ", cx, "is not a legal input, please check again")
+            print("... this function will terminate at once")
+            sys.exit()
+
+    # --- load major return once, workers only receive the columns they need
+    cx_inputs = load_cx_inputs(instruments_universe, by_instrument_dir, input_bgn_date, stp_date)
+    pool = get_worker_pool(proc_num)
     for cx, cx_windows in mgr_cx_windows.items():
-        for cx_window, top_prop in ittl.product(cx_windows, top_props):
+        cx_input_cols = list(dict.fromkeys(cx_vars[cx.upper()] + ("volume",)))
+        cx_sub_inputs = {k: v[cx_input_cols] for k, v in cx_inputs.items()}
+        for cx_window in cx_windows:
             pool.apply_async(fac_exp_alg_cx,
                              args=(run_mode, bgn_date, stp_date,
-                                   cx, cx_window, top_prop,
-                                   instruments_universe,
+                                   cx, cx_window, top_props,
+                                   cx_sub_inputs,
                                    database_structure,
-                                   by_instrument_dir,
                                    factors_exposure_dir),
                              error_callback=error_handler,
                              )
@@ -1,24 +1,24 @@
 import datetime as dt
-import multiprocessing as mp
 import numpy as np
 import pandas as pd
 from rich.progress import track
 from skyrim.whiterun import CCalendar, error_handler
 from skyrim.falkreath import CLib1Tab1
-from skyrim.falkreath import CManagerLibReader
-from skyrim.falkreath import CManagerLibWriter
+from store.minute_bars import CMinuteBarsReader
+from store.bulk_writer import CBulkLibWriter
+from pipeline.pool import get_worker_pool
 
 
-def find_extreme_return(t_df: pd.DataFrame, t_ret: str, t_drifts: list[int]):
-    ret_min, ret_max, ret_median = t_df[t_ret].min(), t_df[t_ret].max(), t_df[t_ret].median()
+def find_extreme_return(t_ret: np.ndarray, t_drifts: list[int]):
+    ret_min, ret_max, ret_median = np.nanmin(t_ret), np.nanmax(t_ret), np.nanmedian(t_ret)
     if (ret_max + ret_min) > (2 * ret_median):
-        idx_exr, exr = t_df[t_ret].argmax(), -ret_max
+        idx_exr, exr = np.nanargmax(t_ret), -ret_max
     else:
-        idx_exr, exr = t_df[t_ret].argmin(), -ret_min
+        idx_exr, exr = np.nanargmin(t_ret), -ret_min
     dxrs = []
     for drift in t_drifts:
         idx_dxr = idx_exr - drift
-        dxr = -t_df[t_ret].iloc[idx_dxr] if idx_dxr >= 0 else exr
+        dxr = -t_ret[idx_dxr] if idx_dxr >= 0 else exr
         dxrs.append(dxr)
     return exr, dxrs
 
@@ -41,13 +41,8 @@ def fac_exp_alg_exr(
     # --- load calendar
     calendar = CCalendar(calendar_path)
 
-    # --- init em01_major reader
-    em01_major_lib_structure = database_structure["em01_major"]  # make sure it has the columns as em01_lib
-    em01_major_lib = CManagerLibReader(
-        t_db_name=em01_major_lib_structure.m_lib_name,
-        t_db_save_dir=intermediary_dir
-    )
-    em01_major_lib.set_default(t_default_table_name=em01_major_lib_structure.m_tab.m_table_name)
+    # --- init minute bars reader
+    minute_bars = CMinuteBarsReader(intermediary_dir)
 
     # ---
     iter_dates = calendar.get_iter_list(bgn_date, stp_date, True)
@@ -56,16 +51,16 @@ def fac_exp_alg_exr(
     # --- init major contracts
     all_factor_dfs = []
     for instrument in track(instruments_universe):
-        em01_df = em01_major_lib.read_by_conditions(
-            t_conditions=[
-                ("trade_date", ">=", base_date),
-                ("trade_date", "<", stp_date),
-                ("instrument", "=", instrument.split(".")[0]),
-            ], t_value_columns=["trade_date", "timestamp", "loc_id", "volume", "amount", "close", "preclose"]
-        )
-        em01_df[["close", "preclose"]] = em01_df[["close", "preclose"]].round(2)
-        em01_df["m01_return_cls"] = (em01_df["close"] / em01_df["preclose"] - 1).replace(np.inf, 0)
-        res_srs = em01_df.groupby(by="trade_date").apply(find_extreme_return, t_ret="m01_return_cls", t_drifts=drifts)
+        trade_dates, day_offsets, bars = minute_bars.get_days(
+            instrument.split(".")[0], base_date, stp_date, ["close", "preclose"])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            close, preclose = [np.round(bars[_].astype(np.float64), 2) for _ in ["close", "preclose"]]
+            m01_return_cls = close / preclose - 1
+        m01_return_cls[np.isposinf(m01_return_cls)] = 0
+        res_srs = pd.Series(
+            data=[find_extreme_return(m01_return_cls[lo:hi], t_drifts=drifts)
+                  for lo, hi in zip(day_offsets[:-1], day_offsets[1:])],
+            index=pd.Index(trade_dates, name="trade_date"), dtype=object)
         exr_srs, dxrs_srs = zip(*res_srs)
         exr_dxr_df = pd.DataFrame({
             "exr": exr_srs,
@@ -84,23 +79,18 @@ def fac_exp_alg_exr(
     }
     exr_d_dfs = {drift: (exr_df + dxr_d_dfs[drift] * np.sqrt(2)) * 0.5 for drift in drifts}
 
+    all_factor_dfs = {}
     for factor_lbl, factor_df in zip(
             [factor_exr_lbl] + factor_dxr_d_lbls + factor_exr_d_lbls,
             [exr_df] + list(dxr_d_dfs.values()) + list(exr_d_dfs.values())
     ):
         df: pd.DataFrame = factor_df[factor_df.index >= bgn_date]
-        all_factor_df = df.stack().reset_index(level=1).sort_index(ascending=True)
-        # --- save
-        factor_lib_structure = database_structure[factor_lbl]
-        factor_lib = CManagerLibWriter(
-            t_db_name=factor_lib_structure.m_lib_name,
-            t_db_save_dir=factors_exposure_dir
-        )
-        factor_lib.initialize_table(t_table=factor_lib_structure.m_tab, t_remove_existence=run_mode in ["O", "OVERWRITE"])
-        factor_lib.update(t_update_df=all_factor_df, t_using_index=True)
-        factor_lib.close()
+        all_factor_dfs[factor_lbl] = df.stack().reset_index(level=1).sort_index(ascending=True)
+
+    # --- save
+    bulk_writer = CBulkLibWriter(database_structure, factors_exposure_dir)
+    bulk_writer.write(t_update_dfs=all_factor_dfs, t_remove_existence=run_mode in ["O", "OVERWRITE"])
 
-    em01_major_lib.close()
     print("... @ {} factor = {:>12s} calculated".format(dt.datetime.now(), factor_exr_lbl))
     return 0
 
@@ -114,7 +104,7 @@ def cal_fac_exp_exr_mp(proc_num: int,
                        intermediary_dir: str,
                        calendar_path: str):
     t0 = dt.datetime.now()
-    pool = mp.Pool(processes=proc_num)
+    pool = get_worker_pool(proc_num)
     for p_window in exr_windows:
         pool.apply_async(fac_exp_alg_exr,
                          args=(run_mode, bgn_date, stp_date,
@@ -0,0 +1,143 @@
+import os
+import shutil
+import sqlite3
+import datetime as dt
+import numpy as np
+import pandas as pd
+from skyrim.falkreath import CLib1Tab1
+from skyrim.falkreath import CManagerLibReader
+from skyrim.whiterun import CCalendar
+from store.bulk_writer import CBulkLibWriter
+
+
+def get_lib_last_date(lib_structure: CLib1Tab1, lib_save_dir: str) -> str | None:
+    """
+
+    :param lib_structure:
+    :param lib_save_dir:
+    :return: the last trade date saved in the library, None if the library is not found or empty
+    """
+    lib_path = os.path.join(lib_save_dir, lib_structure.m_lib_name)
+    if not os.path.exists(lib_path):
+        return None
+    with sqlite3.connect(lib_path) as connection:
+        try:
+            res = connection.execute("SELECT MAX(trade_date) FROM {}".format(lib_structure.m_tab.m_table_name))
+            last_date = res.fetchone()[0]
+        except sqlite3.OperationalError:
+            last_date = None
+    connection.close()
+    return last_date
+
+
+class CFacExpIncremental(object):
+    def __init__(self, t_family: str, t_factor_lbls: list[str], t_max_window: int, t_stp_date: str | None,
+                 t_database_structure: dict[str, CLib1Tab1],
+                 t_factors_exposure_dir: str, t_scratch_dir: str, t_calendar_path: str):
+        """
+
+        :param t_family: like "amp", "cx"
+        :param t_factor_lbls: all factors calculated by the family, like fac_sub_grp_amp
+        :param t_max_window: max window of the family, the family would be calculated from
+                             t_max_window days before the first new date to fill derived factors,
+                             and exposures in this overlap are used to verify the stored ones
+        :param t_stp_date: not included, if None, it would be the day after today
+        :param t_database_structure:
+        :param t_factors_exposure_dir:
+        :param t_scratch_dir: the family would be calculated into this directory before appended
+        :param t_calendar_path:
+        """
+        self.m_family = t_family
+        self.m_factor_lbls = t_factor_lbls
+        self.m_max_window = t_max_window
+        if t_stp_date is None:
+            t_stp_date = (dt.datetime.now() + dt.timedelta(days=1)).strftime("%Y%m%d")
+        self.m_stp_date = t_stp_date
+        self.m_database_structure = t_database_structure
+        self.m_factors_exposure_dir = t_factors_exposure_dir
+        self.m_scratch_dir = t_scratch_dir
+        self.m_calendar = CCalendar(t_calendar_path)
+
+        self.m_last_dates: dict[str, str] = {}  # last stored date of each factor
+        self.m_new_bgn_date: str = ""  # first date to be appended
+        self.m_bgn_date: str = ""  # first date to be calculated in scratch directory
+        self.m_input_bgn_date: str = ""  # first date of inputs to be loaded
+
+    def prepare(self) -> bool:
+        """
+
+        :return: False if there is nothing to update
+        """
+        last_dates = [get_lib_last_date(self.m_database_structure[_], self.m_factors_exposure_dir)
+                      for _ in self.m_factor_lbls]
+        if None in last_dates:
+            print("... Warning! some factors of {} are not found in {}".format(
+                self.m_family, self.m_factors_exposure_dir))
+            print("... please calculate them with run mode = 'o' before incremental update")
+            return False
+
+        self.m_last_dates = dict(zip(self.m_factor_lbls, last_dates))
+        last_date = min(last_dates)
+        new_dates = [_ for _ in self.m_calendar.get_iter_list(last_date, self.m_stp_date, True) if _ > last_date]
+        if not new_dates:
+            print("... @ {} factors of {} are up to date, last date = {}".format(
+                dt.datetime.now(), self.m_family, last_date))
+            return False
+
+        self.m_new_bgn_date = new_dates[0]
+        self.m_bgn_date = self.m_calendar.get_next_date(self.m_new_bgn_date, -self.m_max_window)
+        self.m_input_bgn_date = self.m_calendar.get_next_date(self.m_bgn_date, -self.m_max_window)
+        if os.path.exists(self.m_scratch_dir):
+            shutil.rmtree(self.m_scratch_dir)
+        os.makedirs(self.m_scratch_dir)
+        print("... @ {} factors of {} would be updated from {} to {}, overlap begins at {}".format(
+            dt.datetime.now(), self.m_family, self.m_new_bgn_date, self.m_stp_date, self.m_bgn_date))
+        return True
+
+    def _read(self, t_factor_lbl: str, t_save_dir: str, t_bgn_date: str, t_stp_date: str) -> pd.DataFrame:
+        factor_lib_structure = self.m_database_structure[t_factor_lbl]
+        factor_lib = CManagerLibReader(t_db_name=factor_lib_structure.m_lib_name, t_db_save_dir=t_save_dir)
+        factor_lib.set_default(factor_lib_structure.m_tab.m_table_name)
+        factor_df = factor_lib.read_by_conditions(t_conditions=[
+            ("trade_date", ">=", t_bgn_date),
+            ("trade_date", "<", t_stp_date),
+        ], t_value_columns=["trade_date", "instrument", "value"])
+        factor_lib.close()
+        return factor_df
+
+    def verify_and_append(self):
+        """
+        new values in the overlap are verified against the stored ones before anything is appended,
+        NaN on both sides are equal, and NaN on one side only is a mismatch. If any factor mismatches,
+        nothing would be appended and the scratch directory is kept for inspection
+
+        :return:
+        """
+        append_dfs, mismatch_msgs = {}, []
+        for factor_lbl in self.m_factor_lbls:
+            new_df = self._read(factor_lbl, self.m_scratch_dir, self.m_bgn_date, self.m_stp_date)
+
+            # --- verify overlap
+            old_df = self._read(factor_lbl, self.m_factors_exposure_dir, self.m_bgn_date, self.m_stp_date)
+            overlap_df = pd.merge(left=old_df, right=new_df, on=["trade_date", "instrument"],
+                                  how="inner", suffixes=("_old", "_new"))
+            mismatch = ~np.isclose(overlap_df["value_old"].to_numpy(dtype=np.float64),
+                                   overlap_df["value_new"].to_numpy(dtype=np.float64), equal_nan=True)
+            if mismatch.any():
+                mismatch_msgs.append("{}: {} of {} overlapping values, first at {}".format(
+                    factor_lbl, mismatch.sum(), len(overlap_df), overlap_df.loc[mismatch, "trade_date"].min()))
+
+            # --- append
+            append_dfs[factor_lbl] = new_df.loc[new_df["trade_date"] > self.m_last_dates[factor_lbl]].set_index(
+                "trade_date")
+        if mismatch_msgs:
+            raise ValueError(
+                "... new values of {} factors of {} mismatch the stored ones, nothing is appended, calculated "
+                "values are kept in {}, please check them or recalculate with run mode = 'o':\n    {}".format(
+                    len(mismatch_msgs), self.m_family, self.m_scratch_dir, "\n    ".join(mismatch_msgs)))
+        bulk_writer = CBulkLibWriter(self.m_database_structure, self.m_factors_exposure_dir)
+        bulk_writer.write(t_update_dfs=append_dfs, t_remove_existence=False)
+        print("... @ {} {} factors of {} appended from {}".format(
+            dt.datetime.now(), len(self.m_factor_lbls), self.m_family, self.m_new_bgn_date))
+        shutil.rmtree(self.m_scratch_dir)
+        return 0
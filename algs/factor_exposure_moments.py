@@ -0,0 +1,106 @@
+import datetime as dt
+import pandas as pd
+from rich.progress import track
+from skyrim.falkreath import CLib1Tab1
+from store.major_return import read_major_return
+from store.bulk_writer import CBulkLibWriter
+from engines.moments import rolling_mean, rolling_std, rolling_skew
+
+
+def cal_moments_factors(major_return_df: pd.DataFrame, mgr_windows: dict[str, list[int]],
+                        money_scale: int) -> pd.DataFrame:
+    """
+
+    :param major_return_df: index = trade_date,
+                            columns = ["major_return", "instru_idx", "high", "low", "volume", "oi", "amount"]
+    :param mgr_windows: {family: windows}, family must be in ["amt", "mtm", "rng", "sgm", "size", "skew", "to"]
+    :param money_scale:
+    :return: a DataFrame with index = trade_date, columns = factors of all families
+    """
+    factor_data = {}
+    std_windows = sorted(set(mgr_windows.get("sgm", []) + mgr_windows.get("mtm", [])))
+    ret_std = dict(zip(std_windows, rolling_std(major_return_df["major_return"].to_numpy(), std_windows).T))
+    for family, windows in mgr_windows.items():
+        if family == "amt":
+            r = rolling_mean(major_return_df["amount"].to_numpy(), windows) / money_scale
+            factor_data.update({"AMT{:03d}".format(w): r[:, j] for j, w in enumerate(windows)})
+        elif family == "mtm":
+            instru_idx = major_return_df["instru_idx"]
+            for w in windows:
+                mtm = (instru_idx / instru_idx.shift(w) - 1).to_numpy()
+                factor_data["MTM{:03d}".format(w)] = mtm
+                factor_data["MTM{:03d}ADJ".format(w)] = mtm / ret_std[w] * (252 ** 0.5)
+        elif family == "rng":
+            r = rolling_mean((major_return_df["high"] / major_return_df["low"] - 1).to_numpy(), windows)
+            factor_data.update({"RNG{:03d}".format(w): r[:, j] for j, w in enumerate(windows)})
+        elif family == "sgm":
+            factor_data.update({"SGM{:03d}".format(w): ret_std[w] * (252 ** 0.5) for w in windows})
+        elif family == "size":
+            x = major_return_df["oi"] * major_return_df["amount"] / major_return_df["volume"]
+            r = rolling_mean(x.to_numpy(), windows)
+            factor_data.update({"SIZE{:03d}".format(w): r[:, j] for j, w in enumerate(windows)})
+        elif family == "skew":
+            r = rolling_skew(major_return_df["major_return"].to_numpy(), windows)
+            factor_data.update({"SKEW{:03d}".format(w): r[:, j] for j, w in enumerate(windows)})
+        elif family == "to":
+            r = rolling_mean((major_return_df["volume"] / major_return_df["oi"]).to_numpy(), windows)
+            factor_data.update({"TO{:03d}".format(w): r[:, j] for j, w in enumerate(windows)})
+    return pd.DataFrame(factor_data, index=major_return_df.index)
+
+
+def cal_fac_exp_moments(
+        run_mode: str, bgn_date: str, stp_date: str | None,
+        mgr_windows: dict[str, list[int]],
+        instruments_universe: list[str],
+        database_structure: dict[str, CLib1Tab1],
+        by_instrument_dir: str,
+        factors_exposure_dir: str,
+        money_scale: int,
+        input_bgn_date: str | None = None,
+):
+    """
+    factors of all windows of the families in mgr_windows are calculated in one process,
+    with one read of major return of each instrument
+
+    :param run_mode:
+    :param bgn_date:
+    :param stp_date:
+    :param mgr_windows: {family: windows}, family must be in ["amt", "mtm", "rng", "sgm", "size", "skew", "to"]
+    :param instruments_universe:
+    :param database_structure:
+    :param by_instrument_dir:
+    :param factors_exposure_dir:
+    :param money_scale:
+    :param input_bgn_date: if provided, major return before this date would not be loaded
+    :return:
+    """
+    t0 = dt.datetime.now()
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+
+    # --- init major contracts
+    all_factor_dfs = []
+    for instrument in track(instruments_universe):
+        major_return_df = read_major_return(
+            instrument, ["trade_date", "major_return", "instru_idx", "high", "low", "volume", "oi", "amount"],
+            by_instrument_dir, input_bgn_date, stp_date)
+        factor_df = cal_moments_factors(major_return_df, mgr_windows, money_scale)
+        filter_dates = (factor_df.index >= bgn_date) & (factor_df.index < stp_date)
+        factor_df = factor_df.loc[filter_dates].copy()
+        factor_df["instrument"] = instrument
+        all_factor_dfs.append(factor_df)
+
+    # --- reorganize
+    all_factor_df = pd.concat(all_factor_dfs, axis=0, ignore_index=False)
+    all_factor_df.sort_index(inplace=True)
+
+    # --- save
+    bulk_writer = CBulkLibWriter(database_structure, factors_exposure_dir)
+    bulk_writer.write(t_update_dfs={factor_lbl: all_factor_df[["instrument", factor_lbl]]
+                                    for factor_lbl in all_factor_df.columns.drop("instrument")},
+                      t_remove_existence=run_mode in ["O", "OVERWRITE"])
+
+    t1 = dt.datetime.now()
+    print("... @ {} {} factors of moments calculated".format(dt.datetime.now(), len(all_factor_df.columns) - 1))
+    print("... total time consuming: {:.2f} seconds".format((t1 - t0).total_seconds()))
+    return 0
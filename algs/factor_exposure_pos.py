@@ -1,11 +1,12 @@
 import datetime as dt
-import multiprocessing as mp
 import pandas as pd
 from rich.progress import track
 from skyrim.whiterun import CCalendar, error_handler
 from skyrim.falkreath import CLib1Tab1
 from skyrim.falkreath import CManagerLibReader
-from skyrim.falkreath import CManagerLibWriter
+from store.bulk_writer import CBulkLibWriter
+from store.test_return_cache import CTestReturnCache
+from pipeline.pool import get_worker_pool
 
 
 def drop_values_from_series(s: pd.Series, v: float | str = 0):
@@ -21,6 +22,7 @@ def fac_exp_alg_pos(
         test_returns_dir: str,
         intermediary_dir: str,
         calendar_path: str,
+        test_return_cache: CTestReturnCache | None = None,
 ):
     factor_hl_lbl, factor_hs_lbl = ["POSH{}Q{:02d}".format(d, top_player_qty) for d in list("LS")]
     factor_dl_lbl, factor_ds_lbl = ["POSD{}Q{:02d}".format(d, top_player_qty) for d in list("LS")]
@@ -33,12 +35,6 @@ def fac_exp_alg_pos(
     base_date = calendar.get_next_date(iter_dates[0], -1)
     model_iter_dates = calendar.get_iter_list(base_date, iter_dates[-1], True)
 
-    # --- load test return
-    test_return_lib_id = "test_return_c"
-    test_return_lib_struct = database_structure[test_return_lib_id]
-    test_return_lib = CManagerLibReader(t_db_name=test_return_lib_struct.m_lib_name, t_db_save_dir=test_returns_dir)
-    test_return_lib.set_default(t_default_table_name=test_return_lib_struct.m_tab.m_table_name)
-
     # --- load hold pos
     hld_pos_lib_structure = database_structure["hld_pos"]
     hld_pos_lib = CManagerLibReader(t_db_name=hld_pos_lib_structure.m_lib_name, t_db_save_dir=intermediary_dir)
@@ -50,10 +46,19 @@ def fac_exp_alg_pos(
     dlt_pos_lib.set_default(t_default_table_name=dlt_pos_lib_structure.m_tab.m_table_name)
 
     # --- load test return
-    test_return_df = test_return_lib.read_by_conditions(t_conditions=[
-        ("trade_date", ">=", bgn_date),
-        ("trade_date", "<", stp_date),
-    ], t_value_columns=["trade_date", "instrument", "value"]).set_index(["trade_date", "instrument"])
+    if test_return_cache is not None:
+        test_return_df = test_return_cache.get_frame(bgn_date, stp_date).set_index(["trade_date", "instrument"])
+    else:
+        test_return_lib_id = "test_return_c"
+        test_return_lib_struct = database_structure[test_return_lib_id]
+        test_return_lib = CManagerLibReader(t_db_name=test_return_lib_struct.m_lib_name,
+                                            t_db_save_dir=test_returns_dir)
+        test_return_lib.set_default(t_default_table_name=test_return_lib_struct.m_tab.m_table_name)
+        test_return_df = test_return_lib.read_by_conditions(t_conditions=[
+            ("trade_date", ">=", bgn_date),
+            ("trade_date", "<", stp_date),
+        ], t_value_columns=["trade_date", "instrument", "value"]).set_index(["trade_date", "instrument"])
+        test_return_lib.close()
 
     # --- init major contracts
     all_factor_hl_dfs, all_factor_hs_dfs = [], []
@@ -134,26 +139,18 @@ def fac_exp_alg_pos(
             factor_df = pd.DataFrame({"instrument": instrument, _iter_factor_lbl: pd.Series(_iter_data)})
             _iter_dfs.append(factor_df[["instrument", _iter_factor_lbl]])
 
+    # --- reorganize
+    all_factor_dfs = {}
     for _iter_dfs, _iter_factor_lbl in zip([all_factor_hl_dfs, all_factor_hs_dfs, all_factor_dl_dfs, all_factor_ds_dfs],
                                            [factor_hl_lbl, factor_hs_lbl, factor_dl_lbl, factor_ds_lbl]):
-        # --- reorganize
         all_factor_df = pd.concat(_iter_dfs, axis=0, ignore_index=False)
         all_factor_df.sort_index(inplace=True)
+        all_factor_dfs[_iter_factor_lbl] = all_factor_df
 
-        # --- save
-        factor_lib_structure = database_structure[_iter_factor_lbl]
-        factor_lib = CManagerLibWriter(
-            t_db_name=factor_lib_structure.m_lib_name,
-            t_db_save_dir=factors_exposure_dir
-        )
-        factor_lib.initialize_table(t_table=factor_lib_structure.m_tab,
-                                    t_remove_existence=run_mode in ["O", "OVERWRITE"])
-        factor_lib.update(t_update_df=all_factor_df, t_using_index=True)
-        factor_lib.close()
-
-        print("... @ {} factor = {:>12s} calculated".format(dt.datetime.now(), _iter_factor_lbl))
+    # --- save
+    bulk_writer = CBulkLibWriter(database_structure, factors_exposure_dir)
+    bulk_writer.write(t_update_dfs=all_factor_dfs, t_remove_existence=run_mode in ["O", "OVERWRITE"])
 
-    test_return_lib.close()
     hld_pos_lib.close()
     return 0
 
@@ -168,21 +165,26 @@ def cal_fac_exp_pos_mp(proc_num: int,
                        intermediary_dir: str,
                        calendar_path: str):
     t0 = dt.datetime.now()
-    pool = mp.Pool(processes=proc_num)
-    for top_player_qty in top_players_qty:
-        pool.apply_async(fac_exp_alg_pos,
-                         args=(run_mode, bgn_date, stp_date,
-                               top_player_qty,
-                               instruments_universe,
-                               database_structure,
-                               factors_exposure_dir,
-                               test_returns_dir,
-                               intermediary_dir,
-                               calendar_path),
-                         error_callback=error_handler,
-                         )
-    pool.close()
-    pool.join()
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+    with CTestReturnCache("test_return_c", bgn_date, stp_date, test_returns_dir,
+                          database_structure) as test_return_cache:
+        pool = get_worker_pool(proc_num)
+        for top_player_qty in top_players_qty:
+            pool.apply_async(fac_exp_alg_pos,
+                             args=(run_mode, bgn_date, stp_date,
+                                   top_player_qty,
+                                   instruments_universe,
+                                   database_structure,
+                                   factors_exposure_dir,
+                                   test_returns_dir,
+                                   intermediary_dir,
+                                   calendar_path,
+                                   test_return_cache),
+                             error_callback=error_handler,
+                             )
+        pool.close()
+        pool.join()
     t1 = dt.datetime.now()
     print("... total time consuming: {:.2f} seconds".format((t1 - t0).total_seconds()))
     return 0
@@ -1,6 +1,5 @@
 import os
 import datetime as dt
-import multiprocessing as mp
 import numpy as np
 import pandas as pd
 from rich.progress import track
@@ -8,6 +7,7 @@ from skyrim.whiterun import CCalendar, error_handler
 from skyrim.falkreath import CLib1Tab1
 from skyrim.falkreath import CManagerLibReader
 from skyrim.falkreath import CManagerLibWriter
+from pipeline.pool import get_worker_pool
 
 
 def find_price(t_x: pd.Series, t_md_df: pd.DataFrame):
@@ -183,7 +183,7 @@ def cal_fac_exp_ts_mp(proc_num: int,
                    md_dir,
                    factors_exposure_dir,
                    price_type)
-    pool = mp.Pool(processes=proc_num)
+    pool = get_worker_pool(proc_num)
     for p_window in ts_windows:
         pool.apply_async(fac_exp_alg_ts_ma_and_diff,
                          args=(run_mode, bgn_date, stp_date, p_window,
@@ -1,24 +1,22 @@
 import datetime as dt
-import multiprocessing as mp
 import numpy as np
 import pandas as pd
 from rich.progress import track
 from skyrim.whiterun import CCalendar, error_handler
 from skyrim.falkreath import CLib1Tab1
-from skyrim.falkreath import CManagerLibReader
-from skyrim.falkreath import CManagerLibWriter
+from store.minute_bars import CMinuteBarsReader
+from store.bulk_writer import CBulkLibWriter
+from pipeline.pool import get_worker_pool
 
 
-def find_time_weighted_center(t_df: pd.DataFrame, t_ret: str):
-    index_reset_df = t_df.reset_index()
-    pos_idx = index_reset_df[t_ret] > 0
-    neg_idx = index_reset_df[t_ret] < 0
-    pos_grp = index_reset_df.loc[pos_idx, t_ret]
-    neg_grp = index_reset_df.loc[neg_idx, t_ret]
-    pos_wgt = pos_grp.abs() / pos_grp.abs().sum()
-    neg_wgt = neg_grp.abs() / neg_grp.abs().sum()
-    twcu = pos_grp.index @ pos_wgt
-    twcd = neg_grp.index @ neg_wgt
+def find_time_weighted_center(t_ret: np.ndarray):
+    loc = np.arange(len(t_ret))
+    pos_idx = t_ret > 0
+    neg_idx = t_ret < 0
+    pos_grp = np.abs(t_ret[pos_idx])
+    neg_grp = np.abs(t_ret[neg_idx])
+    twcu = loc[pos_idx] @ (pos_grp / pos_grp.sum()) if pos_idx.any() else 0.0
+    twcd = loc[neg_idx] @ (neg_grp / neg_grp.sum()) if neg_idx.any() else 0.0
     twct = twcu - twcd
     twcv = np.abs(twct)
     return twcu, twcd, -twct, -twcv
@@ -41,13 +39,8 @@ def fac_exp_alg_twc(
     # --- load calendar
     calendar = CCalendar(calendar_path)
 
-    # --- init em01_major reader
-    em01_major_lib_structure = database_structure["em01_major"]  # make sure it has the columns as em01_lib
-    em01_major_lib = CManagerLibReader(
-        t_db_name=em01_major_lib_structure.m_lib_name,
-        t_db_save_dir=intermediary_dir
-    )
-    em01_major_lib.set_default(t_default_table_name=em01_major_lib_structure.m_tab.m_table_name)
+    # --- init minute bars reader
+    minute_bars = CMinuteBarsReader(intermediary_dir)
 
     # ---
     iter_dates = calendar.get_iter_list(bgn_date, stp_date, True)
@@ -56,16 +49,16 @@ def fac_exp_alg_twc(
     # --- init major contracts
     all_factor_u_dfs, all_factor_d_dfs, all_factor_t_dfs, all_factor_v_dfs = [], [], [], []
     for instrument in track(instruments_universe):
-        em01_df = em01_major_lib.read_by_conditions(
-            t_conditions=[
-                ("trade_date", ">=", base_date),
-                ("trade_date", "<", stp_date),
-                ("instrument", "=", instrument.split(".")[0]),
-            ], t_value_columns=["trade_date", "timestamp", "loc_id", "volume", "amount", "close", "preclose"]
-        )
-        em01_df[["close", "preclose"]] = em01_df[["close", "preclose"]].round(2)
-        em01_df["m01_return_cls"] = (em01_df["close"] / em01_df["preclose"] - 1).replace(np.inf, 0)
-        res_srs = em01_df.groupby(by="trade_date").apply(find_time_weighted_center, t_ret="m01_return_cls")
+        trade_dates, day_offsets, bars = minute_bars.get_days(
+            instrument.split(".")[0], base_date, stp_date, ["close", "preclose"])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            close, preclose = [np.round(bars[_].astype(np.float64), 2) for _ in ["close", "preclose"]]
+            m01_return_cls = close / preclose - 1
+        m01_return_cls[np.isposinf(m01_return_cls)] = 0
+        res_srs = pd.Series(
+            data=[find_time_weighted_center(m01_return_cls[lo:hi])
+                  for lo, hi in zip(day_offsets[:-1], day_offsets[1:])],
+            index=pd.Index(trade_dates, name="trade_date"), dtype=object)
         twcu_srs, twcd_srs, twct_srs, twcv_srs = zip(*res_srs)
 
         for _iter_data, _iter_dfs, _iter_factor_lbl in zip([twcu_srs, twcd_srs, twct_srs, twcv_srs],
@@ -76,22 +69,18 @@ def fac_exp_alg_twc(
             factor_df = pd.DataFrame(
                 {"instrument": instrument, _iter_factor_lbl: _iter_srs[_iter_srs.index >= bgn_date]})
             _iter_dfs.append(factor_df[["instrument", _iter_factor_lbl]])
+
+    # --- reorganize
+    all_factor_dfs = {}
     for _iter_dfs, _iter_factor_lbl in zip([all_factor_u_dfs, all_factor_d_dfs, all_factor_t_dfs, all_factor_v_dfs],
                                            [factor_u_lbl, factor_d_lbl, factor_t_lbl, factor_v_lbl]):
-        # --- reorganize
         all_factor_df = pd.concat(_iter_dfs, axis=0, ignore_index=False)
         all_factor_df.sort_index(inplace=True)
+        all_factor_dfs[_iter_factor_lbl] = all_factor_df
 
-        # --- save
-        factor_lib_structure = database_structure[_iter_factor_lbl]
-        factor_lib = CManagerLibWriter(
-            t_db_name=factor_lib_structure.m_lib_name,
-            t_db_save_dir=factors_exposure_dir
-        )
-        factor_lib.initialize_table(t_table=factor_lib_structure.m_tab,
-                                    t_remove_existence=run_mode in ["O", "OVERWRITE"])
-        factor_lib.update(t_update_df=all_factor_df, t_using_index=True)
-        factor_lib.close()
+    # --- save
+    bulk_writer = CBulkLibWriter(database_structure, factors_exposure_dir)
+    bulk_writer.write(t_update_dfs=all_factor_dfs, t_remove_existence=run_mode in ["O", "OVERWRITE"])
     return 0
 
 
@@ -104,7 +93,7 @@ def cal_fac_exp_twc_mp(proc_num: int,
                        intermediary_dir: str,
                        calendar_path: str):
     t0 = dt.datetime.now()
-    pool = mp.Pool(processes=proc_num)
+    pool = get_worker_pool(proc_num)
     for p_window in twc_windows:
         pool.apply_async(fac_exp_alg_twc,
                          args=(run_mode, bgn_date, stp_date,
@@ -0,0 +1,125 @@
+import numpy as np
+
+
+def rank_average(t_x: np.ndarray, t_axis: int = -1) -> np.ndarray:
+    """
+
+    :param t_x: any shape, NaN is allowed
+    :param t_axis: axis to rank along
+    :return: ranks starting from 1 with ties averaged, the same as pd.Series.rank(method="average"),
+             NaN in t_x would be kept as NaN
+    """
+    x = np.moveaxis(np.asarray(t_x, dtype=np.float64), t_axis, -1)
+    n = x.shape[-1]
+    order = np.argsort(x, axis=-1, kind="stable")  # NaN are placed at the end
+    xs = np.take_along_axis(x, order, axis=-1)
+    pos = np.broadcast_to(np.arange(n), x.shape)
+
+    is_bgn = np.ones(x.shape, dtype=bool)
+    is_bgn[..., 1:] = xs[..., 1:] != xs[..., :-1]
+    is_end = np.ones(x.shape, dtype=bool)
+    is_end[..., :-1] = xs[..., :-1] != xs[..., 1:]
+    grp_bgn = np.maximum.accumulate(np.where(is_bgn, pos, 0), axis=-1)
+    grp_end = np.minimum.accumulate(np.where(is_end, pos, n - 1)[..., ::-1], axis=-1)[..., ::-1]
+
+    ranks = np.empty(x.shape, dtype=np.float64)
+    np.put_along_axis(ranks, order, (grp_bgn + grp_end) / 2 + 1, axis=-1)
+    ranks[np.isnan(x)] = np.nan
+    return np.moveaxis(ranks, -1, t_axis)
+
+
+def masked_pearson(t_x: np.ndarray, t_y: np.ndarray, t_axis: int = -1) -> np.ndarray:
+    """
+
+    :param t_x: t_x and t_y must be broadcastable
+    :param t_y:
+    :param t_axis: axis to calculate correlation along
+    :return: pearson correlation of pairs without NaN, the same as DataFrame.corr(method="pearson"),
+             NaN if less than 2 pairs are available or either side is constant
+    """
+    x, y = np.broadcast_arrays(np.asarray(t_x, dtype=np.float64), np.asarray(t_y, dtype=np.float64))
+    valid = ~(np.isnan(x) | np.isnan(y))
+    n = valid.sum(axis=t_axis, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x0, y0 = np.where(valid, x, 0), np.where(valid, y, 0)
+        dx = np.where(valid, x0 - x0.sum(axis=t_axis, keepdims=True) / n, 0)
+        dy = np.where(valid, y0 - y0.sum(axis=t_axis, keepdims=True) / n, 0)
+        sxy = (dx * dy).sum(axis=t_axis)
+        sxx = (dx * dx).sum(axis=t_axis)
+        syy = (dy * dy).sum(axis=t_axis)
+        r = sxy / np.sqrt(sxx * syy)
+    # --- np.where instead of assignment by mask, r is a scalar if t_x and t_y are 1-dimensional
+    return np.where((np.squeeze(n, axis=t_axis) < 2) | (sxx <= 0) | (syy <= 0), np.nan, r)
+
+
+def masked_spearman(t_x: np.ndarray, t_y: np.ndarray, t_axis: int = -1) -> np.ndarray:
+    """
+
+    :param t_x: t_x and t_y must be broadcastable
+    :param t_y:
+    :param t_axis: axis to calculate correlation along
+    :return: spearman correlation of pairs without NaN, the same as DataFrame.corr(method="spearman")
+    """
+    x, y = np.broadcast_arrays(np.asarray(t_x, dtype=np.float64), np.asarray(t_y, dtype=np.float64))
+    invalid = np.isnan(x) | np.isnan(y)
+    rx = rank_average(np.where(invalid, np.nan, x), t_axis=t_axis)
+    ry = rank_average(np.where(invalid, np.nan, y), t_axis=t_axis)
+    return masked_pearson(rx, ry, t_axis=t_axis)
+
+
+def argsort_descending(t_x: np.ndarray, t_axis: int = -1) -> np.ndarray:
+    """
+    the same order as pd.Series.sort_values(ascending=False) of each slice along t_axis, i.e.
+    non-NaN values are reversed, sorted by quicksort and reversed again, and NaN are placed at
+    the end in their original order. Ties are NOT kept in their original order, but in the
+    order of pandas, which depends on the quicksort of numpy.
+
+    :param t_x: any shape, NaN is allowed
+    :param t_axis: axis to sort along
+    :return: indices with the same shape as t_x
+    """
+    x = np.moveaxis(np.asarray(t_x, dtype=np.float64), t_axis, -1)
+    n = x.shape[-1]
+    x2 = x.reshape(-1, n)
+    order = np.empty(x2.shape, dtype=np.intp)
+    if x2.size > 0:
+        # --- slices with the same NaN positions are sorted together, as pandas sorts non-NaN values only
+        nan_patterns, pattern_ids = np.unique(np.isnan(x2), axis=0, return_inverse=True)
+        pattern_ids = pattern_ids.reshape(-1)
+        for p, nan_pattern in enumerate(nan_patterns):
+            rows = np.flatnonzero(pattern_ids == p)
+            rev_idx = np.flatnonzero(~nan_pattern)[::-1]
+            nan_idx = np.flatnonzero(nan_pattern)
+            indexer = rev_idx[np.argsort(x2[np.ix_(rows, rev_idx)], axis=-1, kind="quicksort")][:, ::-1]
+            order[rows] = np.concatenate([indexer, np.broadcast_to(nan_idx, (len(rows), len(nan_idx)))], axis=1)
+    return np.moveaxis(order.reshape(x.shape), -1, t_axis)
+
+
+def sorted_weighted_sum(t_x: np.ndarray, t_y: np.ndarray, t_w: np.ndarray, t_axis: int = -1) -> np.ndarray:
+    """
+
+    :param t_x: values to sort by, in descending order, see argsort_descending
+    :param t_y: values to be weighted, with the same shape as t_x
+    :param t_w: weights with shape = (n,) or (n, k), n = t_x.shape[t_axis], t_w[0] is applied to the largest t_x
+    :param t_axis: axis to sort along
+    :return: sum of t_y weighted by t_w after sorting, t_axis is removed and a trailing axis of size k
+             would be appended if t_w is 2-dimensional
+    """
+    y = np.moveaxis(np.asarray(t_y, dtype=np.float64), t_axis, -1)
+    order = np.moveaxis(argsort_descending(t_x, t_axis=t_axis), t_axis, -1)
+    return np.take_along_axis(y, order, axis=-1) @ np.asarray(t_w, dtype=np.float64)
+
+
+def sorted_weight(t_x: np.ndarray, t_w: np.ndarray, t_axis: int = -1) -> np.ndarray:
+    """
+
+    :param t_x: values to sort by, in descending order, see argsort_descending
+    :param t_w: weights with shape = (n,), n = t_x.shape[t_axis], t_w[0] is assigned to the largest t_x
+    :param t_axis: axis to sort along
+    :return: weights with the same shape as t_x
+    """
+    x = np.moveaxis(np.asarray(t_x, dtype=np.float64), t_axis, -1)
+    order = np.moveaxis(argsort_descending(t_x, t_axis=t_axis), t_axis, -1)
+    w = np.empty(x.shape, dtype=np.float64)
+    np.put_along_axis(w, order, np.broadcast_to(np.asarray(t_w, dtype=np.float64), x.shape), axis=-1)
+    return np.moveaxis(w, -1, t_axis)
@@ -0,0 +1,83 @@
+import numpy as np
+
+
+def _rolling_power_sums(t_x: np.ndarray, t_windows: list[int], t_order: int) -> tuple[np.ndarray, list[np.ndarray]]:
+    """
+    sums of x ** 1, ..., x ** t_order in each rolling window, by differencing cumulative sums.
+    x is centered by the mean of its finite values before powered, which keeps the differences accurate
+
+    :param t_x: 1-d array with shape = (n,), NaN and +-inf would be skipped, so windows containing
+                them have fewer valid x than the window and are NaN in the callers, as in pandas
+    :param t_windows:
+    :param t_order:
+    :return: (number of finite x with shape = (n, len(t_windows)),
+              [sums of (x - x_mean) ** p with shape = (n, len(t_windows)) for p = 1, ..., t_order]),
+             the first window - 1 rows of each column are NaN
+    """
+    x = np.asarray(t_x, dtype=np.float64)
+    n = len(x)
+    valid = np.isfinite(x)
+    xc = np.where(valid, x - (np.mean(x[valid]) if valid.any() else 0), 0)
+    cum_cnt = np.concatenate([[0], np.cumsum(valid)])
+    cum_sums = [np.concatenate([[0], np.cumsum(xc ** p)]) for p in range(1, t_order + 1)]
+
+    cnt = np.full((n, len(t_windows)), np.nan)
+    sums = [np.full((n, len(t_windows)), np.nan) for _ in range(t_order)]
+    for j, window in enumerate(t_windows):
+        if window > n:
+            continue
+        cnt[window - 1:, j] = cum_cnt[window:] - cum_cnt[:n - window + 1]
+        for s, cum_s in zip(sums, cum_sums):
+            s[window - 1:, j] = cum_s[window:] - cum_s[:n - window + 1]
+    return cnt, sums
+
+
+def rolling_mean(t_x: np.ndarray, t_windows: list[int]) -> np.ndarray:
+    """
+    the same as pd.Series(t_x).rolling(window).mean() for each window
+
+    :param t_x: 1-d array with shape = (n,)
+    :param t_windows:
+    :return: array with shape = (n, len(t_windows))
+    """
+    x = np.asarray(t_x, dtype=np.float64)
+    valid = np.isfinite(x)
+    x_mean = np.mean(x[valid]) if valid.any() else 0
+    cnt, (s1,) = _rolling_power_sums(x, t_windows, 1)
+    windows = np.array(t_windows, dtype=np.float64)
+    return np.where(cnt == windows, s1 / windows + x_mean, np.nan)
+
+
+def rolling_std(t_x: np.ndarray, t_windows: list[int]) -> np.ndarray:
+    """
+    the same as pd.Series(t_x).rolling(window).std() for each window, ddof = 1
+
+    :param t_x: 1-d array with shape = (n,)
+    :param t_windows:
+    :return: array with shape = (n, len(t_windows))
+    """
+    cnt, (s1, s2) = _rolling_power_sums(t_x, t_windows, 2)
+    windows = np.array(t_windows, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        var = np.maximum((s2 - s1 ** 2 / windows) / (windows - 1), 0)
+    return np.where(cnt == windows, np.sqrt(var), np.nan)
+
+
+def rolling_skew(t_x: np.ndarray, t_windows: list[int]) -> np.ndarray:
+    """
+    the same as pd.Series(t_x).rolling(window).skew() for each window, i.e. the
+    adjusted Fisher-Pearson coefficient, 0 if the variance of the window is almost 0
+
+    :param t_x: 1-d array with shape = (n,)
+    :param t_windows:
+    :return: array with shape = (n, len(t_windows))
+    """
+    cnt, (s1, s2, s3) = _rolling_power_sums(t_x, t_windows, 3)
+    windows = np.array(t_windows, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        a = s1 / windows
+        b = s2 / windows - a ** 2
+        c = s3 / windows - a ** 3 - 3 * a * b
+        skew = np.sqrt(windows * (windows - 1)) * c / ((windows - 2) * b ** 1.5)
+    skew = np.where(b > 1e-14, skew, 0)
+    return np.where((cnt == windows) & (windows >= 3), skew, np.nan)
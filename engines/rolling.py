@@ -0,0 +1,129 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from engines.cross_section import masked_spearman
+
+
+def rolling_top_spearman(t_x: np.ndarray, t_y: np.ndarray, t_sort: np.ndarray,
+                         t_window: int, t_top_sizes: list[int]) -> np.ndarray:
+    """
+    In each rolling window, rows are sorted by t_sort in descending order, then
+    spearman correlation of t_x and t_y among the top rows is calculated. Sorting
+    is done once per window and shared by all top sizes.
+
+    :param t_x: 1-d array with shape = (n,)
+    :param t_y: 1-d array with shape = (n,)
+    :param t_sort: 1-d array with shape = (n,), NaN would be placed at the end
+    :param t_window:
+    :param t_top_sizes: number of top rows used in each window, values larger than t_window are
+                        treated as t_window
+    :return: array with shape = (n, len(t_top_sizes)), the first t_window - 1 rows are NaN
+    """
+    n = len(t_x)
+    res = np.full((n, len(t_top_sizes)), np.nan)
+    if n < t_window:
+        return res
+
+    xw = sliding_window_view(np.asarray(t_x, dtype=np.float64), t_window)
+    yw = sliding_window_view(np.asarray(t_y, dtype=np.float64), t_window)
+    sw = sliding_window_view(np.asarray(t_sort, dtype=np.float64), t_window)
+    order = np.argsort(-sw, axis=1, kind="stable")
+    for j, top_size in enumerate(t_top_sizes):
+        top_loc = order[:, :min(top_size, t_window)]
+        res[t_window - 1:, j] = masked_spearman(
+            np.take_along_axis(xw, top_loc, axis=1),
+            np.take_along_axis(yw, top_loc, axis=1),
+            t_axis=1)
+    return res
+
+
+def rolling_top_bottom_mean(t_x: np.ndarray, t_sort: np.ndarray,
+                            t_window: int, t_top_sizes: list[int]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    In each rolling window, rows are sorted by t_sort in descending order, then
+    means of t_x among the first and the last top_size rows are calculated.
+    Rows are ranked once for the whole series and the window is kept in Fenwick
+    trees indexed by rank, so each step costs O(log n) for every top size.
+
+    :param t_x: 1-d array with shape = (n,), NaN would be skipped when calculating means
+    :param t_sort: 1-d array with shape = (n,), NaN would be placed at the end, ties are kept in order
+    :param t_window:
+    :param t_top_sizes: values larger than t_window are treated as t_window
+    :return: (means of head rows, means of tail rows), both with shape = (n, len(t_top_sizes)),
+             the first t_window - 1 rows are NaN
+    """
+    x = np.asarray(t_x, dtype=np.float64)
+    s = np.asarray(t_sort, dtype=np.float64)
+    n = len(x)
+    head_mean = np.full((n, len(t_top_sizes)), np.nan)
+    tail_mean = np.full((n, len(t_top_sizes)), np.nan)
+    if n < t_window:
+        return head_mean, tail_mean
+
+    order = np.argsort(np.where(np.isnan(s), np.inf, -s), kind="stable")
+    ranks = np.empty(n, dtype=np.int64)
+    ranks[order] = np.arange(1, n + 1)
+    ranks, valid, values = ranks.tolist(), (~np.isnan(x)).tolist(), np.nan_to_num(x).tolist()
+
+    # --- Fenwick trees: number of rows, number of valid x, sum of valid x
+    tree_cnt, tree_vld, tree_sum = [0] * (n + 1), [0] * (n + 1), [0.0] * (n + 1)
+    top_bit = 1 << (n.bit_length() - 1)
+
+    def _update(t_r: int, t_sign: int, t_vld: int, t_val: float):
+        while t_r <= n:
+            tree_cnt[t_r] += t_sign
+            tree_vld[t_r] += t_vld
+            tree_sum[t_r] += t_val
+            t_r += t_r & -t_r
+
+    def _head(t_k: int) -> tuple[int, float]:
+        # number and sum of valid x in the first t_k rows of the window
+        pos, rem, vld, val = 0, t_k, 0, 0.0
+        step = top_bit
+        while step:
+            nxt = pos + step
+            if nxt <= n and tree_cnt[nxt] <= rem:
+                pos, rem = nxt, rem - tree_cnt[nxt]
+                vld, val = vld + tree_vld[nxt], val + tree_sum[nxt]
+            step >>= 1
+        return vld, val
+
+    tot_vld, tot_val = 0, 0.0
+    top_sizes = [min(_, t_window) for _ in t_top_sizes]
+    for i in range(n):
+        _update(ranks[i], 1, valid[i], values[i] * valid[i])
+        tot_vld, tot_val = tot_vld + valid[i], tot_val + values[i] * valid[i]
+        if i >= t_window:
+            o = i - t_window
+            _update(ranks[o], -1, -valid[o], -values[o] * valid[o])
+            tot_vld, tot_val = tot_vld - valid[o], tot_val - values[o] * valid[o]
+        if i < t_window - 1:
+            continue
+        for j, k in enumerate(top_sizes):
+            h_vld, h_val = _head(k)
+            if h_vld > 0:
+                head_mean[i, j] = h_val / h_vld
+            r_vld, r_val = _head(t_window - k)
+            if tot_vld - r_vld > 0:
+                tail_mean[i, j] = (tot_val - r_val) / (tot_vld - r_vld)
+    return head_mean, tail_mean
+
+
+def rolling_means(t_x: np.ndarray, t_windows: list[int]) -> list[np.ndarray]:
+    """
+    rolling means of all windows along axis 0, read from one cumulative sum
+
+    :param t_x: array with shape = (n, ...), must not contain NaN
+    :param t_windows:
+    :return: [array with the same shape as t_x for each window], the first window - 1 rows are NaN,
+             the same as pd.DataFrame(t_x).rolling(window).mean() for 2-d t_x
+    """
+    x = np.asarray(t_x, dtype=np.float64)
+    n = len(x)
+    cum_x = np.concatenate([np.zeros((1,) + x.shape[1:]), np.cumsum(x, axis=0)], axis=0)
+    res = []
+    for window in t_windows:
+        mean = np.full(x.shape, np.nan)
+        if window <= n:
+            mean[window - 1:] = (cum_x[window:] - cum_x[:n - window + 1]) / window
+        res.append(mean)
+    return res
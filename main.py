@@ -1,4 +1,6 @@
+import os
 import argparse
+import datetime as dt
 
 
 def parse_args():
@@ -6,29 +8,45 @@ def parse_args():
     args_parser.add_argument(
         "--switch", type=str,
         choices=(
-            "preprocess", "test_returns", "factors_exposure", "fema",
+            "all",
+            "preprocess", "test_returns", "factors_exposure", "fema", "store", "panel",
             "ic", "icsum",
             "gp", "gpsum", "gpcor",
             "sig", "simu", "simusum",
         ),
-        help="use this to decide which parts to run, available options",
+        help="""
+            use this to decide which parts to run, available options,
+            'all' = all the stages from preprocess to simusum, run in one process with one worker pool,
+            begin dates of them are pipeline_bgn_dates in project_config, --bgn is not needed in mode 'o',
+            and must be provided in mode 'a', then each stage would begin at the later one of --bgn and
+            its date in pipeline_bgn_dates
+            """,
     )
     args_parser.add_argument(
         "--factor", type=str, default="",
         help="""
             optional, must be provided if switch = {'preprocess', 'factors_exposure'},
             use this to decide which factor, available options = {
-            'amp', 'amt', 'basis', 'beta', 'cx', 'exr', 'mtm', 'pos', 'sgm', 'size', 'skew', 'smt', 'to', 'ts', 'twc'}
+            'amp', 'amt', 'basis', 'beta', 'cx', 'exr', 'mtm', 'pos', 'rng', 'sgm', 'size', 'skew', 'smt', 'to', 'ts',
+            'twc', 'moments'}, 'moments' = {'amt', 'mtm', 'rng', 'sgm', 'size', 'skew', 'to'} calculated in one
+            process, each of them alone is calculated by the same engine
+            if switch = 'store', use this to decide which exposures to pack into the store, available options = {
+            'raw', 'ma'}, both of them would be packed if not provided
+            """)
+    args_parser.add_argument("--mode", type=str, choices=("o", "a", "i"), help="""
+            run mode, 'i' = incremental, only available for switch = 'factors_exposure', new dates after
+            the last stored date would be calculated and appended, --bgn is not needed
             """)
-    args_parser.add_argument("--mode", type=str, choices=("o", "a"), help="run mode")
     args_parser.add_argument("--bgn", type=str, help="""
             begin date, may be different according to different switches, suggestion of different switch:
             {
                 "preprocess/m01": "20150416",
+                "preprocess/vrk": "20150416",  # must be calculated before preprocess/pub
                 "preprocess/pub": "20150416",
                 "test_returns": "20150416",
                 "factor_exposures": "20150416",
                 "factor_exposures_moving_average": "20160615",
+                "panel": "20160615",
                 "tests": "20160701",
                 "tests_summary": "20160701",
                 "signals": "20160627",
@@ -43,22 +61,41 @@ def parse_args():
     args_parser.add_argument("-p", "--process", type=int, default=4, help="""
             number of process to be called when calculating, default = 4
             """)
+    args_parser.add_argument("--store", action="store_true", help="""
+            optional, if provided, switch = {'sig', 'panel'} would read factor exposures from the columnar store,
+            which should be packed by switch = 'store' in advance
+            """)
+    args_parser.add_argument("--batch", action="store_true", help="""
+            optional, if provided, switch = {'ic', 'gp'} would be calculated in a vectorized batch mode
+            with exposures from the factor panel, which should be built by switch = 'panel' in advance
+            """)
+    args_parser.add_argument("--cache", action="store_true", help="""
+            optional, if provided, switch = {'factors_exposure', 'fema', 'ic', 'gp', 'all'} would skip the
+            calculations whose inputs and outputs are unchanged since they were run with --cache last time
+            """)
     args = args_parser.parse_args()
     __switch = args.switch.upper()
     __factor = args.factor.lower()
     __run_mode = args.mode.upper() if args.mode else args.mode
     __bgn_date, __stp_date = args.bgn, args.stp
     __proc_num = args.process
-    return __switch, __factor, __run_mode, __bgn_date, __stp_date, __proc_num
+    __use_store = args.store
+    __use_batch = args.batch
+    __use_cache = args.cache
+    return __switch, __factor, __run_mode, __bgn_date, __stp_date, __proc_num, __use_store, __use_batch, __use_cache
 
 
-if __name__ == "__main__":
+def run_switch(switch: str, factor: str, run_mode: str, bgn_date: str, stp_date: str, proc_num: int,
+               use_store: bool, use_batch: bool, use_cache: bool = False):
     from struct_lib import database_structure
     from project_setup import futures_by_instru_dir, equity_index_by_instrument_dir, calendar_path
-    from project_setup import research_factors_exposure_dir
+    from project_setup import research_factors_exposure_dir, research_result_cache_dir
     from project_config import instruments_universe
 
-    switch, factor, run_mode, bgn_date, stp_date, proc_num = parse_args()
+    if run_mode in ["I", "INCREMENTAL"] and switch not in ["FACTORS_EXPOSURE"]:
+        raise ValueError(f"... run mode = {run_mode} is not available for switch = {switch}, please check again")
+
+    result_cache_dir = research_result_cache_dir if use_cache else None
 
     if switch in ["PREPROCESS"]:
         if factor == "split":
@@ -70,6 +107,7 @@ if __name__ == "__main__":
             from preprocess.preprocess import update_major_minute
             from project_setup import futures_dir, futures_md_structure_path, futures_em01_db_name
             from project_setup import research_intermediary_dir
+            from store.minute_bars import update_minute_bars
 
             update_major_minute(run_mode=run_mode, bgn_date=bgn_date, stp_date=stp_date,
                                 instruments=instruments_universe, calendar_path=calendar_path,
@@ -79,25 +117,36 @@ if __name__ == "__main__":
                                 by_instrument_dir=futures_by_instru_dir,
                                 intermediary_dir=research_intermediary_dir,
                                 database_structure=database_structure)
+            update_minute_bars(run_mode=run_mode, bgn_date=bgn_date, stp_date=stp_date,
+                               database_structure=database_structure,
+                               intermediary_dir=research_intermediary_dir)
+        elif factor == "vrk":
+            from preprocess.preprocess import update_volume_rank
+            from project_setup import futures_dir, futures_md_structure_path, futures_md_db_name
+            from project_setup import research_intermediary_dir
+            from project_config import volume_rank_instruments
+
+            update_volume_rank(run_mode=run_mode, bgn_date=bgn_date, stp_date=stp_date,
+                               instruments=volume_rank_instruments,
+                               futures_md_structure_path=futures_md_structure_path,
+                               futures_md_db_name=futures_md_db_name,
+                               futures_dir=futures_dir,
+                               intermediary_dir=research_intermediary_dir,
+                               database_structure=database_structure)
         elif factor == "pub":
             from preprocess.preprocess import update_public_info
-            from project_setup import (futures_dir, futures_md_structure_path,
-                                       futures_md_db_name, futures_by_date_dir)
+            from project_setup import futures_by_date_dir
             from project_setup import research_intermediary_dir
             from project_config import instruments_universe
 
-            for value_type in ["pos", "delta"]:
-                update_public_info(value_type=value_type,
-                                   run_mode=run_mode, bgn_date=bgn_date, stp_date=stp_date,
-                                   instruments=instruments_universe,
-                                   calendar_path=calendar_path,
-                                   futures_md_structure_path=futures_md_structure_path,
-                                   futures_md_db_name=futures_md_db_name,
-                                   futures_dir=futures_dir,
-                                   futures_by_date_dir=futures_by_date_dir,
-                                   intermediary_dir=research_intermediary_dir,
-                                   database_structure=database_structure
-                                   )
+            update_public_info(run_mode=run_mode, bgn_date=bgn_date, stp_date=stp_date,
+                               instruments=instruments_universe,
+                               calendar_path=calendar_path,
+                               futures_by_date_dir=futures_by_date_dir,
+                               intermediary_dir=research_intermediary_dir,
+                               database_structure=database_structure,
+                               proc_num=proc_num,
+                               )
     elif switch in ["TEST_RETURNS"]:
         from project_setup import (research_test_returns_dir, futures_dir,
                                    futures_md_structure_path, futures_em01_db_name)
@@ -120,6 +169,61 @@ if __name__ == "__main__":
     elif switch in ["FACTORS_EXPOSURE"]:
         from project_config import factors_args
 
+        fac_exp_inc, fac_exp_save_dir, input_bgn_date = None, research_factors_exposure_dir, None
+        if run_mode in ["I", "INCREMENTAL"]:
+            from project_config import fac_sub_grps
+            from project_setup import research_factors_exposure_scratch_dir
+            from algs.factor_exposure_incremental import CFacExpIncremental
+
+            if factor not in fac_sub_grps:
+                raise ValueError(f"factor = {factor} is illegal, please check again")
+            fac_exp_inc = CFacExpIncremental(
+                t_family=factor, t_factor_lbls=fac_sub_grps[factor][0], t_max_window=fac_sub_grps[factor][1],
+                t_stp_date=stp_date,
+                t_database_structure=database_structure,
+                t_factors_exposure_dir=research_factors_exposure_dir,
+                t_scratch_dir=research_factors_exposure_scratch_dir,
+                t_calendar_path=calendar_path,
+            )
+            if not fac_exp_inc.prepare():
+                return 0
+            run_mode, bgn_date, stp_date = "O", fac_exp_inc.m_bgn_date, fac_exp_inc.m_stp_date
+            fac_exp_save_dir, input_bgn_date = research_factors_exposure_scratch_dir, fac_exp_inc.m_input_bgn_date
+
+        result_cache = None
+        if use_cache and (fac_exp_inc is None):
+            from project_setup import research_intermediary_dir, research_test_returns_dir
+            from project_setup import futures_by_instru_md_dir, futures_instru_info_path
+            from project_config import fac_sub_grps
+            from store.result_cache import CResultCache, fingerprint_files
+
+            if factor not in fac_sub_grps:
+                raise ValueError(f"factor = {factor} is illegal, please check again")
+            major_return_path = os.path.join(futures_by_instru_dir, "major_return.db")
+            minute_bars_dir = os.path.join(research_intermediary_dir, "em01_major.bars")
+            upstream_paths = {
+                "amp": [major_return_path, equity_index_by_instrument_dir],
+                "basis": [major_return_path, equity_index_by_instrument_dir, calendar_path],
+                "beta": [major_return_path, equity_index_by_instrument_dir, calendar_path],
+                "exr": [minute_bars_dir, calendar_path],
+                "pos": [research_intermediary_dir, research_test_returns_dir, calendar_path],
+                "smt": [minute_bars_dir, calendar_path, futures_instru_info_path],
+                "ts": [os.path.join(futures_by_instru_dir, "major_minor.db"), futures_by_instru_md_dir, calendar_path],
+                "twc": [minute_bars_dir, calendar_path],
+            }.get(factor, [major_return_path])
+            result_cache = CResultCache(result_cache_dir)
+            result_cache_id = "factors_exposure/{}".format(factor)
+            result_cache_key = result_cache.make_key({
+                "factor": factor, "factors": fac_sub_grps[factor],
+                "run_mode": run_mode, "bgn_date": bgn_date, "stp_date": stp_date,
+                "instruments_universe": instruments_universe,
+                "upstream": fingerprint_files(upstream_paths),
+            })
+            result_cache_outputs = [(database_structure[_], fac_exp_save_dir) for _ in fac_sub_grps[factor][0]]
+            if result_cache.is_hit(result_cache_id, result_cache_key, result_cache_outputs):
+                print("... @ {} result cache of {}: hit = 1, miss = 0".format(dt.datetime.now(), result_cache_id))
+                return 0
+
         if factor == "amp":
             from project_config import mapper_futures_to_index
             from algs.factor_exposure_amp import cal_fac_exp_amp_mp
@@ -131,22 +235,10 @@ if __name__ == "__main__":
                 instruments_universe=instruments_universe,
                 database_structure=database_structure,
                 by_instrument_dir=futures_by_instru_dir,
-                factors_exposure_dir=research_factors_exposure_dir,
+                factors_exposure_dir=fac_exp_save_dir,
                 mapper_fut_to_idx=mapper_futures_to_index,
-                equity_index_by_instrument_dir=equity_index_by_instrument_dir
-            )
-        elif factor == "amt":
-            from algs.factor_exposure_amt import cal_fac_exp_amt_mp
-
-            cal_fac_exp_amt_mp(
-                proc_num=proc_num,
-                run_mode=run_mode, bgn_date=bgn_date, stp_date=stp_date,
-                amt_windows=factors_args["amt_windows"],
-                instruments_universe=instruments_universe,
-                database_structure=database_structure,
-                by_instrument_dir=futures_by_instru_dir,
-                factors_exposure_dir=research_factors_exposure_dir,
-                money_scale=10000
+                equity_index_by_instrument_dir=equity_index_by_instrument_dir,
+                input_bgn_date=input_bgn_date,
             )
         elif factor == "basis":
             from algs.factor_exposure_basis import cal_fac_exp_basis_mp
@@ -159,7 +251,7 @@ if __name__ == "__main__":
                 database_structure=database_structure,
                 by_instrument_dir=futures_by_instru_dir,
                 equity_index_by_instrument_dir=equity_index_by_instrument_dir,
-                factors_exposure_dir=research_factors_exposure_dir,
+                factors_exposure_dir=fac_exp_save_dir,
                 calendar_path=calendar_path,
             )
         elif factor == "beta":
@@ -173,7 +265,7 @@ if __name__ == "__main__":
                 database_structure=database_structure,
                 by_instrument_dir=futures_by_instru_dir,
                 equity_index_by_instrument_dir=equity_index_by_instrument_dir,
-                factors_exposure_dir=research_factors_exposure_dir,
+                factors_exposure_dir=fac_exp_save_dir,
                 calendar_path=calendar_path,
             )
         elif factor == "cx":
@@ -187,7 +279,8 @@ if __name__ == "__main__":
                 instruments_universe=instruments_universe,
                 database_structure=database_structure,
                 by_instrument_dir=futures_by_instru_dir,
-                factors_exposure_dir=research_factors_exposure_dir
+                factors_exposure_dir=fac_exp_save_dir,
+                input_bgn_date=input_bgn_date,
             )
         elif factor == "exr":
             from project_setup import research_intermediary_dir
@@ -199,21 +292,24 @@ if __name__ == "__main__":
                 exr_windows=factors_args["exr_windows"], drifts=factors_args["drifts"],
                 instruments_universe=instruments_universe,
                 database_structure=database_structure,
-                factors_exposure_dir=research_factors_exposure_dir,
+                factors_exposure_dir=fac_exp_save_dir,
                 intermediary_dir=research_intermediary_dir,
                 calendar_path=calendar_path,
             )
-        elif factor == "mtm":
-            from algs.factor_exposure_mtm import cal_fac_exp_mtm_mp
+        elif factor in ["amt", "mtm", "rng", "sgm", "size", "skew", "to", "moments"]:
+            from project_config import moments_families
+            from algs.factor_exposure_moments import cal_fac_exp_moments
 
-            cal_fac_exp_mtm_mp(
-                proc_num=proc_num,
+            cal_fac_exp_moments(
                 run_mode=run_mode, bgn_date=bgn_date, stp_date=stp_date,
-                mtm_windows=factors_args["mtm_windows"],
+                mgr_windows={_: factors_args["{}_windows".format(_)]
+                             for _ in (moments_families if factor == "moments" else [factor])},
                 instruments_universe=instruments_universe,
                 database_structure=database_structure,
                 by_instrument_dir=futures_by_instru_dir,
-                factors_exposure_dir=research_factors_exposure_dir,
+                factors_exposure_dir=fac_exp_save_dir,
+                money_scale=10000,
+                input_bgn_date=input_bgn_date,
             )
         elif factor == "pos":
             from project_setup import research_test_returns_dir, research_intermediary_dir
@@ -225,59 +321,11 @@ if __name__ == "__main__":
                 top_players_qty=factors_args["top_players_qty"],
                 instruments_universe=instruments_universe,
                 database_structure=database_structure,
-                factors_exposure_dir=research_factors_exposure_dir,
+                factors_exposure_dir=fac_exp_save_dir,
                 test_returns_dir=research_test_returns_dir,
                 intermediary_dir=research_intermediary_dir,
                 calendar_path=calendar_path,
             )
-        elif factor == "rng":
-            from algs.factor_exposure_rng import cal_fac_exp_rng_mp
-
-            cal_fac_exp_rng_mp(
-                proc_num=proc_num,
-                run_mode=run_mode, bgn_date=bgn_date, stp_date=stp_date,
-                rng_windows=factors_args["rng_windows"],
-                instruments_universe=instruments_universe,
-                database_structure=database_structure,
-                by_instrument_dir=futures_by_instru_dir,
-                factors_exposure_dir=research_factors_exposure_dir
-            )
-        elif factor == "sgm":
-            from algs.factor_exposure_sgm import cal_fac_exp_sgm_mp
-
-            cal_fac_exp_sgm_mp(
-                proc_num=proc_num,
-                run_mode=run_mode, bgn_date=bgn_date, stp_date=stp_date,
-                sgm_windows=factors_args["sgm_windows"],
-                instruments_universe=instruments_universe,
-                database_structure=database_structure,
-                by_instrument_dir=futures_by_instru_dir,
-                factors_exposure_dir=research_factors_exposure_dir
-            )
-        elif factor == "size":
-            from algs.factor_exposure_size import cal_fac_exp_size_mp
-
-            cal_fac_exp_size_mp(
-                proc_num=proc_num,
-                run_mode=run_mode, bgn_date=bgn_date, stp_date=stp_date,
-                size_windows=factors_args["size_windows"],
-                instruments_universe=instruments_universe,
-                database_structure=database_structure,
-                by_instrument_dir=futures_by_instru_dir,
-                factors_exposure_dir=research_factors_exposure_dir
-            )
-        elif factor == "skew":
-            from algs.factor_exposure_skew import cal_fac_exp_skew_mp
-
-            cal_fac_exp_skew_mp(
-                proc_num=proc_num,
-                run_mode=run_mode, bgn_date=bgn_date, stp_date=stp_date,
-                skew_windows=factors_args["skew_windows"],
-                instruments_universe=instruments_universe,
-                database_structure=database_structure,
-                by_instrument_dir=futures_by_instru_dir,
-                factors_exposure_dir=research_factors_exposure_dir
-            )
         elif factor == "smt":
             from project_setup import research_intermediary_dir, futures_instru_info_path
             from algs.factor_exposure_smt import cal_fac_exp_smt_mp
@@ -288,24 +336,12 @@ if __name__ == "__main__":
                 smt_windows=factors_args["smt_windows"], lbds=factors_args["lbds"],
                 instruments_universe=instruments_universe,
                 database_structure=database_structure,
-                factors_exposure_dir=research_factors_exposure_dir,
+                factors_exposure_dir=fac_exp_save_dir,
                 intermediary_dir=research_intermediary_dir,
                 calendar_path=calendar_path,
                 futures_instru_info_path=futures_instru_info_path,
                 amount_scale=1e4
             )
-        elif factor == "to":
-            from algs.factor_exposure_to import cal_fac_exp_to_mp
-
-            cal_fac_exp_to_mp(
-                proc_num=proc_num,
-                run_mode=run_mode, bgn_date=bgn_date, stp_date=stp_date,
-                to_windows=factors_args["to_windows"],
-                instruments_universe=instruments_universe,
-                database_structure=database_structure,
-                by_instrument_dir=futures_by_instru_dir,
-                factors_exposure_dir=research_factors_exposure_dir
-            )
         elif factor == "ts":
             from algs.factor_exposure_ts import cal_fac_exp_ts_mp
             from project_setup import futures_by_instru_md_dir
@@ -318,7 +354,7 @@ if __name__ == "__main__":
                 database_structure=database_structure,
                 by_instrument_dir=futures_by_instru_dir,
                 md_dir=futures_by_instru_md_dir,
-                factors_exposure_dir=research_factors_exposure_dir,
+                factors_exposure_dir=fac_exp_save_dir,
                 calendar_path=calendar_path,
                 price_type="close",
             )
@@ -332,12 +368,18 @@ if __name__ == "__main__":
                 twc_windows=factors_args["twc_windows"],
                 instruments_universe=instruments_universe,
                 database_structure=database_structure,
-                factors_exposure_dir=research_factors_exposure_dir,
+                factors_exposure_dir=fac_exp_save_dir,
                 intermediary_dir=research_intermediary_dir,
                 calendar_path=calendar_path,
             )
         else:
             raise ValueError(f"factor = {factor} is illegal, please check again")
+
+        if result_cache is not None:
+            result_cache.save(result_cache_id, result_cache_key, result_cache_outputs)
+            print("... @ {} result cache of {}: hit = 0, miss = 1".format(dt.datetime.now(), result_cache_id))
+        if fac_exp_inc is not None:
+            fac_exp_inc.verify_and_append()
     elif switch in ["FEMA"]:  # "FACTORS_EXPOSURE_MOVING_AVERAGE"
         from algs.factor_exposure_MA import cal_fac_exp_MA_mp
         from project_config import factors, factor_mov_ave_wins
@@ -349,22 +391,65 @@ if __name__ == "__main__":
             universe=instruments_universe,
             database_structure=database_structure,
             factors_exposure_dir=research_factors_exposure_dir,
-            calendar_path=calendar_path)
-    elif switch in ["IC"]:
-        from project_setup import research_ic_tests_dir, research_test_returns_dir
-        from tests.ic_tests import cal_ic_tests_mp
-        from project_config import factors_ma
-
-        cal_ic_tests_mp(
-            proc_num=proc_num,
-            factors_ma=factors_ma,
+            calendar_path=calendar_path,
+            result_cache_dir=result_cache_dir)
+    elif switch in ["STORE"]:
+        from project_setup import research_factors_exposure_store_dir
+        from project_config import factors, factors_ma
+        from store.exposure_store import pack_factors_into_store
+
+        pack_factors_into_store(
+            factors={"raw": factors, "ma": factors_ma}.get(factor, factors + factors_ma),
             run_mode=run_mode, bgn_date=bgn_date, stp_date=stp_date,
-            tests_result_dir=research_ic_tests_dir,
+            database_structure=database_structure,
             factors_exposure_dir=research_factors_exposure_dir,
-            test_returns_dir=research_test_returns_dir,
+            exposure_store_dir=research_factors_exposure_store_dir,
+        )
+    elif switch in ["PANEL"]:
+        from project_setup import research_factors_exposure_store_dir, research_factors_panel_dir
+        from project_config import factors_ma
+        from store.factor_panel import build_factor_panel
+
+        build_factor_panel(
+            factors=factors_ma, universe=instruments_universe,
+            bgn_date=bgn_date, stp_date=stp_date,
             database_structure=database_structure,
+            factors_exposure_dir=research_factors_exposure_dir,
+            panel_dir=research_factors_panel_dir,
             calendar_path=calendar_path,
+            exposure_store_dir=research_factors_exposure_store_dir if use_store else None,
         )
+    elif switch in ["IC"]:
+        from project_setup import research_ic_tests_dir, research_test_returns_dir
+        from project_config import factors_ma
+
+        if use_batch:
+            from project_setup import research_factors_panel_dir
+            from tests.ic_tests import cal_ic_tests_batch
+
+            cal_ic_tests_batch(
+                proc_num=proc_num,
+                factors_ma=factors_ma,
+                run_mode=run_mode, bgn_date=bgn_date, stp_date=stp_date,
+                tests_result_dir=research_ic_tests_dir,
+                factors_panel_dir=research_factors_panel_dir,
+                test_returns_dir=research_test_returns_dir,
+                database_structure=database_structure,
+            )
+        else:
+            from tests.ic_tests import cal_ic_tests_mp
+
+            cal_ic_tests_mp(
+                proc_num=proc_num,
+                factors_ma=factors_ma,
+                run_mode=run_mode, bgn_date=bgn_date, stp_date=stp_date,
+                tests_result_dir=research_ic_tests_dir,
+                factors_exposure_dir=research_factors_exposure_dir,
+                test_returns_dir=research_test_returns_dir,
+                database_structure=database_structure,
+                calendar_path=calendar_path,
+                result_cache_dir=result_cache_dir,
+            )
     elif switch in ["ICSUM"]:
         from project_setup import research_ic_tests_dir, research_ic_tests_summary_dir
         from project_config import factors_ma
@@ -383,18 +468,34 @@ if __name__ == "__main__":
     elif switch in ["GP"]:
         from project_setup import research_gp_tests_dir, research_test_returns_dir
         from project_config import factors_ma
-        from tests.gp_tests import cal_gp_tests_mp
 
-        cal_gp_tests_mp(
-            proc_num=proc_num,
-            factors_ma=factors_ma, universe=instruments_universe,
-            run_mode=run_mode, bgn_date=bgn_date, stp_date=stp_date,
-            tests_result_dir=research_gp_tests_dir,
-            factors_exposure_dir=research_factors_exposure_dir,
-            test_returns_dir=research_test_returns_dir,
-            database_structure=database_structure,
-            calendar_path=calendar_path,
-        )
+        if use_batch:
+            from project_setup import research_factors_panel_dir
+            from tests.gp_tests import cal_gp_tests_batch
+
+            cal_gp_tests_batch(
+                proc_num=proc_num,
+                factors_ma=factors_ma, universe=instruments_universe,
+                run_mode=run_mode, bgn_date=bgn_date, stp_date=stp_date,
+                tests_result_dir=research_gp_tests_dir,
+                factors_panel_dir=research_factors_panel_dir,
+                test_returns_dir=research_test_returns_dir,
+                database_structure=database_structure,
+            )
+        else:
+            from tests.gp_tests import cal_gp_tests_mp
+
+            cal_gp_tests_mp(
+                proc_num=proc_num,
+                factors_ma=factors_ma, universe=instruments_universe,
+                run_mode=run_mode, bgn_date=bgn_date, stp_date=stp_date,
+                tests_result_dir=research_gp_tests_dir,
+                factors_exposure_dir=research_factors_exposure_dir,
+                test_returns_dir=research_test_returns_dir,
+                database_structure=database_structure,
+                calendar_path=calendar_path,
+                result_cache_dir=result_cache_dir,
+            )
     elif switch in ["GPSUM"]:
         from project_setup import research_gp_tests_dir, research_gp_tests_summary_dir
         from project_config import factors_ma
@@ -432,7 +533,7 @@ if __name__ == "__main__":
             tests_result_summary_dir=research_gp_tests_summary_dir,
         )
     elif switch in ["SIG"]:
-        from project_setup import research_signals_dir, research_gp_tests_dir
+        from project_setup import research_signals_dir, research_gp_tests_dir, research_factors_exposure_store_dir
         from struct_sig import sids_fix_f_ma_syn, sids_fix_f_syn_ma, sids_dyn, signals_structure
         from signals.signals import cal_signals_mp
 
@@ -445,6 +546,7 @@ if __name__ == "__main__":
             trn_win=3, lbd=1000,
             signals_dir=research_signals_dir,
             factors_exposure_dir=research_factors_exposure_dir,
+            exposure_store_dir=research_factors_exposure_store_dir if use_store else None,
             gp_tests_dir=research_gp_tests_dir,
             database_structure=database_structure,
             calendar_path=calendar_path,
@@ -477,3 +579,140 @@ if __name__ == "__main__":
         )
     else:
         raise ValueError(f"... switch = {switch} is not a legal option, please check again")
+    return 0
+
+
+def run_pipeline(run_mode: str, bgn_date: str | None, stp_date: str, proc_num: int,
+                 use_store: bool, use_batch: bool, use_cache: bool):
+    from project_config import pipeline_bgn_dates, pipeline_factor_options
+    from pipeline.scheduler import CStage, CPipeline
+
+    if run_mode not in ["O", "OVERWRITE", "A", "APPEND"]:
+        raise ValueError(f"... run mode = {run_mode} is not available for switch = all, please check again")
+    if stp_date is None:
+        raise ValueError("... stp date must be provided for switch = all, please check again")
+
+    # --- in append mode, only dates since bgn_date are calculated, or the whole history
+    #     would be appended again to the libraries which already hold it
+    if run_mode in ["A", "APPEND"]:
+        if bgn_date is None:
+            raise ValueError("... bgn date must be provided for switch = all in append mode, please check again")
+        bgn_dates = {k: max(v, bgn_date) for k, v in pipeline_bgn_dates.items()}
+    else:
+        bgn_dates = pipeline_bgn_dates
+
+    def new_stage(stage_id: str, deps: list[str]) -> CStage:
+        stage_switch, _, stage_factor = stage_id.partition("/")
+        return CStage(t_stage_id=stage_id, t_func=run_switch, t_kwargs=dict(
+            switch=stage_switch.upper(), factor=stage_factor,
+            run_mode=run_mode, bgn_date=bgn_dates[stage_switch], stp_date=stp_date,
+            proc_num=proc_num, use_store=use_store, use_batch=use_batch, use_cache=use_cache,
+        ), t_deps=deps)
+
+    # --- options of factors_exposure -> upstream stages
+    options_deps = {
+        "amp": ["preprocess/split"],
+        "basis": ["preprocess/split"],
+        "exr": ["preprocess/m01"],
+        "pos": ["preprocess/pub", "test_returns"],
+        "smt": ["preprocess/m01"],
+        "twc": ["preprocess/m01"],
+    }
+    stages = [
+        new_stage("preprocess/split", []),
+        new_stage("preprocess/m01", []),
+        new_stage("preprocess/vrk", []),
+        new_stage("preprocess/pub", ["preprocess/vrk"]),
+        new_stage("test_returns", ["preprocess/m01"]),
+    ] + [new_stage("factors_exposure/{}".format(_), options_deps.get(_, [])) for _ in pipeline_factor_options]
+
+    if use_batch:
+        # --- ic and gp in batch mode need the whole factor panel, so they are stages
+        fema_deps = ["factors_exposure/{}".format(_) for _ in pipeline_factor_options]
+        tests_deps = ["fema", "test_returns", "panel"]
+        stages += [new_stage("fema", fema_deps)] + ([new_stage("store", ["fema"])] if use_store else []) + [
+            new_stage("panel", ["fema"] + (["store"] if use_store else [])),
+            new_stage("ic", tests_deps),
+            new_stage("gp", tests_deps),
+        ]
+        tasks, fema_ids, ic_ids, gp_ids = [], ["fema"], ["ic"], ["gp"]
+    else:
+        # --- moving average, ic and gp of each factor are tasks, which start as soon as the
+        #     exposure of the factor is calculated, instead of waiting for all the factors
+        tasks, fema_ids, ic_ids, gp_ids = fac_exp_tests_tasks(run_mode, bgn_dates, stp_date, use_cache)
+        if use_store:
+            stages += [new_stage("store", fema_ids)]
+
+    stages += [
+        new_stage("icsum", ic_ids),
+        new_stage("gpsum", gp_ids),
+        new_stage("gpcor", ["gpsum"]),
+        new_stage("sig", fema_ids + gp_ids + (["store"] if use_store else [])),
+        new_stage("simu", ["sig", "test_returns"]),
+        new_stage("simusum", ["simu"]),
+    ]
+    CPipeline(t_stages=stages, t_proc_num=proc_num, t_tasks=tasks).run()
+    return 0
+
+
+def fac_exp_tests_tasks(run_mode: str, bgn_dates: dict[str, str], stp_date: str, use_cache: bool):
+    """
+    tasks of moving average of each factor in project_config.factors, and tasks of ic and gp of
+    each factor in project_config.factors_ma, the moving average depends on the option of
+    factors_exposure which calculates the factor, and the tests depend on the moving average
+    and test returns
+
+    :param run_mode:
+    :param bgn_dates: {switch: bgn_date}, like project_config.pipeline_bgn_dates
+    :param stp_date:
+    :param use_cache:
+    :return: (tasks, ids of moving average tasks, ids of ic tasks, ids of gp tasks)
+    """
+    from struct_lib import database_structure
+    from project_setup import calendar_path, research_factors_exposure_dir, research_test_returns_dir
+    from project_setup import research_ic_tests_dir, research_gp_tests_dir, research_result_cache_dir
+    from project_config import instruments_universe, factors, factor_mov_ave_wins
+    from project_config import factor_option
+    from pipeline.scheduler import CTask
+    from algs.factor_exposure_MA import run_fac_exp_MA_with_cache
+    from tests.ic_tests import run_ic_test_with_cache
+    from tests.gp_tests import run_gp_test_with_cache
+
+    result_cache_dir = research_result_cache_dir if use_cache else None
+    tests_kwargs = dict(factors_exposure_dir=research_factors_exposure_dir,
+                        test_returns_dir=research_test_returns_dir,
+                        database_structure=database_structure,
+                        calendar_path=calendar_path)
+    tasks, fema_ids, ic_ids, gp_ids = [], [], [], []
+    for factor in factors:
+        # --- moving averages of all windows of a factor are calculated in one task
+        fema_id = "fema/" + factor
+        tasks.append(CTask(fema_id, run_fac_exp_MA_with_cache, (
+            factor, factor_mov_ave_wins, run_mode, bgn_dates["fema"], stp_date,
+            instruments_universe, database_structure, research_factors_exposure_dir, calendar_path,
+            result_cache_dir,
+        ), t_deps=["factors_exposure/{}".format(factor_option[factor])]))
+        fema_ids.append(fema_id)
+        for mov_ave_win in factor_mov_ave_wins:
+            factor_ma = "{}-M{:03d}".format(factor, mov_ave_win)
+            ic_id, gp_id = "ic/" + factor_ma, "gp/" + factor_ma
+            tasks += [
+                CTask(ic_id, run_ic_test_with_cache, (
+                    factor_ma, run_mode, bgn_dates["ic"], stp_date, result_cache_dir,
+                ), dict(tests_kwargs, tests_result_dir=research_ic_tests_dir), t_deps=[fema_id, "test_returns"]),
+                CTask(gp_id, run_gp_test_with_cache, (
+                    factor_ma, instruments_universe, run_mode, bgn_dates["gp"], stp_date,
+                    result_cache_dir,
+                ), dict(tests_kwargs, tests_result_dir=research_gp_tests_dir), t_deps=[fema_id, "test_returns"]),
+            ]
+            ic_ids.append(ic_id)
+            gp_ids.append(gp_id)
+    return tasks, fema_ids, ic_ids, gp_ids
+
+
+if __name__ == "__main__":
+    switch, factor, run_mode, bgn_date, stp_date, proc_num, use_store, use_batch, use_cache = parse_args()
+    if switch in ["ALL"]:
+        run_pipeline(run_mode, bgn_date, stp_date, proc_num, use_store, use_batch, use_cache)
+    else:
+        run_switch(switch, factor, run_mode, bgn_date, stp_date, proc_num, use_store, use_batch, use_cache)
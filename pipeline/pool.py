@@ -0,0 +1,94 @@
+"""
+Worker pools of the _mp functions.
+
+By default, get_worker_pool returns a new mp.Pool, which is closed and joined by
+the caller. When a persistent pool is initialized (main.py --switch all), it returns
+a session of the persistent pool instead, so all the stages of a pipeline share the
+same worker processes, and they are forked only once.
+"""
+
+import os
+import multiprocessing as mp
+import multiprocessing.pool
+
+_persistent_pool: tuple[int, mp.pool.Pool] | None = None
+
+
+class CWorkerPoolSession(object):
+    def __init__(self, t_pool: mp.pool.Pool):
+        self.m_pool = t_pool
+        self.m_results: list[tuple[str, mp.pool.AsyncResult]] = []
+
+    @staticmethod
+    def _describe_job(func, args: tuple) -> str:
+        # --- only short scalar arguments are shown, such as labels, windows and dates
+        scalar_args = [repr(_) for _ in args if isinstance(_, (str, int, float)) and len(repr(_)) <= 24]
+        return "{}({})".format(getattr(func, "__name__", repr(func)), ", ".join(scalar_args))
+
+    def apply_async(self, func, args=(), kwds=None, callback=None, error_callback=None) -> mp.pool.AsyncResult:
+        result = self.m_pool.apply_async(func, args=args, kwds={} if kwds is None else kwds,
+                                         callback=callback, error_callback=error_callback)
+        self.m_results.append((self._describe_job(func, args), result))
+        return result
+
+    def close(self):
+        # the persistent pool is kept alive for the following stages
+        return 0
+
+    def join(self, t_check: bool = True):
+        """
+        wait for the tasks submitted in this session only. Unlike mp.Pool.join, a
+        RuntimeError is raised if any of them failed, so the stage calling this
+        would be marked as failed by pipeline.scheduler
+
+        :param t_check: if False, failed tasks would not raise
+        :return:
+        """
+        failed_jobs = []
+        for job, result in self.m_results:
+            result.wait()
+            if not result.successful():
+                try:
+                    result.get()
+                except Exception as e:
+                    failed_jobs.append("{}: {}".format(job, repr(e)))
+        self.m_results.clear()
+        if t_check and failed_jobs:
+            raise RuntimeError("{} jobs failed in worker pool session:\n    {}".format(
+                len(failed_jobs), "\n    ".join(failed_jobs)))
+        return 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # --- an exception raised in the with block is not replaced by errors of the jobs
+        self.join(t_check=exc_type is None)
+        return False
+
+
+def init_persistent_pool(proc_num: int):
+    global _persistent_pool
+    if _persistent_pool is None:
+        _persistent_pool = (os.getpid(), mp.Pool(processes=proc_num))
+    return 0
+
+
+def close_persistent_pool():
+    global _persistent_pool
+    if _persistent_pool is not None:
+        _persistent_pool[1].close()
+        _persistent_pool[1].join()
+        _persistent_pool = None
+    return 0
+
+
+def get_worker_pool(proc_num: int) -> mp.pool.Pool | CWorkerPoolSession:
+    """
+
+    :param proc_num: only used when there is no persistent pool
+    :return: a session of the persistent pool if it is initialized in this process, else a new mp.Pool
+    """
+    if (_persistent_pool is not None) and (_persistent_pool[0] == os.getpid()):
+        return CWorkerPoolSession(_persistent_pool[1])
+    return mp.Pool(processes=proc_num)
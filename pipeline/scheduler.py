@@ -0,0 +1,214 @@
+"""
+A task graph of the stages of main.py.
+
+Stages run in one interpreter, and each of them fans its tasks out to the persistent
+worker pool of pipeline.pool. A stage starts as soon as all of its upstream nodes are
+done, and if a node fails, only its downstream nodes are skipped. Stages are run one
+after another in the main process, because the progress bars of them can not be
+displayed at the same time.
+
+Tasks are finer nodes, such as the moving average or the tests of one factor. Each of
+them is submitted to the persistent pool as soon as its own upstream nodes are done,
+even if a stage is still running in the main process, so they keep the workers busy
+while the stages are waiting for the slowest of their own tasks.
+"""
+
+import heapq
+import threading
+import datetime as dt
+import traceback
+from collections import Counter
+from typing import Callable
+from pipeline.pool import init_persistent_pool, close_persistent_pool, get_worker_pool
+
+
+class CStage(object):
+    def __init__(self, t_stage_id: str, t_func: Callable, t_kwargs: dict, t_deps: list[str] = None):
+        """
+
+        :param t_stage_id:
+        :param t_func:
+        :param t_kwargs: t_func(**t_kwargs) would be called in the main process to run this stage
+        :param t_deps: ids of the upstream stages or tasks
+        """
+        self.m_stage_id = t_stage_id
+        self.m_func = t_func
+        self.m_kwargs = t_kwargs
+        self.m_deps = [] if t_deps is None else t_deps
+
+
+class CTask(object):
+    def __init__(self, t_task_id: str, t_func: Callable, t_args: tuple, t_kwargs: dict = None,
+                 t_deps: list[str] = None):
+        """
+
+        :param t_task_id:
+        :param t_func: must be picklable
+        :param t_args:
+        :param t_kwargs: t_func(*t_args, **t_kwargs) would be called in a worker of the persistent pool
+        :param t_deps: ids of the upstream stages or tasks
+        """
+        self.m_task_id = t_task_id
+        self.m_func = t_func
+        self.m_args = t_args
+        self.m_kwargs = {} if t_kwargs is None else t_kwargs
+        self.m_deps = [] if t_deps is None else t_deps
+
+
+class CPipeline(object):
+    def __init__(self, t_stages: list[CStage], t_proc_num: int, t_tasks: list[CTask] = None):
+        self.m_stages: dict[str, CStage] = {}
+        self.m_tasks: dict[str, CTask] = {}
+        for stage in t_stages:
+            self._check_new_id(stage.m_stage_id)
+            self.m_stages[stage.m_stage_id] = stage
+        for task in [] if t_tasks is None else t_tasks:
+            self._check_new_id(task.m_task_id)
+            self.m_tasks[task.m_task_id] = task
+        self.m_deps: dict[str, list[str]] = {k: v.m_deps for k, v in self.m_stages.items()}
+        self.m_deps.update({k: v.m_deps for k, v in self.m_tasks.items()})
+        for node_id, deps in self.m_deps.items():
+            for dep in deps:
+                if dep not in self.m_deps:
+                    raise ValueError(f"... {node_id} depends on an unknown stage or task = {dep}")
+        self.m_order = self._sort_stages()
+        self.m_proc_num = t_proc_num
+
+        # --- status of each finished node, "done", "failed" or "skipped"
+        self.m_status: dict[str, str] = {}
+        self.m_cond = threading.Condition()
+        self.m_task_dependents: dict[str, list[str]] = {}
+        for task_id, task in self.m_tasks.items():
+            for dep in set(task.m_deps):
+                self.m_task_dependents.setdefault(dep, []).append(task_id)
+        self.m_task_waiting: dict[str, int] = {k: len(set(v.m_deps)) for k, v in self.m_tasks.items()}
+        self.m_pool = None
+
+        # --- counts of the tasks returning a string, such as "hit" or "miss" of the result cache
+        self.m_task_results: Counter = Counter()
+
+    def _check_new_id(self, t_node_id: str):
+        if t_node_id in self.m_stages or t_node_id in self.m_tasks:
+            raise ValueError(f"... stage or task = {t_node_id} is duplicated, please check again")
+        return 0
+
+    def _sort_stages(self) -> list[str]:
+        # --- topological order of all nodes, they are kept in the order they are added if possible
+        node_ids = list(self.m_deps)
+        node_idx = {k: i for i, k in enumerate(node_ids)}
+        waiting = {k: len(set(v)) for k, v in self.m_deps.items()}
+        dependents: dict[str, list[str]] = {}
+        for node_id, deps in self.m_deps.items():
+            for dep in set(deps):
+                dependents.setdefault(dep, []).append(node_id)
+        ready = [node_idx[k] for k, v in waiting.items() if v == 0]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            node_id = node_ids[heapq.heappop(ready)]
+            order.append(node_id)
+            for dependent in dependents.get(node_id, []):
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    heapq.heappush(ready, node_idx[dependent])
+        if len(order) < len(node_ids):
+            raise ValueError("... stages or tasks = {} are in a cycle, please check again".format(
+                [_ for _ in node_ids if waiting[_] > 0]))
+        return [_ for _ in order if _ in self.m_stages]
+
+    # --- tasks, the following methods must be called with m_cond acquired
+    def _submit_task(self, t_task: CTask):
+        self.m_pool.apply_async(
+            t_task.m_func, args=t_task.m_args, kwds=t_task.m_kwargs,
+            callback=lambda r, task_id=t_task.m_task_id: self._on_task_finished(task_id, r, None),
+            error_callback=lambda e, task_id=t_task.m_task_id: self._on_task_finished(task_id, None, e),
+        )
+        return 0
+
+    def _finish_node(self, t_node_id: str, t_status: str):
+        self.m_status[t_node_id] = t_status
+        for task_id in self.m_task_dependents.get(t_node_id, []):
+            if task_id in self.m_status:
+                continue
+            if t_status != "done":
+                self._finish_node(task_id, "skipped")
+            else:
+                self.m_task_waiting[task_id] -= 1
+                if self.m_task_waiting[task_id] == 0:
+                    self._submit_task(self.m_tasks[task_id])
+        self.m_cond.notify_all()
+        return 0
+
+    def _on_task_finished(self, t_task_id: str, t_result, t_error: BaseException | None):
+        with self.m_cond:
+            if isinstance(t_result, str):
+                self.m_task_results[t_result] += 1
+            if t_error is not None:
+                print("... @ {} Warning! task = {} failed: {}".format(dt.datetime.now(), t_task_id, repr(t_error)))
+            self._finish_node(t_task_id, "done" if t_error is None else "failed")
+        return 0
+
+    # --- stages
+    def _get_next_stage(self) -> CStage:
+        with self.m_cond:
+            while True:
+                for stage_id in self.m_order:
+                    if stage_id not in self.m_status and all(_ in self.m_status for _ in self.m_deps[stage_id]):
+                        return self.m_stages[stage_id]
+                self.m_cond.wait()
+
+    def _run_stage(self, t_stage: CStage) -> str:
+        if failed_deps := [_ for _ in t_stage.m_deps if self.m_status[_] != "done"]:
+            print("... @ {} stage = {} is skipped, because upstream nodes = {} are not done".format(
+                dt.datetime.now(), t_stage.m_stage_id, failed_deps[0:5]))
+            return "skipped"
+
+        t0 = dt.datetime.now()
+        print("... @ {} stage = {} begins".format(t0, t_stage.m_stage_id))
+        try:
+            t_stage.m_func(**t_stage.m_kwargs)
+        except Exception:
+            traceback.print_exc()
+            print("... @ {} Warning! stage = {} failed".format(dt.datetime.now(), t_stage.m_stage_id))
+            return "failed"
+        t1 = dt.datetime.now()
+        print("... @ {} stage = {} is done, time consuming: {:.2f} seconds".format(
+            t1, t_stage.m_stage_id, (t1 - t0).total_seconds()))
+        return "done"
+
+    def run(self) -> dict[str, str]:
+        """
+
+        :return: {stage_id or task_id: status}, status = "done", "failed" or "skipped"
+        """
+        t0 = dt.datetime.now()
+        init_persistent_pool(self.m_proc_num)
+        self.m_pool = get_worker_pool(self.m_proc_num)
+        try:
+            with self.m_cond:
+                for task_id, waiting in self.m_task_waiting.items():
+                    if waiting == 0:
+                        self._submit_task(self.m_tasks[task_id])
+            for _ in range(len(self.m_order)):
+                stage = self._get_next_stage()
+                status = self._run_stage(stage)
+                with self.m_cond:
+                    self._finish_node(stage.m_stage_id, status)
+            with self.m_cond:
+                while len(self.m_status) < len(self.m_deps):
+                    self.m_cond.wait()
+        finally:
+            close_persistent_pool()
+            self.m_pool = None
+        t1 = dt.datetime.now()
+        for stage_id in self.m_order:
+            print("... stage = {:<24s} {}".format(stage_id, self.m_status.get(stage_id, "not run")))
+        if self.m_tasks:
+            tasks_status = [self.m_status.get(_, "not run") for _ in self.m_tasks]
+            print("... tasks: {}".format(", ".join(
+                "{} = {}".format(s, tasks_status.count(s)) for s in ["done", "failed", "skipped", "not run"])))
+        if self.m_task_results:
+            print("... tasks returned: {}".format(", ".join(
+                "{} = {}".format(k, v) for k, v in sorted(self.m_task_results.items()))))
+        print("... total time consuming: {:.2f} seconds".format((t1 - t0).total_seconds()))
+        return self.m_status
@@ -1,12 +1,15 @@
 import os
 import sys
 import json
+import sqlite3
 import datetime as dt
+import numpy as np
 import pandas as pd
 from rich.progress import track
-from skyrim.whiterun import CCalendar
+from skyrim.whiterun import CCalendar, error_handler
 from skyrim.falkreath import CManagerLibReader, CTable
 from skyrim.falkreath import CManagerLibWriter
+from pipeline.pool import get_worker_pool
 
 
 def split_spot_daily_k(equity_index_by_instrument_dir: str, equity_indexes: tuple[tuple]):
@@ -54,8 +57,6 @@ def update_major_minute(
     with open(futures_md_structure_path, "r") as j:
         em01_table_struct = json.load(j)[futures_em01_db_name]["CTable"]
     em01_table = CTable(t_table_struct=em01_table_struct)
-    em01_lib = CManagerLibReader(t_db_save_dir=futures_dir, t_db_name=futures_em01_db_name)
-    em01_lib.set_default(em01_table.m_table_name)
     em01_cols = list(em01_table.m_primary_keys) + list(em01_table.m_value_columns)
 
     # --- init lib writer
@@ -67,137 +68,275 @@ def update_major_minute(
     em01_major_lib.initialize_table(t_table=em01_major_lib_structure.m_tab,
                                     t_remove_existence=run_mode in ["O", "OVERWRITE"])
 
-    # --- main loop
-    dfs_list = []
+    # --- resolve major contract of each day
     iter_dates = calendar.get_iter_list(bgn_date, stp_date, True)
-    for trade_date in track(iter_dates, description="[INF] Getting major m01 ..."):
-        theory_number_of_bars = 270 if trade_date < "20160101" else 240
-        for instrument in instruments:
-            try:
-                major_contract = major_minor_manager[instrument].at[trade_date, "n_contract"]
-            except KeyError:
-                print("... Error!", instrument, "does not have major contract @ ", trade_date)
-                print("... called by misc.update_major_minute")
-                sys.exit()
-            major_contract_m01_df = em01_lib.read_by_conditions(
-                t_conditions=[
-                    ("trade_date", "=", trade_date),
-                    ("loc_id", "=", major_contract),
-                ], t_value_columns=em01_cols)
-            major_contract_m01_df = major_contract_m01_df.dropna(
-                axis=0, how="all", subset=["open", "high", "low", "close"]
-            )
-            if (num_of_bars := len(major_contract_m01_df)) != theory_number_of_bars:
-                print(
-                    f"Error! Number of bars = {num_of_bars} @ {trade_date} for {instrument} - {major_contract}, theory = {theory_number_of_bars}"
-                )
-                sys.exit()
-            dfs_list.append(major_contract_m01_df)
-
-    update_df = pd.concat(dfs_list, axis=0, ignore_index=True)
+    targets_dfs, missing = [], []
+    for instrument in instruments:
+        instru_major_srs = major_minor_manager[instrument]["n_contract"].reindex(iter_dates)
+        for trade_date in instru_major_srs.index[instru_major_srs.isnull()]:
+            missing.append("... Error! {} does not have major contract @ {}".format(instrument, trade_date))
+        targets_dfs.append(pd.DataFrame({
+            "trade_date": iter_dates,
+            "loc_id": instru_major_srs.to_numpy(),
+            "instrument": instrument,
+        }).dropna(axis=0, subset=["loc_id"]))
+    if missing:
+        print("\n".join(missing))
+        print("... called by misc.update_major_minute")
+        sys.exit()
+    targets_df = pd.concat(targets_dfs, axis=0, ignore_index=True)
+
+    # --- pull all targets by year, with a join against a temporary table
+    dfs_list = []
+    em01_cols_sql = ", ".join("t.{}".format(_) for _ in em01_cols)
+    with sqlite3.connect(os.path.join(futures_dir, futures_em01_db_name)) as connection:
+        connection.execute("CREATE TEMP TABLE targets (trade_date TEXT, loc_id TEXT)")
+        for year, year_targets_df in track(targets_df.groupby(by=targets_df["trade_date"].str[0:4]),
+                                           description="[INF] Getting major m01 ..."):
+            connection.execute("DELETE FROM temp.targets")
+            connection.executemany("INSERT INTO temp.targets VALUES (?, ?)",
+                                   year_targets_df[["trade_date", "loc_id"]].itertuples(index=False, name=None))
+            year_df = pd.read_sql_query(
+                "SELECT {} FROM {} AS t INNER JOIN temp.targets AS g "
+                "ON t.trade_date = g.trade_date AND t.loc_id = g.loc_id".format(em01_cols_sql, em01_table.m_table_name),
+                connection)
+            dfs_list.append(year_df)
+    connection.close()
+    update_df = pd.concat(dfs_list, axis=0, ignore_index=True).dropna(
+        axis=0, how="all", subset=["open", "high", "low", "close"])
+
+    # --- check number of bars of all days at once
+    num_of_bars = update_df.groupby(by=["trade_date", "loc_id"]).size()
+    targets_df["num_of_bars"] = num_of_bars.reindex(
+        pd.MultiIndex.from_frame(targets_df[["trade_date", "loc_id"]])).fillna(0).astype(int).to_numpy()
+    targets_df["theory_number_of_bars"] = np.where(targets_df["trade_date"] < "20160101", 270, 240)
+    bad_df = targets_df.loc[targets_df["num_of_bars"] != targets_df["theory_number_of_bars"]]
+    if not bad_df.empty:
+        for r in bad_df.itertuples(index=False):
+            print(f"Error! Number of bars = {r.num_of_bars} @ {r.trade_date} for {r.instrument} - {r.loc_id}, "
+                  f"theory = {r.theory_number_of_bars}")
+        print(f"... {len(bad_df)} days of major m01 are illegal, called by misc.update_major_minute")
+        sys.exit()
+
     round_df = update_df.round(2)
     em01_major_lib.update(t_update_df=round_df)
-
-    em01_lib.close()
     em01_major_lib.close()
     return 0
 
 
-def update_public_info(
-        value_type: str,
+def update_volume_rank(
         run_mode: str, bgn_date: str, stp_date: str,
         instruments: list[str],
-        calendar_path: str,
-        futures_md_structure_path,
-        futures_md_db_name,
+        futures_md_structure_path: str,
+        futures_md_db_name: str,
         futures_dir: str,
-        futures_by_date_dir,
         intermediary_dir: str,
         database_structure: dict,
 ):
     """
+    contracts of each instrument are ranked by volume of each day, with one query
+    for all dates and all instruments
 
-    :param value_type:  {"delta", "pos"}
     :param run_mode:
     :param bgn_date:
     :param stp_date:
     :param instruments:
-    :param calendar_path:
     :param futures_md_structure_path:
     :param futures_md_db_name:
     :param futures_dir:
-    :param futures_by_date_dir:
     :param intermediary_dir:
     :param database_structure:
     :return:
     """
-    factor_lbl = {"pos": "hld_pos", "delta": "dlt_pos"}[value_type]
-    instru_sub_ids = [_.split(".")[0] for _ in instruments]
-
     if stp_date is None:
         stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
 
-    # --- load calendar
-    calendar = CCalendar(calendar_path)
-
-    # --- init lib reader
+    # --- load volumes
     with open(futures_md_structure_path, "r") as j:
         md_table_struct = json.load(j)[futures_md_db_name]["CTable"]
     md_table = CTable(t_table_struct=md_table_struct)
     md_db = CManagerLibReader(t_db_save_dir=futures_dir, t_db_name=futures_md_db_name)
     md_db.set_default(t_default_table_name=md_table.m_table_name)
+    md_df = md_db.read_by_conditions(t_conditions=[
+        ("trade_date", ">=", bgn_date),
+        ("trade_date", "<", stp_date),
+    ], t_value_columns=["trade_date", "loc_id", "instrument", "volume"])
+    md_db.close()
+
+    # --- rank
+    instru_sub_ids = {_.split(".")[0]: _ for _ in instruments}
+    rank_df = md_df.loc[md_df["instrument"].isin(instru_sub_ids)].copy()
+    rank_df["instrument"] = rank_df["instrument"].map(instru_sub_ids)
+    rank_df.sort_values(by=["trade_date", "instrument", "volume"], ascending=[True, True, False],
+                        kind="stable", inplace=True)
+    rank_df["rank"] = rank_df.groupby(by=["trade_date", "instrument"]).cumcount()
+
+    # --- save
+    rank_lib_structure = database_structure["volume_rank"]
+    rank_lib = CManagerLibWriter(
+        t_db_name=rank_lib_structure.m_lib_name,
+        t_db_save_dir=intermediary_dir
+    )
+    rank_lib.initialize_table(t_table=rank_lib_structure.m_tab, t_remove_existence=run_mode in ["O", "OVERWRITE"])
+    rank_lib.update(t_update_df=rank_df[["trade_date", "loc_id", "instrument", "volume", "rank"]],
+                    t_using_index=False)
+    rank_lib.close()
+    print("... @ {} volume rank of {} contract-days are calculated".format(dt.datetime.now(), len(rank_df)))
+    return 0
+
+
+def load_volume_rank(bgn_date: str, stp_date: str, intermediary_dir: str,
+                     database_structure: dict) -> pd.DataFrame:
+    """
+
+    :param bgn_date:
+    :param stp_date:
+    :param intermediary_dir:
+    :param database_structure:
+    :return: a DataFrame with columns = ["trade_date", "loc_id", "instrument", "volume", "rank"]
+    """
+    rank_lib_structure = database_structure["volume_rank"]
+    rank_lib = CManagerLibReader(t_db_save_dir=intermediary_dir, t_db_name=rank_lib_structure.m_lib_name)
+    rank_lib.set_default(t_default_table_name=rank_lib_structure.m_tab.m_table_name)
+    rank_df = rank_lib.read_by_conditions(t_conditions=[
+        ("trade_date", ">=", bgn_date),
+        ("trade_date", "<", stp_date),
+    ], t_value_columns=["trade_date", "loc_id", "instrument", "volume", "rank"])
+    rank_lib.close()
+    return rank_df
+
+
+def cal_public_info_by_dates(
+        iter_dates: list[str],
+        instruments: list[str],
+        volume_rank_df: pd.DataFrame,
+        futures_by_date_dir: str,
+) -> dict[str, pd.DataFrame]:
+    """
+
+    :param iter_dates: positions file of each date is read only once for both value types
+    :param instruments:
+    :param volume_rank_df: volume rank of these dates, see load_volume_rank
+    :param futures_by_date_dir:
+    :return: {"pos": DataFrame, "delta": DataFrame}, columns = ["trade_date", "instrument", "member_chs", "lng", "srt"]
+    """
+    value_types = ["pos", "delta"]
+    instru_sub_ids = [_.split(".")[0] for _ in instruments]
+
+    # --- contracts of each (trade_date, instrument), sorted by rank
+    contracts = volume_rank_df.sort_values(by="rank").groupby(by=["trade_date", "instrument"])["loc_id"].apply(list)
 
     # w = [0.4, 0.3, 0.2, 0.2]
     w = [0.25, 0.25, 0.25, 0.25]
-    dlt_dfs = []
-    iter_dates = calendar.get_iter_list(bgn_date, stp_date, True)
-    for trade_date in track(iter_dates, description=f"[INF] Working Pub {value_type} ... "):
+    dlt_dfs = {value_type: [] for value_type in value_types}
+    for trade_date in iter_dates:
         raw_pos_file = "positions.E.{}.csv.gz".format(trade_date)
         raw_pos_path = os.path.join(futures_by_date_dir, trade_date[0:4], trade_date, raw_pos_file)
-        raw_pos_df = pd.read_csv(raw_pos_path, dtype={"type": str})  # type:ignore
-        pivot_pos_df = pd.pivot_table(
+        raw_pos_df = pd.read_csv(raw_pos_path, dtype={"type": str},  # type:ignore
+                                 usecols=["type", "member_chs", "instrument", "loc_id"] + value_types)
+        pivot_pos_dfs = {value_type: pd.pivot_table(
             data=raw_pos_df, index=["type", "member_chs"],
             columns=["instrument", "loc_id"], values=value_type
-        )
+        ) for value_type in value_types}
 
         for instrument, instru_sub_id in zip(instruments, instru_sub_ids):
-            instru_pub_info_df = md_db.read_by_conditions(t_conditions=[
-                ("trade_date", "=", trade_date),
-                ("instrument", "=", instru_sub_id),
-            ], t_value_columns=["loc_id", "volume"]).set_index("loc_id")
-            instru_pub_info_df.sort_values(by="volume", ascending=False, inplace=True)
-            w_srs = pd.Series(data=w, index=instru_pub_info_df.index)
-
-            lng_df_by_contract = pivot_pos_df.loc["2", instru_sub_id].dropna(axis=0, how="all").fillna(0)
-            srt_df_by_contract = pivot_pos_df.loc["3", instru_sub_id].dropna(axis=0, how="all").fillna(0)
-            raw_lng_wgt_srs = w_srs[lng_df_by_contract.columns]
-            raw_srt_wgt_srs = w_srs[srt_df_by_contract.columns]
-            lng_wgt_srs = raw_lng_wgt_srs / raw_lng_wgt_srs.sum()
-            srt_wgt_srs = raw_srt_wgt_srs / raw_srt_wgt_srs.sum()
-
-            td_instru_pos_df = pd.DataFrame({
-                "lng": lng_df_by_contract @ lng_wgt_srs,
-                "srt": srt_df_by_contract @ srt_wgt_srs,
-            }).fillna(0).round(2)
-            td_instru_pos_df["trade_date"] = trade_date
-            td_instru_pos_df["instrument"] = instrument
-            td_instru_pos_df.reset_index(inplace=True)
-            td_instru_pos_df = td_instru_pos_df[["trade_date", "instrument", "member_chs", "lng", "srt"]]
-            dlt_dfs.append(td_instru_pos_df)
-
-    # --- reorganize
-    all_factor_df = pd.concat(dlt_dfs, axis=0, ignore_index=True)
+            w_srs = pd.Series(data=w, index=contracts[(trade_date, instrument)])
 
-    # --- save
-    factor_lib_structure = database_structure[factor_lbl]
-    factor_lib = CManagerLibWriter(
-        t_db_name=factor_lib_structure.m_lib_name,
-        t_db_save_dir=intermediary_dir
-    )
-    factor_lib.initialize_table(t_table=factor_lib_structure.m_tab, t_remove_existence=run_mode in ["O", "OVERWRITE"])
-    factor_lib.update(t_update_df=all_factor_df, t_using_index=False)
-    factor_lib.close()
+            for value_type in value_types:
+                pivot_pos_df = pivot_pos_dfs[value_type]
+                lng_df_by_contract = pivot_pos_df.loc["2", instru_sub_id].dropna(axis=0, how="all").fillna(0)
+                srt_df_by_contract = pivot_pos_df.loc["3", instru_sub_id].dropna(axis=0, how="all").fillna(0)
+                raw_lng_wgt_srs = w_srs[lng_df_by_contract.columns]
+                raw_srt_wgt_srs = w_srs[srt_df_by_contract.columns]
+                lng_wgt_srs = raw_lng_wgt_srs / raw_lng_wgt_srs.sum()
+                srt_wgt_srs = raw_srt_wgt_srs / raw_srt_wgt_srs.sum()
 
-    md_db.close()
-    print("... @ {} {} positions are calculated".format(dt.datetime.now(), value_type))
+                td_instru_pos_df = pd.DataFrame({
+                    "lng": lng_df_by_contract @ lng_wgt_srs,
+                    "srt": srt_df_by_contract @ srt_wgt_srs,
+                }).fillna(0).round(2)
+                td_instru_pos_df["trade_date"] = trade_date
+                td_instru_pos_df["instrument"] = instrument
+                td_instru_pos_df.reset_index(inplace=True)
+                td_instru_pos_df = td_instru_pos_df[["trade_date", "instrument", "member_chs", "lng", "srt"]]
+                dlt_dfs[value_type].append(td_instru_pos_df)
+    return {value_type: pd.concat(dlt_dfs[value_type], axis=0, ignore_index=True) if dlt_dfs[value_type]
+            else pd.DataFrame(columns=["trade_date", "instrument", "member_chs", "lng", "srt"])
+            for value_type in value_types}
+
+
+def update_public_info(
+        run_mode: str, bgn_date: str, stp_date: str,
+        instruments: list[str],
+        calendar_path: str,
+        futures_by_date_dir,
+        intermediary_dir: str,
+        database_structure: dict,
+        proc_num: int = 1,
+):
+    """
+    both "pos" and "delta" positions are calculated from one read of the
+    positions files, dates are split into chunks and parsed in a process pool.
+    Contracts are weighted by their volume rank, which should be calculated by
+    update_volume_rank in advance
+
+    :param run_mode:
+    :param bgn_date:
+    :param stp_date:
+    :param instruments:
+    :param calendar_path:
+    :param futures_by_date_dir:
+    :param intermediary_dir:
+    :param database_structure:
+    :param proc_num:
+    :return:
+    """
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+
+    # --- load calendar
+    calendar = CCalendar(calendar_path)
+
+    # --- load volume rank
+    iter_dates = calendar.get_iter_list(bgn_date, stp_date, True)
+    volume_rank_df = load_volume_rank(bgn_date, stp_date, intermediary_dir, database_structure)
+    if missing_dates := sorted(set(iter_dates) - set(volume_rank_df["trade_date"])):
+        raise ValueError(
+            "... volume rank of {} trade dates in [{}, {}) is not found in {}, first = {}, last = {}, please run "
+            "main.py --switch preprocess --factor vrk for these dates in advance".format(
+                len(missing_dates), bgn_date, stp_date, intermediary_dir, missing_dates[0], missing_dates[-1]))
+
+    # --- parse positions files
+    chunk_size = max(int(np.ceil(len(iter_dates) / proc_num)), 1)
+    pool = get_worker_pool(proc_num)
+    jobs = []
+    for i in range(0, len(iter_dates), chunk_size):
+        chunk_dates = iter_dates[i:i + chunk_size]
+        jobs.append(pool.apply_async(cal_public_info_by_dates,
+                                     args=(chunk_dates, instruments,
+                                           volume_rank_df.loc[volume_rank_df["trade_date"].isin(chunk_dates)],
+                                           futures_by_date_dir),
+                                     error_callback=error_handler,
+                                     ))
+    pool.close()
+    pool.join()
+    chunk_res = [job.get() for job in jobs]
+
+    for value_type in ["pos", "delta"]:
+        factor_lbl = {"pos": "hld_pos", "delta": "dlt_pos"}[value_type]
+
+        # --- reorganize
+        all_factor_df = pd.concat([_[value_type] for _ in chunk_res], axis=0, ignore_index=True)
+
+        # --- save
+        factor_lib_structure = database_structure[factor_lbl]
+        factor_lib = CManagerLibWriter(
+            t_db_name=factor_lib_structure.m_lib_name,
+            t_db_save_dir=intermediary_dir
+        )
+        factor_lib.initialize_table(t_table=factor_lib_structure.m_tab,
+                                    t_remove_existence=run_mode in ["O", "OVERWRITE"])
+        factor_lib.update(t_update_df=all_factor_df, t_using_index=False)
+        factor_lib.close()
+        print("... @ {} {} positions are calculated".format(dt.datetime.now(), value_type))
     return 0
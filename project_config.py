@@ -1,6 +1,7 @@
 import itertools as ittl
 
 instruments_universe = ["IH.CFE", "IF.CFE", "IC.CFE"]
+volume_rank_instruments = instruments_universe + ["IM.CFE"]
 equity_indexes = (
     ("000016.SH", "IH.CFE"),
     ("000300.SH", "IF.CFE"),
@@ -118,6 +119,34 @@ factors = fac_sub_grp_amp + fac_sub_grp_amt \
 
 factors_ma = ["{}-M{:03d}".format(f, w) for f, w in ittl.product(factors, factor_mov_ave_wins)]
 
+# --- families calculated by algs.factor_exposure_moments, together by main.py --factor moments
+moments_families = ["amt", "mtm", "rng", "sgm", "size", "skew", "to"]
+
+# --- factors calculated by each option of main.py --factor, option -> (factors, max window of inputs)
+fac_sub_grps = {
+    "amp": (fac_sub_grp_amp, max(amp_windows)),
+    "amt": (fac_sub_grp_amt, max(amt_windows)),
+    "basis": (fac_sub_grp_basis, max(basis_windows)),
+    "beta": (fac_sub_grp_beta, max(beta_windows)),
+    "cx": (fac_sub_grp_csp + fac_sub_grp_csr + fac_sub_grp_ctp + fac_sub_grp_ctr + fac_sub_grp_cvp + fac_sub_grp_cvr,
+           max(max(_) for _ in manager_cx_windows.values())),
+    "exr": (fac_sub_grp_exr, max(exr_windows)),
+    "mtm": (fac_sub_grp_mtm, max(mtm_windows)),
+    "pos": (fac_sub_grp_pos, 1),
+    "rng": (fac_sub_grp_rng, max(rng_windows)),
+    "sgm": (fac_sub_grp_sgm, max(sgm_windows)),
+    "size": (fac_sub_grp_size, max(size_windows)),
+    "skew": (fac_sub_grp_skew, max(skew_windows)),
+    "smt": (fac_sub_grp_smt, max(smt_windows)),
+    "to": (fac_sub_grp_to, max(to_windows)),
+    "ts": (fac_sub_grp_ts, max(ts_windows)),
+    "twc": (fac_sub_grp_twc, max(twc_windows)),
+}
+fac_sub_grps["moments"] = (
+    [_ for family in moments_families for _ in fac_sub_grps[family][0]],
+    max(fac_sub_grps[family][1] for family in moments_families),
+)
+
 universe_options = {
     "U3": ["IC.CFE", "IF.CFE", "IH.CFE"],
     "UCH": ["IC.CFE", "IH.CFE"],
@@ -128,6 +157,28 @@ universe_options = {
 # --- simulation
 cost_rate = 5e-4
 
+# --- begin date of each switch, used by main.py --switch all
+pipeline_bgn_dates = {
+    "preprocess": "20150416",
+    "test_returns": "20150416",
+    "factors_exposure": "20150416",
+    "fema": "20160615",
+    "store": "20150416",
+    "panel": "20160615",
+    "ic": "20160701",
+    "icsum": "20160701",
+    "gp": "20160701",
+    "gpsum": "20160701",
+    "gpcor": "20160701",
+    "sig": "20160615",
+    "simu": "20160701",
+    "simusum": "20160701",
+}
+
+# --- options of factors_exposure run by main.py --switch all, and the option calculating each factor
+pipeline_factor_options = ["amp", "basis", "beta", "cx", "exr", "moments", "pos", "smt", "ts", "twc"]
+factor_option = {f: option for option in pipeline_factor_options for f in fac_sub_grps[option][0]}
+
 if __name__ == "__main__":
     print("Number of fac_sub_grp_amp   = {:>3d}".format(len(fac_sub_grp_amp)))
     print("Number of fac_sub_grp_amt   = {:>3d}".format(len(fac_sub_grp_amt)))
@@ -65,6 +65,9 @@ research_project_name = os.getcwd().split("\\")[-1]
 research_project_data_dir = os.path.join(research_data_root_dir, research_project_name)
 research_test_returns_dir = os.path.join(research_project_data_dir, "test_returns")
 research_factors_exposure_dir = os.path.join(research_project_data_dir, "factors_exposure")
+research_factors_exposure_store_dir = os.path.join(research_project_data_dir, "factors_exposure_store")
+research_factors_panel_dir = os.path.join(research_project_data_dir, "factors_panel")
+research_factors_exposure_scratch_dir = os.path.join(research_project_data_dir, "factors_exposure_scratch")
 research_intermediary_dir = os.path.join(research_project_data_dir, "intermediary")
 research_ic_tests_dir = os.path.join(research_project_data_dir, "ic_tests")
 research_gp_tests_dir = os.path.join(research_project_data_dir, "gp_tests")
@@ -73,6 +76,7 @@ research_gp_tests_summary_dir = os.path.join(research_project_data_dir, "gp_test
 research_signals_dir = os.path.join(research_project_data_dir, "signals")
 research_simulations_dir = os.path.join(research_project_data_dir, "simulations")
 research_simulations_summary_dir = os.path.join(research_project_data_dir, "simulations_summary")
+research_result_cache_dir = os.path.join(research_project_data_dir, "result_cache")
 
 if __name__ == "__main__":
     from skyrim.winterhold import check_and_mkdir
@@ -81,6 +85,8 @@ if __name__ == "__main__":
     check_and_mkdir(research_project_data_dir)
     check_and_mkdir(research_test_returns_dir)
     check_and_mkdir(research_factors_exposure_dir)
+    check_and_mkdir(research_factors_exposure_store_dir)
+    check_and_mkdir(research_factors_panel_dir)
     check_and_mkdir(research_intermediary_dir)
     check_and_mkdir(research_ic_tests_dir)
     check_and_mkdir(research_gp_tests_dir)
@@ -91,5 +97,6 @@ if __name__ == "__main__":
     check_and_mkdir(os.path.join(research_signals_dir, "models"))
     check_and_mkdir(research_simulations_dir)
     check_and_mkdir(research_simulations_summary_dir)
+    check_and_mkdir(research_result_cache_dir)
 
     print("... directory system for this project has been established.")
@@ -4,6 +4,7 @@ $bgn_date_test = "20160701"
 $stp_date = "20240201"
 
 python main.py --switch preprocess --factor m01 --mode o --bgn $bgn_date --stp $stp_date
+python main.py --switch preprocess --factor vrk --mode o --bgn $bgn_date --stp $stp_date
 python main.py --switch preprocess --factor pub --mode o --bgn $bgn_date --stp $stp_date
 python main.py --switch test_returns --mode o --bgn $bgn_date --stp $stp_date
 python main.py --switch factors_exposure --mode o --bgn $bgn_date --stp $stp_date --factor amp
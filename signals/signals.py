@@ -1,6 +1,5 @@
 import os
 import datetime as dt
-import multiprocessing as mp
 import numpy as np
 import pandas as pd
 from skyrim.falkreath import CLib1Tab1, CManagerLibReader, CManagerLibWriter
@@ -8,6 +7,9 @@ from skyrim.whiterun import CCalendar, CCalendarMonthly, error_handler
 from skyrim.winterhold import check_and_mkdir, plot_lines
 from skyrim.markarth import minimize_utility
 from skyrim.riften import CNAV
+from store.exposure_store import CExposureStoreReader
+from store.test_return_cache import CTestReturnCache
+from pipeline.pool import get_worker_pool
 
 
 def shift_wgt(df: pd.DataFrame, row: str, col: str, val: str, shift_win: int):
@@ -41,7 +43,8 @@ class CSignalBase(object):
     def main_cal_sim(self, cost_rate: float,
                      database_structure: dict[str, CLib1Tab1],
                      test_returns_dir: str,
-                     simulations_dir: str):
+                     simulations_dir: str,
+                     test_return_cache: CTestReturnCache | None = None):
         # --- signals
         sig_lib_id = self.m_sid
         sig_lib_structure = database_structure[sig_lib_id]
@@ -57,19 +60,22 @@ class CSignalBase(object):
         sig_df_shift, dlt_wgt_srs = shift_wgt(sig_df, row="trade_date", col="instrument", val="value",
                                               shift_win=self.m_FIX_TEST_WIN + 1)
 
-        # --- test return library
-        test_return_lib_id = "test_return_o"
-        test_return_lib_structure = database_structure[test_return_lib_id]
-        test_return_lib = CManagerLibReader(t_db_name=test_return_lib_structure.m_lib_name,
-                                            t_db_save_dir=test_returns_dir)
-        test_return_lib.set_default(test_return_lib_structure.m_tab.m_table_name)
-        test_return_df = test_return_lib.read_by_conditions(
-            t_conditions=[
-                ("trade_date", ">=", self.m_bgn_date),
-                ("trade_date", "<", self.m_stp_date),
-            ], t_value_columns=["trade_date", "instrument", "value"]
-        )
-        test_return_lib.close()
+        # --- test return
+        if test_return_cache is not None:
+            test_return_df = test_return_cache.get_frame(self.m_bgn_date, self.m_stp_date)
+        else:
+            test_return_lib_id = "test_return_o"
+            test_return_lib_structure = database_structure[test_return_lib_id]
+            test_return_lib = CManagerLibReader(t_db_name=test_return_lib_structure.m_lib_name,
+                                                t_db_save_dir=test_returns_dir)
+            test_return_lib.set_default(test_return_lib_structure.m_tab.m_table_name)
+            test_return_df = test_return_lib.read_by_conditions(
+                t_conditions=[
+                    ("trade_date", ">=", self.m_bgn_date),
+                    ("trade_date", "<", self.m_stp_date),
+                ], t_value_columns=["trade_date", "instrument", "value"]
+            )
+            test_return_lib.close()
 
         simu_input_df = pd.merge(
             left=sig_df_shift, right=test_return_df,
@@ -111,8 +117,16 @@ class CSignal(CSignalBase):
         self.m_sig_save_df = pd.DataFrame()  # with index = "trade_date", values = ["instrument", "value"]
         self.m_sig_lib_structure = database_structure[self.m_sid]
 
-    def _cal_weight(self, database_structure: dict[str, CLib1Tab1], factors_exposure_dir: str):
-        dfs_list = []
+    def _load_factors(self, database_structure: dict[str, CLib1Tab1], factors_exposure_dir: str,
+                      exposure_store_dir: str | None) -> dict[str, pd.DataFrame]:
+        if exposure_store_dir is not None:
+            store_reader = CExposureStoreReader(exposure_store_dir)
+            store_df = store_reader.read(t_factors=list(self.m_factors),
+                                         t_bgn_date=self.m_bgn_date, t_stp_date=self.m_stp_date)
+            return {factor: store_df[["trade_date", "instrument", factor]].rename(mapper={factor: "value"}, axis=1)
+                    for factor in self.m_factors}
+
+        factor_dfs = {}
         for factor in self.m_factors:
             factor_lib_structure = database_structure[factor]
             factor_lib = CManagerLibReader(
@@ -120,11 +134,19 @@ class CSignal(CSignalBase):
                 t_db_save_dir=factors_exposure_dir
             )
             factor_lib.set_default(factor_lib_structure.m_tab.m_table_name)
-            df = factor_lib.read_by_conditions(t_conditions=[
+            factor_dfs[factor] = factor_lib.read_by_conditions(t_conditions=[
                 ("trade_date", ">=", self.m_bgn_date),
                 ("trade_date", "<", self.m_stp_date),
             ], t_value_columns=["trade_date", "instrument", "value"])
             factor_lib.close()
+        return factor_dfs
+
+    def _cal_weight(self, database_structure: dict[str, CLib1Tab1], factors_exposure_dir: str,
+                    exposure_store_dir: str | None = None):
+        dfs_list = []
+        factor_dfs = self._load_factors(database_structure, factors_exposure_dir, exposure_store_dir)
+        for factor in self.m_factors:
+            df = factor_dfs[factor]
             pivot_df = pd.pivot_table(data=df, index="trade_date", columns="instrument", values="value")[
                 self.m_universe]
             self.m_factors_weight[factor] = pivot_df.sort_index()
@@ -146,7 +168,8 @@ class CSignal(CSignalBase):
         sig_lib.close()
         return 0
 
-    def main_cal_sig(self, database_structure: dict[str, CLib1Tab1], factors_exposure_dir: str):
+    def main_cal_sig(self, database_structure: dict[str, CLib1Tab1], factors_exposure_dir: str,
+                     exposure_store_dir: str | None = None):
         pass
 
 
@@ -168,15 +191,17 @@ class CSignalFixWeight(CSignal):
         y = self.m_fix_weights[xt.columns]
         return xt @ y
 
-    def main_cal_sig(self, database_structure: dict[str, CLib1Tab1], factors_exposure_dir: str):
-        self._cal_weight(database_structure, factors_exposure_dir)
+    def main_cal_sig(self, database_structure: dict[str, CLib1Tab1], factors_exposure_dir: str,
+                     exposure_store_dir: str | None = None):
+        self._cal_weight(database_structure, factors_exposure_dir, exposure_store_dir)
         self._save()
         return 0
 
 
 class CSignalFixWeightFMaSyn(CSignalFixWeight):
-    def _cal_weight(self, database_structure: dict[str, CLib1Tab1], factors_exposure_dir: str):
-        super()._cal_weight(database_structure, factors_exposure_dir)
+    def _cal_weight(self, database_structure: dict[str, CLib1Tab1], factors_exposure_dir: str,
+                    exposure_store_dir: str | None = None):
+        super()._cal_weight(database_structure, factors_exposure_dir, exposure_store_dir)
         sig_grp_df = self.m_raw_wgt_df.groupby(lambda z: z).apply(self._sumprod_weights)
         sig_nrm_df = sig_grp_df.div(sig_grp_df.abs().sum(axis=1), axis=0).fillna(0)
         self.m_sig_save_df = sig_nrm_df.stack().reset_index(level=1)
@@ -194,8 +219,9 @@ class CSignalFixWeightFSynMa(CSignalFixWeight):
         super().__init__(sid, universe, factors_struct, run_mode, bgn_date, stp_date, signals_dir, database_structure,
                          calendar_path)
 
-    def _cal_weight(self, database_structure: dict[str, CLib1Tab1], factors_exposure_dir: str):
-        super()._cal_weight(database_structure, factors_exposure_dir)
+    def _cal_weight(self, database_structure: dict[str, CLib1Tab1], factors_exposure_dir: str,
+                    exposure_store_dir: str | None = None):
+        super()._cal_weight(database_structure, factors_exposure_dir, exposure_store_dir)
         sig_grp_df = self.m_raw_wgt_df.groupby(lambda z: z).apply(self._sumprod_weights)
         sig_nrm_df = sig_grp_df.div(sig_grp_df.abs().sum(axis=1), axis=0).fillna(0)
         sig_rol_df = sig_nrm_df.rolling(window=self.m_mov_ave_win).mean()
@@ -312,8 +338,9 @@ class CSignalDynamicWeight(CSignal):
         y = self.m_opt_wgt_df.loc[t, xt.columns]
         return xt @ y
 
-    def _cal_weight(self, database_structure: dict[str, CLib1Tab1], factors_exposure_dir: str):
-        super()._cal_weight(database_structure, factors_exposure_dir)
+    def _cal_weight(self, database_structure: dict[str, CLib1Tab1], factors_exposure_dir: str,
+                    exposure_store_dir: str | None = None):
+        super()._cal_weight(database_structure, factors_exposure_dir, exposure_store_dir)
         header_df = pd.DataFrame({"trade_date": self.m_iter_dates})
         opt_wgt_df = pd.DataFrame.from_dict(self.m_opt_wgt, orient="index")
         self.m_opt_wgt_df = pd.merge(
@@ -329,9 +356,10 @@ class CSignalDynamicWeight(CSignal):
         self.m_sig_save_df = sig_df.stack().reset_index(level=1)
         return 0
 
-    def main_cal_sig(self, database_structure: dict[str, CLib1Tab1], factors_exposure_dir: str):
+    def main_cal_sig(self, database_structure: dict[str, CLib1Tab1], factors_exposure_dir: str,
+                     exposure_store_dir: str | None = None):
         self._cal_models()
-        self._cal_weight(database_structure, factors_exposure_dir)
+        self._cal_weight(database_structure, factors_exposure_dir, exposure_store_dir)
         self._save()
         return 0
 
@@ -345,11 +373,12 @@ def cal_signals_mp(
         factors_exposure_dir: str,
         gp_tests_dir: str,
         database_structure: dict[str, CLib1Tab1],
-        calendar_path: str):
+        calendar_path: str,
+        exposure_store_dir: str | None = None):
     t0 = dt.datetime.now()
 
     # --- for fix
-    pool = mp.Pool(processes=proc_num)
+    pool = get_worker_pool(proc_num)
     for sid in sids_f_ma_syn_fix:
         sig_struct = signals_structure["sigFixFMaSyn"][sid]
         signal = CSignalFixWeightFMaSyn(sid, sig_struct["universe"],
@@ -360,7 +389,7 @@ def cal_signals_mp(
                                         calendar_path)
         pool.apply_async(
             signal.main_cal_sig,
-            args=(database_structure, factors_exposure_dir),
+            args=(database_structure, factors_exposure_dir, exposure_store_dir),
             error_callback=error_handler,
         )
     for sid in sids_f_syn_ma_fix:
@@ -373,7 +402,7 @@ def cal_signals_mp(
                                         calendar_path)
         pool.apply_async(
             signal.main_cal_sig,
-            args=(database_structure, factors_exposure_dir),
+            args=(database_structure, factors_exposure_dir, exposure_store_dir),
             error_callback=error_handler,
         )
 
@@ -391,7 +420,7 @@ def cal_signals_mp(
                                       calendar_path)
         pool.apply_async(
             signal.main_cal_sig,
-            args=(database_structure, factors_exposure_dir),
+            args=(database_structure, factors_exposure_dir, exposure_store_dir),
             error_callback=error_handler,
         )
 
@@ -414,23 +443,27 @@ def cal_simulations_mp(
         calendar_path: str
 ):
     t0 = dt.datetime.now()
-
-    # --- for fix
-    pool = mp.Pool(processes=proc_num)
-    for sid in sids:
-        signal = CSignalBase(sid, run_mode, bgn_date, stp_date, signals_dir, calendar_path)
-        pool.apply_async(
-            signal.main_cal_sim,
-            args=(
-                cost_rate,
-                database_structure,
-                test_returns_dir,
-                simulations_dir,
-            ),
-            error_callback=error_handler,
-        )
-    pool.close()
-    pool.join()
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+    with CTestReturnCache("test_return_o", bgn_date, stp_date, test_returns_dir,
+                          database_structure) as test_return_cache:
+        # --- for fix
+        pool = get_worker_pool(proc_num)
+        for sid in sids:
+            signal = CSignalBase(sid, run_mode, bgn_date, stp_date, signals_dir, calendar_path)
+            pool.apply_async(
+                signal.main_cal_sim,
+                args=(
+                    cost_rate,
+                    database_structure,
+                    test_returns_dir,
+                    simulations_dir,
+                    test_return_cache,
+                ),
+                error_callback=error_handler,
+            )
+        pool.close()
+        pool.join()
     t1 = dt.datetime.now()
     print("... total time consuming: {:.2f} seconds".format((t1 - t0).total_seconds()))
     return 0
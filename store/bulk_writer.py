@@ -0,0 +1,80 @@
+"""
+A bulk writer for the CLib1Tab1 libraries of algorithms with many outputs.
+
+Tables are still created by CManagerLibWriter, so their schema is not changed. Then
+the rows of each library are inserted with one executemany in one transaction, and
+    synchronous = OFF
+is set for the load. If the table is created again (t_remove_existence = True), there
+is nothing to protect, so the rollback journal is also kept in memory. Rows with the
+same primary keys as existing rows replace them.
+"""
+
+import os
+import sqlite3
+import datetime as dt
+import pandas as pd
+from skyrim.falkreath import CLib1Tab1, CManagerLibWriter
+
+
+class CBulkLibWriter(object):
+    def __init__(self, t_database_structure: dict[str, CLib1Tab1], t_db_save_dir: str):
+        self.m_database_structure = t_database_structure
+        self.m_db_save_dir = t_db_save_dir
+
+    def _init_lib(self, t_lib_structure: CLib1Tab1, t_remove_existence: bool):
+        lib_writer = CManagerLibWriter(t_db_name=t_lib_structure.m_lib_name, t_db_save_dir=self.m_db_save_dir)
+        lib_writer.initialize_table(t_table=t_lib_structure.m_tab, t_remove_existence=t_remove_existence)
+        lib_writer.close()
+        return 0
+
+    @staticmethod
+    def _get_rows(t_update_df: pd.DataFrame, t_using_index: bool) -> list[tuple]:
+        # --- values are converted to python types column by column, much faster than itertuples
+        columns = [t_update_df.iloc[:, j].tolist() for j in range(t_update_df.shape[1])]
+        if t_using_index:
+            columns.insert(0, t_update_df.index.tolist())
+        return list(zip(*columns))
+
+    def _write_lib(self, t_lib_structure: CLib1Tab1, t_update_df: pd.DataFrame,
+                   t_remove_existence: bool, t_using_index: bool) -> int:
+        self._init_lib(t_lib_structure, t_remove_existence)
+        rows = self._get_rows(t_update_df, t_using_index)
+        if not rows:
+            return 0
+        connection = sqlite3.connect(os.path.join(self.m_db_save_dir, t_lib_structure.m_lib_name),
+                                     isolation_level=None)
+        try:
+            connection.execute("PRAGMA synchronous = OFF")
+            if t_remove_existence:
+                connection.execute("PRAGMA journal_mode = MEMORY")
+            connection.execute("BEGIN")
+            connection.executemany("INSERT OR REPLACE INTO {} VALUES ({})".format(
+                t_lib_structure.m_tab.m_table_name, ", ".join(["?"] * len(rows[0]))), rows)
+            connection.execute("COMMIT")
+        except Exception:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+        return len(rows)
+
+    def write(self, t_update_dfs: dict[str, pd.DataFrame], t_remove_existence: bool, t_using_index: bool = True):
+        """
+
+        :param t_update_dfs: {factor_lbl: update_df}, columns of update_df are in the same order as the
+                             columns of the table, like ["instrument", "value"] with index = trade_date
+        :param t_remove_existence: if True, existing tables would be removed
+        :param t_using_index: if True, the index of update_df would be the first column
+        :return:
+        """
+        t0 = dt.datetime.now()
+        rows_num = 0
+        for factor_lbl, update_df in t_update_dfs.items():
+            rows_num += self._write_lib(self.m_database_structure[factor_lbl], update_df,
+                                        t_remove_existence, t_using_index)
+        t1 = dt.datetime.now()
+        seconds = (t1 - t0).total_seconds()
+        print("... @ {} {} rows of {} libraries written, {:.0f} rows/sec".format(
+            t1, rows_num, len(t_update_dfs), rows_num / seconds if seconds > 0 else 0))
+        return 0
@@ -0,0 +1,189 @@
+"""
+A date-partitioned columnar store for factor exposures.
+
+Layout of the store:
+    {store_dir}/{year}/keys.npz       trade_date and instrument of each row, sorted by (trade_date, instrument)
+    {store_dir}/{year}/{factor}.npy   float64 values of a factor, aligned with keys.npz of the same year
+
+The writer is NOT process-safe, use it from a single process.
+"""
+
+import os
+import datetime as dt
+import numpy as np
+import pandas as pd
+from rich.progress import track
+from skyrim.falkreath import CLib1Tab1, CManagerLibReader
+
+
+class CExposureStore(object):
+    def __init__(self, t_store_dir: str):
+        self.m_store_dir = t_store_dir
+
+    def _get_years(self, t_bgn_date: str = "00000000", t_stp_date: str = "99999999") -> list[str]:
+        if not os.path.exists(self.m_store_dir):
+            return []
+        return sorted(_ for _ in os.listdir(self.m_store_dir)
+                      if _.isdigit() and (t_bgn_date[0:4] <= _ <= t_stp_date[0:4]))
+
+    def _get_partition_dir(self, t_year: str) -> str:
+        return os.path.join(self.m_store_dir, t_year)
+
+    def _get_column_path(self, t_year: str, t_factor: str) -> str:
+        return os.path.join(self._get_partition_dir(t_year), "{}.npy".format(t_factor))
+
+    def _load_keys(self, t_year: str) -> pd.MultiIndex:
+        keys_path = os.path.join(self._get_partition_dir(t_year), "keys.npz")
+        if os.path.exists(keys_path):
+            keys = np.load(keys_path)
+            return pd.MultiIndex.from_arrays([keys["trade_date"], keys["instrument"]],
+                                             names=["trade_date", "instrument"])
+        return pd.MultiIndex.from_arrays([[], []], names=["trade_date", "instrument"])
+
+    def get_factors(self) -> list[str]:
+        res = set()
+        for year in self._get_years():
+            res.update(_[:-4] for _ in os.listdir(self._get_partition_dir(year)) if _.endswith(".npy"))
+        return sorted(res)
+
+
+class CExposureStoreWriter(CExposureStore):
+    @staticmethod
+    def _save_array(t_path: str, t_array: np.ndarray):
+        tmp_path = t_path + ".tmp.npy"
+        np.save(tmp_path, t_array)
+        os.replace(tmp_path, t_path)
+        return 0
+
+    def _save_keys(self, t_year: str, t_keys: pd.MultiIndex):
+        keys_path = os.path.join(self._get_partition_dir(t_year), "keys.npz")
+        tmp_path = keys_path + ".tmp.npz"
+        np.savez(tmp_path,
+                 trade_date=t_keys.get_level_values("trade_date").to_numpy(dtype=str),
+                 instrument=t_keys.get_level_values("instrument").to_numpy(dtype=str))
+        os.replace(tmp_path, keys_path)
+        return 0
+
+    def remove_factors(self, t_factors: list[str]):
+        for year in self._get_years():
+            for factor in t_factors:
+                if os.path.exists(column_path := self._get_column_path(year, factor)):
+                    os.remove(column_path)
+        return 0
+
+    def update(self, t_update_df: pd.DataFrame, t_remove_existence: bool = False):
+        """
+
+        :param t_update_df: columns = ["trade_date", "instrument", factor_0, factor_1, ...]
+        :param t_remove_existence: if True, all existing values of the factors in t_update_df would be removed
+        :return:
+        """
+        factors = [_ for _ in t_update_df.columns if _ not in ["trade_date", "instrument"]]
+        if t_remove_existence:
+            self.remove_factors(factors)
+
+        for year, year_df in t_update_df.groupby(by=t_update_df["trade_date"].str[0:4]):
+            os.makedirs(self._get_partition_dir(year), exist_ok=True)
+            old_keys = self._load_keys(year)
+            new_keys = pd.MultiIndex.from_frame(year_df[["trade_date", "instrument"]])
+            all_keys = old_keys.union(new_keys).sort_values()
+
+            # --- realign existing columns if new rows are added to this partition
+            if len(all_keys) != len(old_keys):
+                for column_file in os.listdir(self._get_partition_dir(year)):
+                    if column_file.endswith(".npy") and column_file[:-4] not in factors:
+                        column_path = os.path.join(self._get_partition_dir(year), column_file)
+                        old_srs = pd.Series(data=np.load(column_path), index=old_keys)
+                        self._save_array(column_path, old_srs.reindex(all_keys).to_numpy(dtype=np.float64))
+
+            # --- update columns in this call
+            new_loc = all_keys.get_indexer(new_keys)
+            for factor in factors:
+                column_path = self._get_column_path(year, factor)
+                if os.path.exists(column_path):
+                    old_srs = pd.Series(data=np.load(column_path), index=old_keys)
+                    values = old_srs.reindex(all_keys).to_numpy(dtype=np.float64)
+                else:
+                    values = np.full(len(all_keys), np.nan)
+                values[new_loc] = year_df[factor].to_numpy(dtype=np.float64)
+                self._save_array(column_path, values)
+            self._save_keys(year, all_keys)
+        return 0
+
+
+class CExposureStoreReader(CExposureStore):
+    def read(self, t_factors: list[str], t_bgn_date: str, t_stp_date: str) -> pd.DataFrame:
+        """
+
+        :param t_factors:
+        :param t_bgn_date:
+        :param t_stp_date: not included
+        :return: a DataFrame with columns = ["trade_date", "instrument"] + t_factors,
+                 values of factors not found in the store are NaN
+        """
+        dfs = []
+        for year in self._get_years(t_bgn_date, t_stp_date):
+            keys = self._load_keys(year)
+            trade_dates = keys.get_level_values("trade_date")
+            filter_dates = (trade_dates >= t_bgn_date) & (trade_dates < t_stp_date)
+            year_data = {
+                "trade_date": trade_dates[filter_dates],
+                "instrument": keys.get_level_values("instrument")[filter_dates],
+            }
+            for factor in t_factors:
+                if os.path.exists(column_path := self._get_column_path(year, factor)):
+                    year_data[factor] = np.load(column_path, mmap_mode="r")[filter_dates]
+                else:
+                    year_data[factor] = np.nan
+            dfs.append(pd.DataFrame(year_data))
+        if dfs:
+            return pd.concat(dfs, axis=0, ignore_index=True)
+        return pd.DataFrame(columns=["trade_date", "instrument"] + t_factors)
+
+
+def pack_factors_into_store(
+        factors: list[str],
+        run_mode: str, bgn_date: str, stp_date: str | None,
+        database_structure: dict[str, CLib1Tab1],
+        factors_exposure_dir: str,
+        exposure_store_dir: str,
+        batch_size: int = 100,
+):
+    """
+    copy factor exposures from CLib1Tab1 libraries into the columnar store.
+    Factors are merged into wide DataFrames of batch_size factors, so each
+    partition of the store is rewritten once per batch instead of once per factor.
+
+    :param factors:
+    :param run_mode:
+    :param bgn_date:
+    :param stp_date:
+    :param database_structure:
+    :param factors_exposure_dir:
+    :param exposure_store_dir:
+    :param batch_size:
+    :return:
+    """
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+
+    store_writer = CExposureStoreWriter(exposure_store_dir)
+    for i in track(range(0, len(factors), batch_size), description="[INF] Packing factors into store ..."):
+        batch_srs = {}
+        for factor in factors[i:i + batch_size]:
+            factor_lib_structure = database_structure[factor]
+            factor_lib = CManagerLibReader(
+                t_db_name=factor_lib_structure.m_lib_name,
+                t_db_save_dir=factors_exposure_dir
+            )
+            factor_lib.set_default(factor_lib_structure.m_tab.m_table_name)
+            factor_df = factor_lib.read_by_conditions(t_conditions=[
+                ("trade_date", ">=", bgn_date),
+                ("trade_date", "<", stp_date),
+            ], t_value_columns=["trade_date", "instrument", "value"])
+            factor_lib.close()
+            batch_srs[factor] = factor_df.set_index(["trade_date", "instrument"])["value"]
+        batch_df = pd.DataFrame(batch_srs).reset_index()
+        store_writer.update(t_update_df=batch_df, t_remove_existence=run_mode in ["O", "OVERWRITE"])
+    print("... @ {} {} factors packed into {}".format(dt.datetime.now(), len(factors), exposure_store_dir))
+    return 0
@@ -0,0 +1,140 @@
+"""
+A dense, memory-mapped factor panel with shape = (date, instrument, factor).
+
+Layout of the panel:
+    {panel_dir}/panel.f8         float64 values in C order, NaN if not available
+    {panel_dir}/dates.npy        trade dates, sorted
+    {panel_dir}/instruments.npy  instruments
+    {panel_dir}/factors.npy      factors
+"""
+
+import os
+import datetime as dt
+import numpy as np
+import pandas as pd
+from rich.progress import track
+from skyrim.falkreath import CLib1Tab1, CManagerLibReader
+from skyrim.whiterun import CCalendar
+from store.exposure_store import CExposureStoreReader
+
+
+class CFactorPanel(object):
+    def __init__(self, t_panel_dir: str):
+        self.m_panel_dir = t_panel_dir
+        self.m_dates: np.ndarray = np.load(os.path.join(t_panel_dir, "dates.npy"))
+        self.m_instruments: np.ndarray = np.load(os.path.join(t_panel_dir, "instruments.npy"))
+        self.m_factors: np.ndarray = np.load(os.path.join(t_panel_dir, "factors.npy"))
+        self.m_factors_loc = {f: j for j, f in enumerate(self.m_factors)}
+        self.m_instruments_loc = {z: k for k, z in enumerate(self.m_instruments)}
+        self.m_data = np.memmap(os.path.join(t_panel_dir, "panel.f8"), dtype=np.float64, mode="r",
+                                shape=(len(self.m_dates), len(self.m_instruments), len(self.m_factors)))
+
+    def get_date_slice(self, t_bgn_date: str, t_stp_date: str) -> slice:
+        return slice(int(np.searchsorted(self.m_dates, t_bgn_date, side="left")),
+                     int(np.searchsorted(self.m_dates, t_stp_date, side="left")))
+
+    def get_instruments_loc(self, t_instruments: list[str]) -> list[int]:
+        return [self.m_instruments_loc[_] for _ in t_instruments]
+
+    def get_factors_loc(self, t_factors: list[str]) -> list[int]:
+        return [self.m_factors_loc[_] for _ in t_factors]
+
+    def get_factor(self, t_factor: str, t_bgn_date: str = "00000000", t_stp_date: str = "99999999") -> np.ndarray:
+        """
+
+        :return: a zero-copy view with shape = (date, instrument)
+        """
+        return self.m_data[self.get_date_slice(t_bgn_date, t_stp_date), :, self.m_factors_loc[t_factor]]
+
+    def get_factors(self, t_factors: list[str],
+                    t_bgn_date: str = "00000000", t_stp_date: str = "99999999") -> np.ndarray:
+        """
+
+        :return: array with shape = (date, instrument, factor), it is a zero-copy view
+                 if t_factors are stored contiguously in the panel, else a copy
+        """
+        date_slice = self.get_date_slice(t_bgn_date, t_stp_date)
+        loc = self.get_factors_loc(t_factors)
+        if loc and (loc == list(range(loc[0], loc[0] + len(loc)))):
+            return self.m_data[date_slice, :, loc[0]:loc[0] + len(loc)]
+        return self.m_data[date_slice][:, :, loc]
+
+    def get_frame(self, t_factor: str, t_bgn_date: str = "00000000", t_stp_date: str = "99999999") -> pd.DataFrame:
+        date_slice = self.get_date_slice(t_bgn_date, t_stp_date)
+        return pd.DataFrame(data=self.get_factor(t_factor, t_bgn_date, t_stp_date),
+                            index=pd.Index(self.m_dates[date_slice], name="trade_date"),
+                            columns=pd.Index(self.m_instruments, name="instrument"))
+
+
+def build_factor_panel(
+        factors: list[str], universe: list[str],
+        bgn_date: str, stp_date: str | None,
+        database_structure: dict[str, CLib1Tab1],
+        factors_exposure_dir: str,
+        panel_dir: str,
+        calendar_path: str,
+        exposure_store_dir: str | None = None,
+        batch_size: int = 100,
+):
+    """
+    materialise factor exposures into a memory-mapped panel, exposures are read
+    from the columnar store if exposure_store_dir is provided, else from CLib1Tab1 libraries.
+
+    :param factors:
+    :param universe:
+    :param bgn_date:
+    :param stp_date:
+    :param database_structure:
+    :param factors_exposure_dir:
+    :param panel_dir:
+    :param calendar_path:
+    :param exposure_store_dir:
+    :param batch_size:
+    :return:
+    """
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+
+    calendar = CCalendar(calendar_path)
+    iter_dates = calendar.get_iter_list(bgn_date, stp_date, True)
+    os.makedirs(panel_dir, exist_ok=True)
+
+    panel_path = os.path.join(panel_dir, "panel.f8")
+    panel = np.memmap(panel_path, dtype=np.float64, mode="w+", shape=(len(iter_dates), len(universe), len(factors)))
+    panel[:] = np.nan
+    store_reader = CExposureStoreReader(exposure_store_dir) if exposure_store_dir is not None else None
+    for i in track(range(0, len(factors), batch_size), description="[INF] Building factor panel ..."):
+        batch_factors = factors[i:i + batch_size]
+        if store_reader is not None:
+            batch_df = store_reader.read(t_factors=batch_factors, t_bgn_date=bgn_date, t_stp_date=stp_date)
+        else:
+            batch_srs = {}
+            for factor in batch_factors:
+                factor_lib_structure = database_structure[factor]
+                factor_lib = CManagerLibReader(
+                    t_db_name=factor_lib_structure.m_lib_name,
+                    t_db_save_dir=factors_exposure_dir
+                )
+                factor_lib.set_default(factor_lib_structure.m_tab.m_table_name)
+                factor_df = factor_lib.read_by_conditions(t_conditions=[
+                    ("trade_date", ">=", bgn_date),
+                    ("trade_date", "<", stp_date),
+                ], t_value_columns=["trade_date", "instrument", "value"])
+                factor_lib.close()
+                batch_srs[factor] = factor_df.set_index(["trade_date", "instrument"])["value"]
+            batch_df = pd.DataFrame(batch_srs, columns=batch_factors).reset_index()
+
+        # --- align to (date, instrument, factor)
+        full_index = pd.MultiIndex.from_product([iter_dates, universe], names=["trade_date", "instrument"])
+        aligned_df = batch_df.set_index(["trade_date", "instrument"])[batch_factors].reindex(full_index)
+        panel[:, :, i:i + len(batch_factors)] = aligned_df.to_numpy(dtype=np.float64).reshape(
+            len(iter_dates), len(universe), len(batch_factors))
+    panel.flush()
+    del panel
+
+    np.save(os.path.join(panel_dir, "dates.npy"), np.array(iter_dates, dtype=str))
+    np.save(os.path.join(panel_dir, "instruments.npy"), np.array(universe, dtype=str))
+    np.save(os.path.join(panel_dir, "factors.npy"), np.array(factors, dtype=str))
+    print("... @ {} panel of {} dates x {} instruments x {} factors built".format(
+        dt.datetime.now(), len(iter_dates), len(universe), len(factors)))
+    return 0
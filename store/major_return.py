@@ -0,0 +1,50 @@
+import os
+import functools
+import pandas as pd
+from skyrim.falkreath import CManagerLibReader
+
+# --- one reader of major_return.db for each by_instrument_dir in each process,
+#     a reader inherited from the parent process by fork is not reused
+_major_return_readers: dict[str, tuple[int, CManagerLibReader]] = {}
+
+
+def _get_major_return_reader(by_instrument_dir: str) -> CManagerLibReader:
+    pid = os.getpid()
+    if (by_instrument_dir not in _major_return_readers) or (_major_return_readers[by_instrument_dir][0] != pid):
+        _major_return_readers[by_instrument_dir] = (pid, CManagerLibReader(by_instrument_dir, "major_return.db"))
+    return _major_return_readers[by_instrument_dir][1]
+
+
+@functools.lru_cache(maxsize=64)
+def _load_major_return(instrument: str, value_columns: tuple[str], by_instrument_dir: str,
+                       bgn_date: str | None, stp_date: str) -> pd.DataFrame:
+    major_return_lib_reader = _get_major_return_reader(by_instrument_dir)
+    if bgn_date is None:
+        major_return_df = major_return_lib_reader.read(
+            t_value_columns=list(value_columns),
+            t_using_default_table=False,
+            t_table_name=instrument.replace(".", "_"),
+        )
+    else:
+        major_return_lib_reader.set_default(t_default_table_name=instrument.replace(".", "_"))
+        major_return_df = major_return_lib_reader.read_by_conditions(t_conditions=[
+            ("trade_date", ">=", bgn_date),
+            ("trade_date", "<", stp_date),
+        ], t_value_columns=list(value_columns))
+    return major_return_df.set_index("trade_date")
+
+
+def read_major_return(instrument: str, value_columns: list[str], by_instrument_dir: str,
+                      bgn_date: str | None = None, stp_date: str = "99999999") -> pd.DataFrame:
+    """
+    frames are memoized in each process by (instrument, value_columns, dates), so
+    tasks running in the same pool worker would not parse the same table again
+
+    :param instrument: like "IH.CFE"
+    :param value_columns: must include "trade_date"
+    :param by_instrument_dir:
+    :param bgn_date: if None, the whole history would be loaded
+    :param stp_date: not included, only used when bgn_date is provided
+    :return: a DataFrame with index = trade_date, it is a copy and free to be modified
+    """
+    return _load_major_return(instrument, tuple(value_columns), by_instrument_dir, bgn_date, stp_date).copy()
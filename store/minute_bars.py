@@ -0,0 +1,173 @@
+"""
+A columnar copy of minute bars in em01_major.db, saved next to it.
+
+Layout of the copy, partitioned by instrument and year:
+    {intermediary_dir}/em01_major.bars/{instrument}/{year}/index.npz    trade_date, offset and length of each day
+    {intermediary_dir}/em01_major.bars/{instrument}/{year}/{column}.npy values of a column, sorted by
+                                                                        (trade_date, timestamp)
+
+Minutes of a day are contiguous, so any range of days in a partition is a slice
+of the column arrays, and the arrays are memory mapped when read.
+"""
+
+import os
+import shutil
+import datetime as dt
+import numpy as np
+import pandas as pd
+from skyrim.falkreath import CLib1Tab1, CManagerLibReader
+
+minute_bars_columns_dtype = {
+    "timestamp": np.int64,
+    "open": np.float32,
+    "high": np.float32,
+    "low": np.float32,
+    "close": np.float32,
+    "preclose": np.float32,
+    "volume": np.float64,
+    "amount": np.float64,
+    "oi": np.float64,
+}
+minute_bars_columns = list(minute_bars_columns_dtype)
+
+
+class CMinuteBars(object):
+    def __init__(self, t_intermediary_dir: str):
+        self.m_bars_dir = os.path.join(t_intermediary_dir, "em01_major.bars")
+
+    def _get_partition_dir(self, t_instrument: str, t_year: str) -> str:
+        return os.path.join(self.m_bars_dir, t_instrument, t_year)
+
+    def _get_years(self, t_instrument: str, t_bgn_date: str = "00000000", t_stp_date: str = "99999999") -> list[str]:
+        if not os.path.exists(instrument_dir := os.path.join(self.m_bars_dir, t_instrument)):
+            return []
+        return sorted(_ for _ in os.listdir(instrument_dir)
+                      if _.isdigit() and (t_bgn_date[0:4] <= _ <= t_stp_date[0:4]))
+
+
+class CMinuteBarsWriter(CMinuteBars):
+    @staticmethod
+    def _save_array(t_path: str, t_array: np.ndarray):
+        tmp_path = t_path + ".tmp.npy"
+        np.save(tmp_path, t_array)
+        os.replace(tmp_path, t_path)
+        return 0
+
+    def remove_all(self):
+        if os.path.exists(self.m_bars_dir):
+            shutil.rmtree(self.m_bars_dir)
+        return 0
+
+    def update(self, t_em01_df: pd.DataFrame):
+        """
+
+        :param t_em01_df: columns = ["instrument", "trade_date"] + minute_bars_columns,
+                          partitions found in it would be replaced as a whole, so it
+                          should contain all minutes of these years
+        :return:
+        """
+        for (instrument, year), year_df in t_em01_df.groupby(by=[t_em01_df["instrument"],
+                                                                 t_em01_df["trade_date"].str[0:4]]):
+            partition_dir = self._get_partition_dir(instrument, year)
+            os.makedirs(partition_dir, exist_ok=True)
+            sorted_df = year_df.sort_values(by=["trade_date", "timestamp"], kind="stable")
+            for column, dtype in minute_bars_columns_dtype.items():
+                self._save_array(os.path.join(partition_dir, "{}.npy".format(column)),
+                                 sorted_df[column].to_numpy(dtype=dtype))
+
+            day_size = sorted_df.groupby(by="trade_date", sort=True).size()
+            day_length = day_size.to_numpy(dtype=np.int64)
+            index_path = os.path.join(partition_dir, "index.npz")
+            tmp_path = index_path + ".tmp.npz"
+            np.savez(tmp_path, trade_date=day_size.index.to_numpy(dtype=str),
+                     offset=np.cumsum(day_length) - day_length, length=day_length)
+            os.replace(tmp_path, index_path)
+        return 0
+
+
+class CMinuteBarsReader(CMinuteBars):
+    def __init__(self, t_intermediary_dir: str):
+        super().__init__(t_intermediary_dir)
+        self.m_partitions: dict[tuple[str, str], tuple[np.ndarray, np.ndarray]] = {}
+        self.m_columns: dict[tuple[str, str, str], np.ndarray] = {}
+
+    def _get_partition_days(self, t_instrument: str, t_year: str) -> tuple[np.ndarray, np.ndarray]:
+        if (t_instrument, t_year) not in self.m_partitions:
+            index = np.load(os.path.join(self._get_partition_dir(t_instrument, t_year), "index.npz"))
+            offsets = np.append(index["offset"], index["offset"][-1] + index["length"][-1])
+            self.m_partitions[(t_instrument, t_year)] = (index["trade_date"], offsets)
+        return self.m_partitions[(t_instrument, t_year)]
+
+    def _get_partition_column(self, t_instrument: str, t_year: str, t_column: str) -> np.ndarray:
+        if (t_instrument, t_year, t_column) not in self.m_columns:
+            column_path = os.path.join(self._get_partition_dir(t_instrument, t_year), "{}.npy".format(t_column))
+            self.m_columns[(t_instrument, t_year, t_column)] = np.load(column_path, mmap_mode="r")
+        return self.m_columns[(t_instrument, t_year, t_column)]
+
+    def get_days(self, t_instrument: str, t_bgn_date: str, t_stp_date: str,
+                 t_columns: list[str]) -> tuple[np.ndarray, np.ndarray, dict[str, np.ndarray]]:
+        """
+
+        :param t_instrument: the same as instrument in em01_major, like "IH"
+        :param t_bgn_date:
+        :param t_stp_date: not included
+        :param t_columns: some of minute_bars_columns
+        :return: (trade_dates with shape = (d,),
+                  offsets with shape = (d + 1,), minutes of trade_dates[i] are [offsets[i], offsets[i + 1]),
+                  {column: minute bars of these days}), values are read-only views of the
+                  memory mapped arrays if all days are in one year, else they are copies
+        """
+        day_dates, day_offsets, column_slices = [], [np.zeros(1, dtype=np.int64)], {_: [] for _ in t_columns}
+        size = 0
+        for year in self._get_years(t_instrument, t_bgn_date, t_stp_date):
+            trade_dates, offsets = self._get_partition_days(t_instrument, year)
+            i0, i1 = np.searchsorted(trade_dates, [t_bgn_date, t_stp_date], side="left")
+            lo, hi = offsets[i0], offsets[i1]
+            day_dates.append(trade_dates[i0:i1])
+            day_offsets.append(offsets[i0 + 1:i1 + 1] - lo + size)
+            for column in t_columns:
+                column_slices[column].append(self._get_partition_column(t_instrument, year, column)[lo:hi])
+            size += hi - lo
+
+        if len(day_dates) == 1:
+            return day_dates[0], np.concatenate(day_offsets), {k: v[0] for k, v in column_slices.items()}
+        return (np.concatenate(day_dates) if day_dates else np.array([], dtype=str),
+                np.concatenate(day_offsets),
+                {k: np.concatenate(v) if v else np.array([], dtype=minute_bars_columns_dtype[k])
+                 for k, v in column_slices.items()})
+
+
+def update_minute_bars(run_mode: str, bgn_date: str, stp_date: str | None,
+                       database_structure: dict[str, CLib1Tab1], intermediary_dir: str):
+    """
+    copy minute bars from em01_major.db into the columnar partitions, all
+    partitions of the years from bgn_date to stp_date are rebuilt
+
+    :param run_mode:
+    :param bgn_date:
+    :param stp_date:
+    :param database_structure:
+    :param intermediary_dir:
+    :return:
+    """
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+
+    bars_writer = CMinuteBarsWriter(intermediary_dir)
+    if run_mode in ["O", "OVERWRITE"]:
+        bars_writer.remove_all()
+
+    em01_major_lib_structure = database_structure["em01_major"]
+    em01_major_lib = CManagerLibReader(
+        t_db_name=em01_major_lib_structure.m_lib_name,
+        t_db_save_dir=intermediary_dir
+    )
+    em01_major_lib.set_default(t_default_table_name=em01_major_lib_structure.m_tab.m_table_name)
+    em01_df = em01_major_lib.read_by_conditions(t_conditions=[
+        ("trade_date", ">=", bgn_date[0:4] + "0101"),
+        ("trade_date", "<", "{:04d}0101".format(int(stp_date[0:4]) + 1)),
+    ], t_value_columns=["instrument", "trade_date"] + minute_bars_columns)
+    em01_major_lib.close()
+    bars_writer.update(em01_df)
+    print("... @ {} {} minute bars copied into {}".format(dt.datetime.now(), len(em01_df), bars_writer.m_bars_dir))
+    return 0
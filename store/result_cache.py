@@ -0,0 +1,154 @@
+"""
+A content-addressed cache of results, so unchanged calculations are skipped on rerun.
+
+For each task, such as the moving average of a factor, the key is a hash of its
+inputs: labels, arguments, dates and fingerprints of the upstream libraries or
+files. A record of the key and fingerprints of the output libraries is saved in
+    {cache_dir}/{task_id}.json
+after the task is done. When the task is called again, it is skipped if the key
+is the same and the output libraries are not changed since then.
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import datetime as dt
+from collections import Counter
+from skyrim.falkreath import CLib1Tab1
+
+
+def fingerprint_lib(lib_structure: CLib1Tab1, lib_save_dir: str) -> list | None:
+    """
+
+    :param lib_structure:
+    :param lib_save_dir:
+    :return: [first trade date, last trade date, number of rows], None if the library is not found
+    """
+    lib_path = os.path.join(lib_save_dir, lib_structure.m_lib_name)
+    if not os.path.exists(lib_path):
+        return None
+    with sqlite3.connect(lib_path) as connection:
+        try:
+            res = connection.execute("SELECT MIN(trade_date), MAX(trade_date), COUNT(*) FROM {}".format(
+                lib_structure.m_tab.m_table_name))
+            fingerprint = list(res.fetchone())
+        except sqlite3.OperationalError:
+            fingerprint = None
+    connection.close()
+    return fingerprint
+
+
+def fingerprint_files(paths: list[str]) -> list:
+    """
+    for upstream data not saved as libraries of this project
+
+    :param paths: files or directories, files in directories are included recursively
+    :return: [[path, size, modified time], ...]
+    """
+    fingerprint = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for file in sorted(files):
+                    file_stat = os.stat(file_path := os.path.join(root, file))
+                    fingerprint.append([file_path, file_stat.st_size, file_stat.st_mtime_ns])
+        elif os.path.exists(path):
+            file_stat = os.stat(path)
+            fingerprint.append([path, file_stat.st_size, file_stat.st_mtime_ns])
+        else:
+            fingerprint.append([path, None, None])
+    return fingerprint
+
+
+class CResultCache(object):
+    def __init__(self, t_cache_dir: str):
+        self.m_cache_dir = t_cache_dir
+
+    @staticmethod
+    def make_key(t_inputs: dict) -> str:
+        return hashlib.sha1(json.dumps(t_inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _get_record_path(self, t_task_id: str) -> str:
+        return os.path.join(self.m_cache_dir, "{}.json".format(t_task_id.replace("/", "-")))
+
+    @staticmethod
+    def _fingerprint_outputs(t_outputs: list[tuple[CLib1Tab1, str]]) -> list:
+        return [fingerprint_lib(lib_structure, lib_save_dir) for lib_structure, lib_save_dir in t_outputs]
+
+    def is_hit(self, t_task_id: str, t_key: str, t_outputs: list[tuple[CLib1Tab1, str]]) -> bool:
+        """
+
+        :param t_task_id:
+        :param t_key:
+        :param t_outputs: [(lib_structure, lib_save_dir), ...] of output libraries
+        :return:
+        """
+        if not os.path.exists(record_path := self._get_record_path(t_task_id)):
+            return False
+        try:
+            with open(record_path, "r", encoding="utf-8") as j:
+                record = json.load(j)
+        except (json.JSONDecodeError, OSError):
+            return False
+        outputs_fingerprint = self._fingerprint_outputs(t_outputs)
+        return (record["key"] == t_key) and (None not in outputs_fingerprint) and (
+                record["outputs"] == outputs_fingerprint)
+
+    def save(self, t_task_id: str, t_key: str, t_outputs: list[tuple[CLib1Tab1, str]]):
+        os.makedirs(self.m_cache_dir, exist_ok=True)
+        record_path = self._get_record_path(t_task_id)
+        tmp_path = record_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as j:
+            json.dump({"key": t_key, "outputs": self._fingerprint_outputs(t_outputs)}, j)
+        os.replace(tmp_path, record_path)
+        return 0
+
+
+def run_with_cache(t_cache_dir: str | None, t_task_id: str, t_inputs: dict,
+                   t_input_libs: list[tuple[CLib1Tab1, str]],
+                   t_outputs: list[tuple[CLib1Tab1, str]],
+                   t_func, t_args: tuple = (), t_kwargs: dict = None) -> str:
+    """
+    t_func(*t_args, **t_kwargs) is skipped if its inputs and outputs are unchanged since last call
+
+    :param t_cache_dir: if None, t_func would always be called
+    :param t_task_id: like "fema/SKEW126-M005"
+    :param t_inputs: labels, arguments and dates of t_func, must be json serializable
+    :param t_input_libs: [(lib_structure, lib_save_dir), ...] of the upstream libraries, they
+                         are fingerprinted when this function is called
+    :param t_outputs: [(lib_structure, lib_save_dir), ...] of the libraries written by t_func
+    :param t_func:
+    :param t_args:
+    :param t_kwargs:
+    :return: "hit" if t_func is skipped, else "miss"
+    """
+    if t_cache_dir is None:
+        t_func(*t_args, **({} if t_kwargs is None else t_kwargs))
+        return "miss"
+
+    result_cache = CResultCache(t_cache_dir)
+    key = result_cache.make_key({
+        "inputs": t_inputs,
+        "input_libs": [fingerprint_lib(lib_structure, lib_save_dir) for lib_structure, lib_save_dir in t_input_libs],
+    })
+    if result_cache.is_hit(t_task_id, key, t_outputs):
+        return "hit"
+    t_func(*t_args, **({} if t_kwargs is None else t_kwargs))
+    result_cache.save(t_task_id, key, t_outputs)
+    return "miss"
+
+
+class CResultCacheStats(object):
+    def __init__(self):
+        self.m_counter = Counter()
+
+    def update(self, t_status: str):
+        self.m_counter[t_status] += 1
+        return 0
+
+    def report(self, t_switch: str):
+        print("... @ {} result cache of {}: hit = {}, miss = {}".format(
+            dt.datetime.now(), t_switch, self.m_counter["hit"], self.m_counter["miss"]))
+        return 0
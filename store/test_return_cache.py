@@ -0,0 +1,88 @@
+"""
+A read-only test return cache shared by processes.
+
+The parent process loads a test return library once into a block of shared
+memory with shape = (date, instrument). Instances are picklable, so they can be
+handed to pool workers, which attach to the block by its name instead of
+reading the library again.
+"""
+
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+from skyrim.falkreath import CLib1Tab1, CManagerLibReader
+
+
+class CTestReturnCache(object):
+    def __init__(self, t_test_return_lib_id: str, t_bgn_date: str, t_stp_date: str,
+                 t_test_returns_dir: str, t_database_structure: dict[str, CLib1Tab1]):
+        test_return_lib_structure = t_database_structure[t_test_return_lib_id]
+        test_return_lib = CManagerLibReader(t_db_name=test_return_lib_structure.m_lib_name,
+                                            t_db_save_dir=t_test_returns_dir)
+        test_return_lib.set_default(test_return_lib_structure.m_tab.m_table_name)
+        test_return_df = test_return_lib.read_by_conditions(t_conditions=[
+            ("trade_date", ">=", t_bgn_date),
+            ("trade_date", "<", t_stp_date),
+        ], t_value_columns=["trade_date", "instrument", "value"])
+        test_return_lib.close()
+        pivot_df = pd.pivot_table(data=test_return_df, index="trade_date", columns="instrument", values="value")
+
+        self.m_test_return_lib_id = t_test_return_lib_id
+        self.m_bgn_date, self.m_stp_date = t_bgn_date, t_stp_date
+        self.m_dates: np.ndarray = pivot_df.index.to_numpy(dtype=str)
+        self.m_instruments: np.ndarray = pivot_df.columns.to_numpy(dtype=str)
+        self.m_shape = (len(self.m_dates), len(self.m_instruments))
+
+        values = pivot_df.to_numpy(dtype=np.float64)
+        self.m_shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        self.m_shm_name = self.m_shm.name
+        self.m_is_owner = True
+        np.ndarray(self.m_shape, dtype=np.float64, buffer=self.m_shm.buf)[:] = values
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["m_shm"] = None
+        state["m_is_owner"] = False
+        return state
+
+    def _get_data(self) -> np.ndarray:
+        if self.m_shm is None:
+            self.m_shm = shared_memory.SharedMemory(name=self.m_shm_name)
+        return np.ndarray(self.m_shape, dtype=np.float64, buffer=self.m_shm.buf)
+
+    def get_frame(self, t_bgn_date: str, t_stp_date: str) -> pd.DataFrame:
+        """
+
+        :param t_bgn_date:
+        :param t_stp_date: not included
+        :return: a DataFrame with columns = ["trade_date", "instrument", "value"], the same as
+                 read_by_conditions from the test return library
+        """
+        if t_bgn_date < self.m_bgn_date or t_stp_date > self.m_stp_date:
+            raise ValueError(f"... [{t_bgn_date}, {t_stp_date}) is out of range of test return cache "
+                             f"[{self.m_bgn_date}, {self.m_stp_date})")
+        date_slice = slice(int(np.searchsorted(self.m_dates, t_bgn_date, side="left")),
+                           int(np.searchsorted(self.m_dates, t_stp_date, side="left")))
+        values = self._get_data()[date_slice]
+        frame_df = pd.DataFrame({
+            "trade_date": np.repeat(self.m_dates[date_slice], len(self.m_instruments)),
+            "instrument": np.tile(self.m_instruments, len(values)),
+            "value": values.flatten(),
+        })
+        return frame_df.dropna(axis=0, subset=["value"]).reset_index(drop=True)
+
+    def close(self):
+        if self.m_shm is not None:
+            self.m_shm.close()
+            if self.m_is_owner:
+                self.m_shm.unlink()
+            self.m_shm = None
+        return 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # --- the shared memory is released even if a job fails, it would outlive the process otherwise
+        self.close()
+        return False
@@ -101,6 +101,18 @@ database_structure.update({
     )
 })
 
+# --- contracts ranked by volume of each day, 0 = the most active one
+database_structure.update({
+    "volume_rank": CLib1Tab1(
+        t_lib_name="volume_rank.db",
+        t_tab=CTable({
+            "table_name": "volume_rank",
+            "primary_keys": {"trade_date": "TEXT", "loc_id": "TEXT"},
+            "value_columns": {"instrument": "TEXT", "volume": "REAL", "rank": "INT4"},
+        })
+    )
+})
+
 # --- hold position and delta position from public information
 database_structure.update({
     z: CLib1Tab1(
@@ -1,69 +1,109 @@
+import os
 import json
+import sqlite3
 import datetime as dt
-import multiprocessing as mp
 import numpy as np
 import pandas as pd
-from rich.progress import track
 from skyrim.whiterun import CCalendar, error_handler
 from skyrim.falkreath import CTable, CLib1Tab1
 from skyrim.falkreath import CManagerLibReader
 from skyrim.falkreath import CManagerLibWriterByDate
+from pipeline.pool import get_worker_pool
 
 
-def lookup_av_ratio(db: CManagerLibReader, date: str, contract: str, ret_type: str):
-    _s, _d = (0, 1) if ret_type == "o" else (-1, -1)
-    m01_df = db.read_by_date(
-        t_trade_date=date,
-        t_value_columns=["loc_id", "open", "high", "low", "close", "amount", "volume"]
-    ).set_index("loc_id")
-    m01_df = m01_df.dropna(axis=0, how="all", subset=["open", "high", "low", "close"])
-    try:
-        i = 0
-        while (v := m01_df.at[contract, "volume"].iloc[_s + _d * i]) == 0:
-            i += 1
-        if i > 0:
-            print("... 0 volume found for {} at {} with ret_type = {}, i = {:>3d}".format(contract, date, ret_type, i))
-        a = m01_df.at[contract, "amount"].iloc[_s + _d * i]
-        return a / v
-    except KeyError:
-        print("... Warning! KeyError when lookup av ratio at {} for {}".format(date, contract))
-        return np.nan
-
-
-def cal_test_returns_for_test_window(
-        test_return_type: str,
-        run_mode: str, bgn_date: str, stp_date: str | None,
+def cal_av_ratios(t_m01_df: pd.DataFrame) -> pd.DataFrame:
+    """
+
+    :param t_m01_df: minute bars of all contracts of a day, columns = ["loc_id", "amount", "volume", ...]
+    :return: a DataFrame with index = loc_id, columns = ["o", "c", "o_skip", "c_skip"],
+             "o" and "c" are amount / volume of the first and the last bar with non-zero volume,
+             "o_skip" and "c_skip" are numbers of zero-volume bars skipped
+    """
+    m01_df = t_m01_df.reset_index(drop=True)
+    m01_df["pos"] = m01_df.groupby(by="loc_id").cumcount()
+    m01_df["size"] = m01_df.groupby(by="loc_id")["pos"].transform("size")
+    non_zero_df = m01_df.loc[m01_df["volume"] != 0]
+    grouped = non_zero_df.groupby(by="loc_id")
+    first_df, last_df = grouped.head(1).set_index("loc_id"), grouped.tail(1).set_index("loc_id")
+    return pd.DataFrame({
+        "o": first_df["amount"] / first_df["volume"],
+        "c": last_df["amount"] / last_df["volume"],
+        "o_skip": first_df["pos"],
+        "c_skip": last_df["size"] - 1 - last_df["pos"],
+    })
+
+
+class CAvRatioByDate(object):
+    def __init__(self, t_m01_db: CManagerLibReader, t_cache_size: int = 2):
+        """
+
+        :param t_m01_db:
+        :param t_cache_size: number of latest dates kept, dates are usually visited in
+                             order, so a date is read once as the end date of a window
+                             and then reused as the begin date of the next one
+        """
+        self.m_m01_db = t_m01_db
+        self.m_cache_size = t_cache_size
+        self.m_cache: dict[str, pd.DataFrame] = {}
+
+    def _get_av_ratios(self, t_date: str) -> pd.DataFrame:
+        if t_date not in self.m_cache:
+            m01_df = self.m_m01_db.read_by_date(
+                t_trade_date=t_date,
+                t_value_columns=["loc_id", "open", "high", "low", "close", "amount", "volume"]
+            )
+            m01_df = m01_df.dropna(axis=0, how="all", subset=["open", "high", "low", "close"])
+            self.m_cache[t_date] = cal_av_ratios(m01_df)
+            while len(self.m_cache) > self.m_cache_size:
+                self.m_cache.pop(next(iter(self.m_cache)))
+        return self.m_cache[t_date]
+
+    def lookup(self, t_date: str, t_contract: str, t_ret_type: str) -> float:
+        av_ratios = self._get_av_ratios(t_date)
+        if t_contract not in av_ratios.index:
+            print("... Warning! KeyError when lookup av ratio at {} for {}".format(t_date, t_contract))
+            return np.nan
+        if (i := av_ratios.at[t_contract, t_ret_type + "_skip"]) > 0:
+            print("... 0 volume found for {} at {} with ret_type = {}, i = {:>3d}".format(
+                t_contract, t_date, t_ret_type, i))
+        return av_ratios.at[t_contract, t_ret_type]
+
+
+def delete_by_date_range(lib_struct: CLib1Tab1, lib_save_dir: str, bgn_date: str, stp_date: str):
+    lib_path = os.path.join(lib_save_dir, lib_struct.m_lib_name)
+    if not os.path.exists(lib_path):
+        return 0
+    with sqlite3.connect(lib_path) as connection:
+        try:
+            connection.execute("DELETE FROM {} WHERE trade_date >= ? AND trade_date < ?".format(
+                lib_struct.m_tab.m_table_name), (bgn_date, stp_date))
+        except sqlite3.OperationalError:
+            pass
+    connection.close()
+    return 0
+
+
+def cal_test_returns_by_dates(
+        test_return_types: tuple[str],
+        iter_dates_pair: list[tuple[str, str]],
         instruments_universe: list[str],
-        database_structure: dict[str, CLib1Tab1],
-        test_returns_dir: str,
         by_instrument_dir: str,
         futures_dir: str,
-        calendar_path: str,
         futures_md_structure_path: str,
         futures_em01_db_name: str,
-
-):
+) -> dict[str, pd.DataFrame]:
     """
 
-    :param test_return_type: must be in {"o", "c"}
-    :param run_mode:
-    :param bgn_date:
-    :param stp_date:
+    :param test_return_types: each of them must be in {"o", "c"}, all of them are
+                              calculated from one read of the minute bars
+    :param iter_dates_pair: [(test_bgn_date, test_end_date), ...]
     :param instruments_universe:
-    :param database_structure:
-    :param test_returns_dir:
     :param by_instrument_dir:
     :param futures_dir:
-    :param calendar_path:
     :param futures_md_structure_path:
     :param futures_em01_db_name:
-    :return:
+    :return: {test_return_type: DataFrame with columns = ["trade_date", "instrument", "test_return"]}
     """
-    calendar = CCalendar(calendar_path)
-    if stp_date is None:
-        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
-    _test_window = 1
-
     # --- init major contracts
     major_minor_manager = {}
     major_minor_lib_reader = CManagerLibReader(by_instrument_dir, "major_minor.db")
@@ -81,66 +121,107 @@ def cal_test_returns_for_test_window(
     m01_table = CTable(t_table_struct=m01_table_struct)
     m01_db = CManagerLibReader(t_db_save_dir=futures_dir, t_db_name=futures_em01_db_name)
     m01_db.set_default(m01_table.m_table_name)
-
-    # --- init lib writer
-    test_return_lib_id = f"test_return_{test_return_type}"
-    test_return_lib_struct = database_structure[test_return_lib_id]
-    test_return_lib = CManagerLibWriterByDate(
-        t_db_save_dir=test_returns_dir,
-        t_db_name=test_return_lib_struct.m_lib_name,
-    )
-    test_return_lib.initialize_table(
-        t_table=test_return_lib_struct.m_tab,
-        t_remove_existence=run_mode in ["O", "OVERWRITE"],
-    )
+    av_ratio_by_date = CAvRatioByDate(m01_db)
 
     # --- main loop
-    test_return_data = []
-    iter_end_dates = calendar.get_iter_list(bgn_date, stp_date, True)
-    iter_bgn_dates = calendar.get_iter_list(
-        calendar.get_next_date(iter_end_dates[0], -_test_window),
-        calendar.get_next_date(iter_end_dates[-1], -_test_window + 1),
-        True
-    )
-    iter_dates_pair = list(zip(iter_bgn_dates, iter_end_dates))
-    for test_bgn_date, test_end_date in track(iter_dates_pair, description=f"[INF] Test return {test_return_type}"):
+    test_return_data = {test_return_type: [] for test_return_type in test_return_types}
+    for test_bgn_date, test_end_date in iter_dates_pair:
         for instrument in instruments_universe:
             instru_major_contract = major_minor_manager[instrument].at[
                 test_end_date, "n_contract"]  # format like = "IC2305.CFE"
-            test_bgn_av_ratio = lookup_av_ratio(m01_db, test_bgn_date, instru_major_contract, test_return_type)
-            test_end_av_ratio = lookup_av_ratio(m01_db, test_end_date, instru_major_contract, test_return_type)
-            test_return_data.append({
-                "trade_date": test_end_date,
-                "instrument": instrument,
-                "test_return": test_end_av_ratio / test_bgn_av_ratio - 1,
-            })
-        if run_mode in ["A", "APPEND"]:
-            test_return_lib.delete_by_date(t_date=test_end_date)
-    test_return_df = pd.DataFrame(test_return_data).sort_values(by=["trade_date", "instrument"])
-    test_return_lib.update(t_update_df=test_return_df)
-    test_return_lib.close()
+            for test_return_type in test_return_types:
+                test_bgn_av_ratio = av_ratio_by_date.lookup(test_bgn_date, instru_major_contract, test_return_type)
+                test_end_av_ratio = av_ratio_by_date.lookup(test_end_date, instru_major_contract, test_return_type)
+                test_return_data[test_return_type].append({
+                    "trade_date": test_end_date,
+                    "instrument": instrument,
+                    "test_return": test_end_av_ratio / test_bgn_av_ratio - 1,
+                })
     m01_db.close()
-    print("... @", dt.datetime.now(), run_mode, bgn_date, stp_date, test_return_type, "calculated")
-    return 0
+    return {k: pd.DataFrame(v, columns=["trade_date", "instrument", "test_return"])
+            for k, v in test_return_data.items()}
 
 
 def cal_test_returns_mp(
         proc_num: int,
         test_return_types: tuple[str],
         run_mode: str, bgn_date: str, stp_date: str | None,
-        **kwargs
+        instruments_universe: list[str],
+        database_structure: dict[str, CLib1Tab1],
+        test_returns_dir: str,
+        by_instrument_dir: str,
+        futures_dir: str,
+        calendar_path: str,
+        futures_md_structure_path: str,
+        futures_em01_db_name: str,
 ):
+    """
+    dates are split into proc_num chunks, each chunk calculates all test_return_types
+    with one read of the minute bars, and results are saved by this process
+
+    :param proc_num:
+    :param test_return_types: each of them must be in {"o", "c"}
+    :param run_mode:
+    :param bgn_date:
+    :param stp_date:
+    :param instruments_universe:
+    :param database_structure:
+    :param test_returns_dir:
+    :param by_instrument_dir:
+    :param futures_dir:
+    :param calendar_path:
+    :param futures_md_structure_path:
+    :param futures_em01_db_name:
+    :return:
+    """
     t0 = dt.datetime.now()
-    pool = mp.Pool(processes=proc_num)
-    for test_return_type in test_return_types:
-        pool.apply_async(
-            cal_test_returns_for_test_window,
-            args=(test_return_type, run_mode, bgn_date, stp_date),
-            kwds=kwargs,
+    calendar = CCalendar(calendar_path)
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+    _test_window = 1
+
+    iter_end_dates = calendar.get_iter_list(bgn_date, stp_date, True)
+    iter_bgn_dates = calendar.get_iter_list(
+        calendar.get_next_date(iter_end_dates[0], -_test_window),
+        calendar.get_next_date(iter_end_dates[-1], -_test_window + 1),
+        True
+    )
+    iter_dates_pair = list(zip(iter_bgn_dates, iter_end_dates))
+    chunk_size = max(int(np.ceil(len(iter_dates_pair) / proc_num)), 1)
+
+    pool = get_worker_pool(proc_num)
+    jobs = []
+    for i in range(0, len(iter_dates_pair), chunk_size):
+        jobs.append(pool.apply_async(
+            cal_test_returns_by_dates,
+            args=(test_return_types, iter_dates_pair[i:i + chunk_size], instruments_universe,
+                  by_instrument_dir, futures_dir, futures_md_structure_path, futures_em01_db_name),
             error_callback=error_handler,
-        )
+        ))
     pool.close()
     pool.join()
+    chunk_res = [job.get() for job in jobs]
+
+    # --- save
+    for test_return_type in test_return_types:
+        test_return_lib_id = f"test_return_{test_return_type}"
+        test_return_lib_struct = database_structure[test_return_lib_id]
+        if run_mode in ["A", "APPEND"]:
+            delete_by_date_range(test_return_lib_struct, test_returns_dir, bgn_date, stp_date)
+        test_return_lib = CManagerLibWriterByDate(
+            t_db_save_dir=test_returns_dir,
+            t_db_name=test_return_lib_struct.m_lib_name,
+        )
+        test_return_lib.initialize_table(
+            t_table=test_return_lib_struct.m_tab,
+            t_remove_existence=run_mode in ["O", "OVERWRITE"],
+        )
+        test_return_df = pd.concat([_[test_return_type] for _ in chunk_res], axis=0, ignore_index=True)
+        test_return_df.sort_values(by=["trade_date", "instrument"], inplace=True)
+        test_return_lib.update(t_update_df=test_return_df)
+        test_return_lib.close()
+        print("... @", dt.datetime.now(), run_mode, bgn_date, stp_date, test_return_type, "calculated")
+
     t1 = dt.datetime.now()
     print("... total time consuming: {:.2f} seconds".format((t1 - t0).total_seconds()))
     return 0
@@ -1,11 +1,16 @@
 import datetime as dt
 import numpy as np
 import pandas as pd
-import multiprocessing as mp
 from rich.progress import Progress
 from skyrim.falkreath import CLib1Tab1
 from skyrim.falkreath import CManagerLibReader, CManagerLibWriter
 from skyrim.whiterun import CCalendar, error_handler
+from engines.cross_section import sorted_weighted_sum
+from store.factor_panel import CFactorPanel
+from store.test_return_cache import CTestReturnCache
+from tests.ic_tests import load_test_return_by_date, load_shifted_exposures, save_test_result
+from store.result_cache import run_with_cache, fingerprint_files, CResultCacheStats
+from pipeline.pool import get_worker_pool
 
 
 def cal_wgt_from_universe(universe: list[str]):
@@ -17,13 +22,6 @@ def cal_wgt_from_universe(universe: list[str]):
     return wl / np.abs(wl).sum(), ws / np.abs(ws).sum(), wh / np.abs(wh).sum()
 
 
-def cal_gp_ret_by_date(df: pd.DataFrame, fe: str, tr: str,
-                       universe: list[str],
-                       wl: np.ndarray, ws: np.ndarray, wh: np.ndarray):
-    test_df = df.loc[universe, [fe, tr]].sort_values(by=fe, ascending=False)
-    return test_df[tr] @ wl, test_df[tr] @ ws, test_df[tr] @ wh
-
-
 def shift_fac_exp(df: pd.DataFrame, row: str, col: str, val: str, shift_win: int):
     _pivot_df = pd.pivot_table(data=df, index=row, columns=col, values=val)
     _res_df = _pivot_df.shift(shift_win).stack().sort_index().reset_index()
@@ -39,7 +37,8 @@ def gp_test_single_factor(
         factors_exposure_dir: str,
         test_returns_dir: str,
         database_structure: dict[str, CLib1Tab1],
-        calendar_path: str):
+        calendar_path: str,
+        test_return_cache: CTestReturnCache | None = None):
     _test_window = 1
 
     # --- directory check
@@ -61,12 +60,6 @@ def gp_test_single_factor(
     factor_lib = CManagerLibReader(t_db_save_dir=factors_exposure_dir, t_db_name=factor_lib_structure.m_lib_name)
     factor_lib.set_default(factor_lib_structure.m_tab.m_table_name)
 
-    # --- test return library
-    test_return_lib_id = "test_return_o"
-    test_return_lib_structure = database_structure[test_return_lib_id]
-    test_return_lib = CManagerLibReader(t_db_name=test_return_lib_structure.m_lib_name, t_db_save_dir=test_returns_dir)
-    test_return_lib.set_default(test_return_lib_structure.m_tab.m_table_name)
-
     fac_exp_df = factor_lib.read_by_conditions(t_conditions=[
         ("trade_date", ">=", base_date),
         ("trade_date", "<", stp_date),
@@ -74,54 +67,155 @@ def gp_test_single_factor(
     fac_exp_df_shift = shift_fac_exp(
         fac_exp_df, row="trade_date", col="instrument", val="value", shift_win=_test_window + 1)
 
-    test_return_df = test_return_lib.read_by_conditions(
-        t_conditions=[
-            ("trade_date", ">=", bgn_date),
-            ("trade_date", "<", stp_date),
-        ], t_value_columns=["trade_date", "instrument", "value"]
-    )
+    # --- test return
+    if test_return_cache is not None:
+        test_return_df = test_return_cache.get_frame(bgn_date, stp_date)
+    else:
+        test_return_lib_id = "test_return_o"
+        test_return_lib_structure = database_structure[test_return_lib_id]
+        test_return_lib = CManagerLibReader(t_db_name=test_return_lib_structure.m_lib_name,
+                                            t_db_save_dir=test_returns_dir)
+        test_return_lib.set_default(test_return_lib_structure.m_tab.m_table_name)
+        test_return_df = test_return_lib.read_by_conditions(
+            t_conditions=[
+                ("trade_date", ">=", bgn_date),
+                ("trade_date", "<", stp_date),
+            ], t_value_columns=["trade_date", "instrument", "value"]
+        )
+        test_return_lib.close()
 
     test_input_df = pd.merge(
         left=fac_exp_df_shift, right=test_return_df,
         on=["trade_date", "instrument"], suffixes=("_e", "_r"),
         how="right"
-    ).set_index("instrument")
-    res_srs = test_input_df.groupby(by="trade_date").apply(
-        cal_gp_ret_by_date, fe="value_e", tr="value_r", universe=universe, wl=wl, ws=ws, wh=wh)
-    rl_srs, rs_srs, rh_srs = zip(*res_srs)
-    test_res_df = pd.DataFrame({
-        "rl": rl_srs,
-        "rs": rs_srs,
-        "rh": rh_srs,
-    }, index=res_srs.index)
+    )
+
+    # --- instruments of all dates are sorted by exposure at once, shape = (date, instrument)
+    test_input_by_date = test_input_df.pivot(index="trade_date", columns="instrument", values=["value_e", "value_r"])
+    fac_exp = test_input_by_date["value_e"].reindex(columns=universe).to_numpy(dtype=np.float64)
+    test_ret = test_input_by_date["value_r"].reindex(columns=universe).to_numpy(dtype=np.float64)
+    gp_ret = sorted_weighted_sum(fac_exp, test_ret, np.stack([wl, ws, wh], axis=1), t_axis=1)
+    test_res_df = pd.DataFrame(data=gp_ret, columns=["rl", "rs", "rh"], index=test_input_by_date.index)
     test_lib.update(t_update_df=test_res_df, t_using_index=True)
     test_lib.close()
     factor_lib.close()
-    test_return_lib.close()
     return 0
 
 
+def run_gp_test_with_cache(
+        factor_ma: str,
+        universe: list[str],
+        run_mode: str, bgn_date: str, stp_date: str,
+        result_cache_dir: str | None,
+        **kwargs) -> str:
+    database_structure = kwargs["database_structure"]
+    return run_with_cache(
+        t_cache_dir=result_cache_dir, t_task_id="gp/{}".format(factor_ma),
+        t_inputs={"factor_ma": factor_ma, "universe": universe,
+                  "run_mode": run_mode, "bgn_date": bgn_date, "stp_date": stp_date,
+                  "calendar": fingerprint_files([kwargs["calendar_path"]])},
+        t_input_libs=[(database_structure[factor_ma], kwargs["factors_exposure_dir"]),
+                      (database_structure["test_return_o"], kwargs["test_returns_dir"])],
+        t_outputs=[(database_structure["gp-{}".format(factor_ma)], kwargs["tests_result_dir"])],
+        t_func=gp_test_single_factor,
+        t_args=(factor_ma, universe, run_mode, bgn_date, stp_date),
+        t_kwargs=kwargs,
+    )
+
+
 def cal_gp_tests_mp(
         proc_num: int,
         factors_ma: list[str],
         universe: list[str],
         run_mode: str, bgn_date: str, stp_date: str | None,
+        result_cache_dir: str | None = None,
         **kwargs
 ):
     t0 = dt.datetime.now()
-    with Progress() as pb:
+    cache_stats = CResultCacheStats()
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+    with CTestReturnCache("test_return_o", bgn_date, stp_date,
+                          kwargs["test_returns_dir"], kwargs["database_structure"]) as test_return_cache, \
+            Progress() as pb:
         main_task = pb.add_task(description=f"[INF] Calculating ic ...", total=len(factors_ma))
-        pool = mp.Pool(processes=proc_num)
+
+        def on_done(status: str):
+            pb.update(main_task, advance=1)
+            cache_stats.update(status)
+
+        pool = get_worker_pool(proc_num)
         for factor_ma in factors_ma:
             pool.apply_async(
-                gp_test_single_factor,
-                args=(factor_ma, universe, run_mode, bgn_date, stp_date),
-                kwds=kwargs,
-                callback=lambda _: pb.update(main_task, advance=1),
+                run_gp_test_with_cache,
+                args=(factor_ma, universe, run_mode, bgn_date, stp_date, result_cache_dir),
+                kwds=dict(kwargs, test_return_cache=test_return_cache),
+                callback=on_done,
                 error_callback=error_handler,
             )
         pool.close()
         pool.join()
+    if result_cache_dir is not None:
+        cache_stats.report("gp")
+    t1 = dt.datetime.now()
+    print("... total time consuming: {:.2f} seconds".format((t1 - t0).total_seconds()))
+    return 0
+
+
+def cal_gp_tests_batch(
+        proc_num: int,
+        factors_ma: list[str],
+        universe: list[str],
+        run_mode: str, bgn_date: str, stp_date: str | None,
+        tests_result_dir: str,
+        factors_panel_dir: str,
+        test_returns_dir: str,
+        database_structure: dict[str, CLib1Tab1],
+        factors_batch_size: int = 256,
+):
+    """
+    batch version of gp_test_single_factor, instruments of all dates and factors
+    are ranked by one argsort on exposures from the factor panel built by
+    store.factor_panel.build_factor_panel
+
+    """
+    t0 = dt.datetime.now()
+    _test_window = 1
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+    wl, ws, wh = cal_wgt_from_universe(universe)
+    wgt = np.stack([wl, ws, wh], axis=1)
+
+    # --- load panel and test return
+    panel = CFactorPanel(factors_panel_dir)
+    universe_loc = panel.get_instruments_loc(universe)
+    test_return_by_date = load_test_return_by_date(
+        bgn_date, stp_date, universe, test_returns_dir, database_structure)
+    test_dates = test_return_by_date.index.to_numpy(dtype=str)
+    test_return = test_return_by_date.to_numpy(dtype=np.float64)[:, :, np.newaxis]
+
+    # --- calculate and save
+    with Progress() as pb:
+        main_task = pb.add_task(description=f"[INF] Calculating gp in batch ...", total=len(factors_ma))
+        pool = get_worker_pool(proc_num)
+        for i in range(0, len(factors_ma), factors_batch_size):
+            batch_factors = factors_ma[i:i + factors_batch_size]
+            fac_exp = load_shifted_exposures(panel, batch_factors, test_dates, shift_win=_test_window + 1)
+            fac_exp = fac_exp[:, universe_loc, :]
+            ret = np.broadcast_to(test_return, fac_exp.shape)
+            gp_ret = sorted_weighted_sum(fac_exp, ret, wgt, t_axis=1)  # shape = (date, factor, 3)
+            for j, factor_ma in enumerate(batch_factors):
+                test_res_df = pd.DataFrame(
+                    data=gp_ret[:, j, :], columns=["rl", "rs", "rh"],
+                    index=pd.Index(test_dates, name="trade_date"))
+                pool.apply_async(
+                    save_test_result,
+                    args=("gp-{}".format(factor_ma), test_res_df, run_mode, tests_result_dir, database_structure),
+                    callback=lambda _: pb.update(main_task, advance=1),
+                    error_callback=error_handler,
+                )
+        pool.close()
+        pool.join()
     t1 = dt.datetime.now()
     print("... total time consuming: {:.2f} seconds".format((t1 - t0).total_seconds()))
     return 0
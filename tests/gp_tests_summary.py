@@ -1,11 +1,11 @@
 import os
 import datetime as dt
 import pandas as pd
-import multiprocessing as mp
 from rich.progress import track
 from skyrim.falkreath import CLib1Tab1, CManagerLibReader
 from skyrim.riften import CNAV
 from skyrim.whiterun import error_handler
+from pipeline.pool import get_worker_pool
 
 
 def cal_gp_tests_summary(
@@ -59,7 +59,7 @@ def cal_gp_tests_summary_mp(
         **kwargs
 ):
     t0 = dt.datetime.now()
-    pool = mp.Pool(processes=proc_num)
+    pool = get_worker_pool(proc_num)
     pool.apply_async(
         cal_gp_tests_summary,
         args=(factors_ma, sharpe_ratio_threshold, bgn_date, stp_date),
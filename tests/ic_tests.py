@@ -1,10 +1,15 @@
 import datetime as dt
+import numpy as np
 import pandas as pd
-import multiprocessing as mp
 from rich.progress import Progress
 from skyrim.falkreath import CLib1Tab1
 from skyrim.falkreath import CManagerLibReader, CManagerLibWriter
 from skyrim.whiterun import CCalendar, error_handler
+from engines.cross_section import masked_pearson, masked_spearman
+from store.factor_panel import CFactorPanel
+from store.test_return_cache import CTestReturnCache
+from store.result_cache import run_with_cache, fingerprint_files, CResultCacheStats
+from pipeline.pool import get_worker_pool
 
 
 def cal_corr_by_date(df: pd.DataFrame, fe: str, tr: str):
@@ -27,7 +32,8 @@ def ic_test_single_factor(
         factors_exposure_dir: str,
         test_returns_dir: str,
         database_structure: dict[str, CLib1Tab1],
-        calendar_path: str):
+        calendar_path: str,
+        test_return_cache: CTestReturnCache | None = None):
     _test_window = 1
 
     # --- load calendar
@@ -46,12 +52,6 @@ def ic_test_single_factor(
     factor_lib = CManagerLibReader(t_db_save_dir=factors_exposure_dir, t_db_name=factor_lib_structure.m_lib_name)
     factor_lib.set_default(factor_lib_structure.m_tab.m_table_name)
 
-    # --- test return library
-    test_return_lib_id = "test_return_o"
-    test_return_lib_structure = database_structure[test_return_lib_id]
-    test_return_lib = CManagerLibReader(t_db_name=test_return_lib_structure.m_lib_name, t_db_save_dir=test_returns_dir)
-    test_return_lib.set_default(test_return_lib_structure.m_tab.m_table_name)
-
     fac_exp_df = factor_lib.read_by_conditions(t_conditions=[
         ("trade_date", ">=", base_date),
         ("trade_date", "<", stp_date),
@@ -59,12 +59,22 @@ def ic_test_single_factor(
     fac_exp_df_shift = shift_fac_exp(
         fac_exp_df, row="trade_date", col="instrument", val="value", shift_win=_test_window + 1)
 
-    test_return_df = test_return_lib.read_by_conditions(
-        t_conditions=[
-            ("trade_date", ">=", bgn_date),
-            ("trade_date", "<", stp_date),
-        ], t_value_columns=["trade_date", "instrument", "value"]
-    )
+    # --- test return
+    if test_return_cache is not None:
+        test_return_df = test_return_cache.get_frame(bgn_date, stp_date)
+    else:
+        test_return_lib_id = "test_return_o"
+        test_return_lib_structure = database_structure[test_return_lib_id]
+        test_return_lib = CManagerLibReader(t_db_name=test_return_lib_structure.m_lib_name,
+                                            t_db_save_dir=test_returns_dir)
+        test_return_lib.set_default(test_return_lib_structure.m_tab.m_table_name)
+        test_return_df = test_return_lib.read_by_conditions(
+            t_conditions=[
+                ("trade_date", ">=", bgn_date),
+                ("trade_date", "<", stp_date),
+            ], t_value_columns=["trade_date", "instrument", "value"]
+        )
+        test_return_lib.close()
 
     test_input_df = pd.merge(
         left=fac_exp_df_shift, right=test_return_df,
@@ -81,30 +91,182 @@ def ic_test_single_factor(
     test_lib.update(t_update_df=test_res_df, t_using_index=True)
     test_lib.close()
     factor_lib.close()
-    test_return_lib.close()
     return 0
 
 
+def run_ic_test_with_cache(
+        factor_ma: str,
+        run_mode: str, bgn_date: str, stp_date: str,
+        result_cache_dir: str | None,
+        **kwargs) -> str:
+    database_structure = kwargs["database_structure"]
+    return run_with_cache(
+        t_cache_dir=result_cache_dir, t_task_id="ic/{}".format(factor_ma),
+        t_inputs={"factor_ma": factor_ma, "run_mode": run_mode, "bgn_date": bgn_date, "stp_date": stp_date,
+                  "calendar": fingerprint_files([kwargs["calendar_path"]])},
+        t_input_libs=[(database_structure[factor_ma], kwargs["factors_exposure_dir"]),
+                      (database_structure["test_return_o"], kwargs["test_returns_dir"])],
+        t_outputs=[(database_structure["ic-{}".format(factor_ma)], kwargs["tests_result_dir"])],
+        t_func=ic_test_single_factor,
+        t_args=(factor_ma, run_mode, bgn_date, stp_date),
+        t_kwargs=kwargs,
+    )
+
+
 def cal_ic_tests_mp(
         proc_num: int,
         factors_ma: list[str],
         run_mode: str, bgn_date: str, stp_date: str | None,
+        result_cache_dir: str | None = None,
         **kwargs
 ):
     t0 = dt.datetime.now()
-    with Progress() as pb:
+    cache_stats = CResultCacheStats()
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+    with CTestReturnCache("test_return_o", bgn_date, stp_date,
+                          kwargs["test_returns_dir"], kwargs["database_structure"]) as test_return_cache, \
+            Progress() as pb:
         main_task = pb.add_task(description=f"[INF] Calculating ic ...", total=len(factors_ma))
-        pool = mp.Pool(processes=proc_num)
+
+        def on_done(status: str):
+            pb.update(main_task, advance=1)
+            cache_stats.update(status)
+
+        pool = get_worker_pool(proc_num)
         for factor_ma in factors_ma:
             pool.apply_async(
-                ic_test_single_factor,
-                args=(factor_ma, run_mode, bgn_date, stp_date),
-                kwds=kwargs,
-                callback=lambda _: pb.update(main_task, advance=1),
+                run_ic_test_with_cache,
+                args=(factor_ma, run_mode, bgn_date, stp_date, result_cache_dir),
+                kwds=dict(kwargs, test_return_cache=test_return_cache),
+                callback=on_done,
                 error_callback=error_handler,
             )
         pool.close()
         pool.join()
+    if result_cache_dir is not None:
+        cache_stats.report("ic")
+    t1 = dt.datetime.now()
+    print("... total time consuming: {:.2f} seconds".format((t1 - t0).total_seconds()))
+    return 0
+
+
+def load_test_return_by_date(
+        bgn_date: str, stp_date: str, instruments: list[str],
+        test_returns_dir: str,
+        database_structure: dict[str, CLib1Tab1]) -> pd.DataFrame:
+    """
+
+    :param bgn_date:
+    :param stp_date:
+    :param instruments:
+    :param test_returns_dir:
+    :param database_structure:
+    :return: a DataFrame with index = trade_date, columns = instruments
+    """
+    test_return_lib_id = "test_return_o"
+    test_return_lib_structure = database_structure[test_return_lib_id]
+    test_return_lib = CManagerLibReader(t_db_name=test_return_lib_structure.m_lib_name, t_db_save_dir=test_returns_dir)
+    test_return_lib.set_default(test_return_lib_structure.m_tab.m_table_name)
+    test_return_df = test_return_lib.read_by_conditions(
+        t_conditions=[
+            ("trade_date", ">=", bgn_date),
+            ("trade_date", "<", stp_date),
+        ], t_value_columns=["trade_date", "instrument", "value"]
+    )
+    test_return_lib.close()
+    return pd.pivot_table(
+        data=test_return_df, index="trade_date", columns="instrument", values="value"
+    ).reindex(columns=instruments)
+
+
+def load_shifted_exposures(panel: CFactorPanel, factors_ma: list[str], test_dates: list[str], shift_win: int):
+    """
+
+    :param panel:
+    :param factors_ma:
+    :param test_dates:
+    :param shift_win: exposure of the date which is shift_win days before test date would be used
+    :return: array with shape = (test date, instrument, factor)
+    """
+    loc = np.searchsorted(panel.m_dates, test_dates)
+    found = (loc < len(panel.m_dates)) & (panel.m_dates[np.minimum(loc, len(panel.m_dates) - 1)] == test_dates)
+    src = loc - shift_win
+    valid = found & (src >= 0)
+    rows = np.where(valid, src, 0)
+
+    # --- factors are selected from a view of the dates in range first, so only the
+    #     columns of this batch are copied from the panel, instead of all factors
+    row_bgn = rows.min() if len(rows) > 0 else 0
+    row_stp = rows.max() + 1 if len(rows) > 0 else 0
+    fac_exp = panel.m_data[row_bgn:row_stp][:, :, panel.get_factors_loc(factors_ma)][rows - row_bgn]
+    fac_exp[~valid] = np.nan
+    return fac_exp
+
+
+def save_test_result(
+        test_lib_id: str, test_res_df: pd.DataFrame,
+        run_mode: str,
+        tests_result_dir: str,
+        database_structure: dict[str, CLib1Tab1]):
+    test_lib_structure = database_structure[test_lib_id]
+    test_lib = CManagerLibWriter(t_db_save_dir=tests_result_dir, t_db_name=test_lib_structure.m_lib_name)
+    test_lib.initialize_table(t_table=test_lib_structure.m_tab, t_remove_existence=run_mode in ["O", "OVERWRITE"])
+    test_lib.update(t_update_df=test_res_df, t_using_index=True)
+    test_lib.close()
+    return 0
+
+
+def cal_ic_tests_batch(
+        proc_num: int,
+        factors_ma: list[str],
+        run_mode: str, bgn_date: str, stp_date: str | None,
+        tests_result_dir: str,
+        factors_panel_dir: str,
+        test_returns_dir: str,
+        database_structure: dict[str, CLib1Tab1],
+        factors_batch_size: int = 256,
+):
+    """
+    batch version of ic_test_single_factor, test returns are loaded once and
+    ic of all factors are calculated in a vectorized way with exposures from
+    the factor panel built by store.factor_panel.build_factor_panel
+
+    """
+    t0 = dt.datetime.now()
+    _test_window = 1
+    if stp_date is None:
+        stp_date = (dt.datetime.strptime(bgn_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+
+    # --- load panel and test return
+    panel = CFactorPanel(factors_panel_dir)
+    test_return_by_date = load_test_return_by_date(
+        bgn_date, stp_date, panel.m_instruments, test_returns_dir, database_structure)
+    test_dates = test_return_by_date.index.to_numpy(dtype=str)
+    test_return = test_return_by_date.to_numpy(dtype=np.float64)[:, :, np.newaxis]
+
+    # --- calculate and save
+    with Progress() as pb:
+        main_task = pb.add_task(description=f"[INF] Calculating ic in batch ...", total=len(factors_ma))
+        pool = get_worker_pool(proc_num)
+        for i in range(0, len(factors_ma), factors_batch_size):
+            batch_factors = factors_ma[i:i + factors_batch_size]
+            fac_exp = load_shifted_exposures(panel, batch_factors, test_dates, shift_win=_test_window + 1)
+            pearson = masked_pearson(fac_exp, test_return, t_axis=1)
+            spearman = masked_spearman(fac_exp, test_return, t_axis=1)
+            for j, factor_ma in enumerate(batch_factors):
+                test_res_df = pd.DataFrame({
+                    "pearson": pearson[:, j],
+                    "spearman": spearman[:, j],
+                }, index=pd.Index(test_dates, name="trade_date"))
+                pool.apply_async(
+                    save_test_result,
+                    args=("ic-{}".format(factor_ma), test_res_df, run_mode, tests_result_dir, database_structure),
+                    callback=lambda _: pb.update(main_task, advance=1),
+                    error_callback=error_handler,
+                )
+        pool.close()
+        pool.join()
     t1 = dt.datetime.now()
     print("... total time consuming: {:.2f} seconds".format((t1 - t0).total_seconds()))
     return 0
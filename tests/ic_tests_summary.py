@@ -2,10 +2,10 @@ import os
 import datetime as dt
 import numpy as np
 import pandas as pd
-import multiprocessing as mp
 from skyrim.falkreath import CLib1Tab1, CManagerLibReader
 from skyrim.winterhold import plot_lines
 from skyrim.whiterun import error_handler
+from pipeline.pool import get_worker_pool
 
 
 def cal_ic_tests_summary(
@@ -94,7 +94,7 @@ def cal_ic_tests_summary_mp(
         **kwargs
 ):
     t0 = dt.datetime.now()
-    pool = mp.Pool(processes=proc_num)
+    pool = get_worker_pool(proc_num)
     pool.apply_async(
         cal_ic_tests_summary,
         args=(factors_ma, methods, icir_threshold, bgn_date, stp_date),
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+import pytest
+from engines.cross_section import argsort_descending, sorted_weight, masked_pearson, masked_spearman
+
+
+@pytest.mark.parametrize("n", [5, 7, 16, 17, 40])
+def test_argsort_descending_same_as_pandas(n: int):
+    rng = np.random.default_rng(n)
+    x = rng.integers(0, 4, (200, n)).astype(np.float64)
+    x[rng.random(x.shape) < 0.15] = np.nan
+    x[::9] = 0
+    order = argsort_descending(x, t_axis=1)
+    for i in range(len(x)):
+        expected = pd.Series(x[i]).sort_values(ascending=False).index.to_numpy()
+        assert np.array_equal(order[i], expected), i
+    assert np.array_equal(argsort_descending(x.T, t_axis=0), order.T)
+
+
+def test_sorted_weight_ties_in_pandas_order():
+    # --- pandas puts later ties first for small arrays, which is not their original order
+    x = np.array([3, 2, 1, 3, 3], dtype=np.float64)
+    w = np.array([0.5, 0.3, 0.1, 0.0, -0.9])
+    expected = pd.Series(w, index=pd.Series(x).sort_values(ascending=False).index).sort_index().to_numpy()
+    assert np.array_equal(sorted_weight(x, w), expected)
+
+
+def test_masked_corr_of_1d_input():
+    x = np.array([1, 2, np.nan, 4, 3, 7, 5])
+    y = np.array([2, 1, 3, 5, np.nan, 6, 6])
+    df = pd.DataFrame({"x": x, "y": y})
+    assert masked_pearson(x, y) == pytest.approx(df.corr(method="pearson").at["x", "y"])
+    assert masked_spearman(x, y) == pytest.approx(df.corr(method="spearman").at["x", "y"])
+    assert np.isnan(masked_pearson(np.ones(4), np.arange(4.0)))
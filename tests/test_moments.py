@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+from engines.moments import rolling_mean, rolling_std, rolling_skew
+
+WINDOWS = [3, 5, 21, 63]
+
+
+def make_series(t_n: int, t_seed: int) -> np.ndarray:
+    rng = np.random.default_rng(t_seed)
+    return rng.standard_normal(t_n) * 0.02
+
+
+@pytest.mark.parametrize("non_finite", [
+    {},
+    {7: np.nan, 120: np.nan},
+    {250: np.inf},
+    {30: -np.inf, 300: np.inf, 400: np.nan},
+])
+def test_rolling_moments_same_as_pandas(non_finite: dict[int, float]):
+    x = make_series(500, 0)
+    for loc, v in non_finite.items():
+        x[loc] = v
+    x_srs = pd.Series(x)
+    for func, method in [(rolling_mean, "mean"), (rolling_std, "std"), (rolling_skew, "skew")]:
+        res = func(x, WINDOWS)
+        for j, w in enumerate(WINDOWS):
+            expected = getattr(x_srs.rolling(window=w), method)().to_numpy()
+            assert np.array_equal(np.isnan(res[:, j]), np.isnan(expected)), (method, w)
+            np.testing.assert_allclose(res[:, j], expected, rtol=1e-6, atol=1e-9, equal_nan=True,
+                                       err_msg="{}, window = {}".format(method, w))
+
+
+def test_rolling_moments_inf_only_affects_its_windows():
+    x = make_series(500, 1)
+    x[100] = np.inf
+    res = rolling_std(x, [10])[:, 0]
+    assert np.isnan(res[100:110]).all()
+    assert np.isfinite(res[9:100]).all() and np.isfinite(res[110:]).all()
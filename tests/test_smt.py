@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("rich")
+pytest.importorskip("skyrim")
+from algs.factor_exposure_smt import cal_smart  # noqa: E402
+
+LBDS = [0.2, 0.4, 0.6, 0.8]
+
+
+def cal_smart_by_pandas(t_sub_df: pd.DataFrame, t_sort_var: str, t_lbd: float):
+    # --- the pandas implementation replaced by cal_smart, kept as the reference
+    tot_vwap = t_sub_df["vwap"] @ t_sub_df["amount"] / t_sub_df["amount"].sum()
+    tot_ret = t_sub_df["m01_return_cls"] @ t_sub_df["amount"] / t_sub_df["amount"].sum()
+
+    _sorted_df = t_sub_df.sort_values(by=t_sort_var, ascending=False)
+    volume_threshold = _sorted_df["volume"].sum() * t_lbd
+    n = sum(_sorted_df["volume"].cumsum() < volume_threshold) + 1
+    smart_df = _sorted_df.head(n)
+    if (amt_sum := smart_df["amount"].sum()) > 0:
+        w = smart_df["amount"] / amt_sum
+        smart_p = smart_df["vwap"] @ w / tot_vwap - 1
+        smart_r = smart_df["m01_return_cls"] @ w - tot_ret
+        return -smart_p, -smart_r
+    else:
+        return 0, 0
+
+
+def make_minute_bars(t_n: int, t_seed: int, t_nan_bars: dict[str, list[int]]) -> pd.DataFrame:
+    rng = np.random.default_rng(t_seed)
+    volume = rng.integers(2, 500, t_n).astype(np.float64)
+    close = np.round(4000 * np.exp(np.cumsum(rng.standard_normal(t_n) * 1e-3)), 2)
+    preclose = np.concatenate([[close[0]], close[:-1]])
+    amount = volume * close * rng.uniform(0.999, 1.001, t_n)
+    df = pd.DataFrame({"volume": volume, "amount": amount, "close": close, "preclose": preclose})
+    for col, locs in t_nan_bars.items():
+        df.loc[locs, col] = np.nan
+    df["vwap"] = (df["amount"] / df["volume"]).ffill()
+    df["m01_return_cls"] = (df["close"] / df["preclose"] - 1).replace(np.inf, 0)
+    df["smart_idx"] = np.where(df["volume"] > 1, np.abs(df["m01_return_cls"]) / np.log(df["volume"]) * 1e4, 0)
+    return df
+
+
+@pytest.mark.parametrize("nan_bars", [
+    {},
+    {"volume": [3]},
+    {"volume": [0, 57, 199]},
+    {"amount": [11]},
+    {"volume": [80], "amount": [80]},
+    {"close": [120]},
+])
+def test_cal_smart_same_as_pandas(nan_bars: dict[str, list[int]]):
+    df = make_minute_bars(240, 0, nan_bars)
+    smart_p, smart_r = cal_smart(
+        t_vwap=df["vwap"].to_numpy(), t_ret=df["m01_return_cls"].to_numpy(),
+        t_volume=df["volume"].to_numpy(), t_amount=df["amount"].to_numpy(),
+        t_smart_idx=df["smart_idx"].to_numpy(), t_lbds=LBDS)
+    expected_p, expected_r = zip(*[cal_smart_by_pandas(df, "smart_idx", lbd) for lbd in LBDS])
+    np.testing.assert_allclose(smart_p, expected_p, rtol=1e-9, atol=1e-12, equal_nan=True)
+    np.testing.assert_allclose(smart_r, expected_r, rtol=1e-9, atol=1e-12, equal_nan=True)